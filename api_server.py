@@ -7,54 +7,96 @@
 # - Trace URL:       GET /trace/{session_id}
 # - Health check:    GET /health
 
-import re, os
+import re, os, sys
+import importlib
 import asyncio
 import logging
-import tempfile
-from typing import Optional
+from typing import Any, Callable, Optional
 from pathlib import Path
-from fastapi.responses import PlainTextResponse
-import requests
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse, StreamingResponse
+import httpx
+from fastapi import FastAPI, UploadFile, File, Form, Header
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from functools import lru_cache
+from functools import lru_cache, partial
 import time
 from threading import Lock
+from collections import OrderedDict
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 
 load_dotenv()  # 自动读取 .env
+os.environ["LG_ENV_LOADED"] = "1"  # scripts.api_core 据此跳过重复读取
 _lru_recent = {}  # {session_id: last_ts}
 # --- 日志 ---
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
 logger = logging.getLogger("dynamic-langgraph.api")
 
-_RUN_GUARD: dict[str, float] = {}
-_RUN_LOCK = Lock()
+# 同时运行的分析任务上限；超出的任务排队等待，避免线程池/内存被打满
+_ANALYZE_SEM = asyncio.Semaphore(int(os.getenv("ANALYZE_CONCURRENCY", "4")))
+_LIVE_TASKS: set[asyncio.Task] = set()
+
+# 默认线程池大小：asyncio.to_thread / run_in_executor(None, ...) 都走它。
+# 节点里同步的 llm.invoke、MinIO 上传等都是长时间 I/O 等待，默认的 cpu+4 个线程容易排队
+_DEFAULT_EXECUTOR_WORKERS = int(os.getenv("DEFAULT_EXECUTOR_WORKERS", str(min(32, (os.cpu_count() or 1) * 4))))
 
-def _run_key(session_id: str, file_path: str, query: str) -> str:
-    # 组合 key，避免只按 session_id 判断不准
-    digest = hashlib.md5(f"{file_path}|{query}".encode("utf-8")).hexdigest()[:16]
-    return f"{session_id}:{digest}"
+# /upload 内容去重：sha256(文件内容) -> 已上传的对象键（LRU）
+_UPLOAD_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_UPLOAD_CACHE_MAX = 1024
+_UPLOAD_CACHE_LOCK = Lock()
 
-def _recently_started(key: str, ttl: float = 10.0) -> bool:
-    now = time.time()
+# /ingest/openwebui 并发合并：(session_id, filename, prefer_ext) -> 进行中的结果 Future
+_INGEST_INFLIGHT: dict[tuple[str, str, str], asyncio.Future] = {}
+
+_RUN_GUARD: dict[tuple[str, str, str], float] = {}
+_RUN_LOCK = Lock()
+_GUARD_CALLS = 0
+_GUARD_SWEEP_SIZE = 512
+
+def _run_key(session_id: str, file_path: str, query: str) -> tuple[str, str, str]:
+    # 组合 key，避免只按 session_id 判断不准；进程内去重，直接用元组作 dict 键即可
+    return (session_id, file_path, query)
+
+def _upload_cache_get(digest: str) -> Optional[str]:
+    with _UPLOAD_CACHE_LOCK:
+        key = _UPLOAD_CACHE.get(digest)
+        if key is not None:
+            _UPLOAD_CACHE.move_to_end(digest)
+        return key
+
+def _upload_cache_put(digest: str, object_key: str) -> None:
+    with _UPLOAD_CACHE_LOCK:
+        _UPLOAD_CACHE[digest] = object_key
+        _UPLOAD_CACHE.move_to_end(digest)
+        while len(_UPLOAD_CACHE) > _UPLOAD_CACHE_MAX:
+            _UPLOAD_CACHE.popitem(last=False)
+
+def _recently_started(key: tuple[str, str, str], ttl: float = 10.0) -> bool:
+    global _GUARD_CALLS
+    now = time.monotonic()
     with _RUN_LOCK:
-        # 清理过期
-        for k, t in list(_RUN_GUARD.items()):
-            if now - t > ttl:
-                _RUN_GUARD.pop(k, None)
-        last = _RUN_GUARD.get(key, 0.0)
+        # 清理过期：摊销执行（每 256 次调用或表过大时才全量扫一遍），平时锁内只做 O(1) 查询
+        _GUARD_CALLS += 1
+        if (_GUARD_CALLS & 0xFF) == 0 or len(_RUN_GUARD) > _GUARD_SWEEP_SIZE:
+            for k, t in list(_RUN_GUARD.items()):
+                if now - t > ttl:
+                    _RUN_GUARD.pop(k, None)
+        last = _RUN_GUARD.get(key, float("-inf"))
         if now - last < ttl:
             return True
         _RUN_GUARD[key] = now
         return False
     
+_OWUI_PREFIX_RE = re.compile(r"^owui-")
+_UUID_PREFIX_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_(.+)$", re.I)
+# trace 增量轮询只用到单段 Range：bytes=N- 或 bytes=N-M
+_BYTE_RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
 def sid_core(session_id: str) -> str:
-    return re.sub(r"^owui-", "", session_id or "")
+    return _OWUI_PREFIX_RE.sub("", session_id or "")
 
 def strip_webui_uuid_prefix(name: str) -> str:
     """
@@ -62,41 +104,34 @@ def strip_webui_uuid_prefix(name: str) -> str:
     形如 'f922703e-e810-4f13-9bc2-49f6468f1604_ball501.txt' -> 'ball501.txt'
     """
     base = os.path.basename(name or "")
-    m = re.match(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_(.+)$", base, re.I)
+    m = _UUID_PREFIX_RE.match(base)
     return m.group(1) if m else base
 
-# --- MinIO 封装 ---
-try:
-    from minio_client import (
-        upload_file_to_minio,
-        download_file_from_minio,  # 未使用但保留
-        object_exists,  
-    )
-except Exception as e:
-    logger.warning("minio_client 未能完整导入：%s", e)
-    upload_file_to_minio = None
-    download_file_from_minio = None
-
-MINIO_BASE_URL = os.getenv("MINIO_BASE_URL", "").rstrip("/")
-MINIO_BUCKET = os.getenv("MINIO_BUCKET", "").strip()
-try:
-    from minio_client import MINIO_BASE_URL as _MBU  # type: ignore
-    if _MBU:
-        MINIO_BASE_URL = _MBU.rstrip("/")
-except Exception:
-    pass
-try:
-    from minio_client import MINIO_BUCKET as _MB  # type: ignore
-    if _MB:
-        MINIO_BUCKET = _MB.strip()
-except Exception:
-    pass
-
-# 可选：若在 minio_client 中实现了 get_trace_url(session_id)
-try:
-    from minio_client import get_trace_url as _get_trace_url  # type: ignore
-except Exception:
-    _get_trace_url = None
+# --- MinIO 封装（懒加载：首次访问时导入 minio_client 并缓存符号）---
+@lru_cache(maxsize=None)
+def _minio_attr(name: str) -> Any:
+    """
+    取 minio_client 中的符号；符号不存在时返回 None。
+    模块导入失败直接抛出（lru_cache 不缓存异常），下次访问会重新导入，一次偶发失败不会让 MinIO 整个进程失效。
+    """
+    mod = sys.modules.get("minio_client") or importlib.import_module("minio_client")
+    return getattr(mod, name, None)
+
+def _minio_setting(name: str) -> str:
+    """MINIO_BASE_URL / MINIO_BUCKET：优先 minio_client 里的值，导入不了时退回环境变量（用时再取，不在导入时解析）。"""
+    try:
+        value = _minio_attr(name)
+    except Exception as e:
+        logger.warning("minio_client 未能导入：%s", e)
+        value = None
+    return (value or os.getenv(name, "")).strip().rstrip("/")
+
+def _minio(name: str) -> Callable[..., Any]:
+    """取 minio_client 中的函数；缺失时抛 RuntimeError，由各路由的异常分支统一转成错误响应。"""
+    fn = _minio_attr(name)
+    if fn is None:
+        raise RuntimeError(f"minio_client.{name} 未定义，请检查 minio_client.py")
+    return fn
 
 # 事件记录 & SSE
 from scripts.recorder import stream_event_generator, record_step
@@ -115,7 +150,7 @@ logger.info(f"[Ingest] OPENWEBUI_DATA_DIR={OPENWEBUI_DATA_DIR}")
 logger.info(f"[Ingest] OPENWEBUI_UPLOADS={OPENWEBUI_UPLOADS}")
 
 # --- FastAPI ---
-app = FastAPI(title="Dynamic-LangGraph Service", version="2.2.0")
+app = FastAPI(title="Dynamic-LangGraph Service", version="2.2.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -125,6 +160,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def _on_startup() -> None:
+    # 事件循环本身由 uvicorn 决定：装了 uvloop（uvicorn[standard] 自带）时 --loop auto 即用 uvloop
+    loop = asyncio.get_running_loop()
+    app.state.executor = ThreadPoolExecutor(max_workers=_DEFAULT_EXECUTOR_WORKERS, thread_name_prefix="dlg")
+    loop.set_default_executor(app.state.executor)
+    logger.info("event loop=%s, default executor workers=%d", type(loop).__module__, _DEFAULT_EXECUTOR_WORKERS)
+    # 共享的异步 HTTP 客户端（/trace 直链回退用），避免同步 requests 阻塞事件循环
+    app.state.http = httpx.AsyncClient(timeout=60)
+    # 预热 case.json 模板缓存，首个 /analyze 不再现读现解析
+    try:
+        from dynamic_langgraph.case_loader import load_case_templates
+        await asyncio.to_thread(load_case_templates)
+    except Exception as e:
+        logger.warning("预加载 case.json 失败：%s", e)
+
+@app.on_event("shutdown")
+async def _on_shutdown() -> None:
+    # 取消仍在跑的分析任务并等它们收尾（各自的 finally 会记 end 事件、删临时文件）
+    tasks = list(_LIVE_TASKS)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await app.state.http.aclose()
+    # aioboto3 客户端（用过异步上传时才存在）；minio_client 没导入过就不必为关停去导入它
+    mc = sys.modules.get("minio_client")
+    if mc is not None:
+        await mc.aclose_aclient()
+    app.state.executor.shutdown(wait=False, cancel_futures=True)
+
 # ================= 数据模型 =================
 class AnalyzeIn(BaseModel):
     file_path: str = Field(..., description="MinIO 对象键或后端可访问的绝对路径，如 uploaded/123abc_xxx.txt")
@@ -144,25 +209,45 @@ class IngestIn(BaseModel):
 
 # ================= 工具函数 =================
 def _compose_trace_url(session_id: str) -> Optional[str]:
-    """生成 trace/{session_id}.jsonl 的可访问 URL。"""
-    if _get_trace_url:
-        try:
-            url = _get_trace_url(session_id)  # type: ignore
+    """
+    生成 trace/{session_id}.jsonl 的可访问 URL。
+    配置了 MINIO_BASE_URL 时是确定的公开直链，按 session_id 缓存；
+    否则可能是会过期的预签名 URL，每次现算。
+    """
+    if _minio_setting("MINIO_BASE_URL"):
+        return _cached_trace_url(session_id)
+    return _build_trace_url(session_id)
+
+@lru_cache(maxsize=4096)
+def _cached_trace_url(session_id: str) -> Optional[str]:
+    return _build_trace_url(session_id)
+
+def _build_trace_url(session_id: str) -> Optional[str]:
+    # 可选：若在 minio_client 中实现了 get_trace_url(session_id)
+    try:
+        get_trace_url = _minio_attr("get_trace_url")
+        if get_trace_url:
+            url = get_trace_url(session_id)
             if url:
                 return url
-        except Exception as e:
-            logger.warning("minio_client.get_trace_url 调用失败，降级拼接：%s", e)
-    if MINIO_BASE_URL and MINIO_BUCKET:
-        return f"{MINIO_BASE_URL}/{MINIO_BUCKET}/trace/{session_id}.jsonl"
+    except Exception as e:
+        logger.warning("minio_client.get_trace_url 调用失败，降级拼接：%s", e)
+    base_url, bucket = _minio_setting("MINIO_BASE_URL"), _minio_setting("MINIO_BUCKET")
+    if base_url and bucket:
+        return f"{base_url}/{bucket}/trace/{session_id}.jsonl"
     return None
 
 async def _run_analyze_background(file_path: str, query: str, session_id: str) -> None:
-    """后台运行 analyze_with_streaming_path。异常时推送 error 事件。"""
+    """后台运行 analyze_with_streaming_path（受 _ANALYZE_SEM 限流）。异常时推送 error 事件。"""
     try:
-        if asyncio.iscoroutinefunction(analyze_with_streaming_path):
-            await analyze_with_streaming_path(file_path=file_path, query=query, session_id=session_id)
-        else:
-            await asyncio.to_thread(analyze_with_streaming_path, file_path=file_path, query=query, session_id=session_id)
+        async with _ANALYZE_SEM:
+            if asyncio.iscoroutinefunction(analyze_with_streaming_path):
+                await analyze_with_streaming_path(file_path=file_path, query=query, session_id=session_id)
+            else:
+                # 无需传播 contextvars：run_in_executor 省去 to_thread 的 copy_context()
+                await asyncio.get_running_loop().run_in_executor(
+                    None, partial(analyze_with_streaming_path, file_path=file_path, query=query, session_id=session_id)
+                )
     except Exception as e:
         logger.exception("analyze 后台任务异常：%s", e)
         try:
@@ -176,8 +261,50 @@ async def _run_analyze_background(file_path: str, query: str, session_id: str) -
         except Exception:
             pass
 
-def _pick_latest(paths):
-    return max(paths, key=lambda p: p.stat().st_mtime) if paths else None
+# 快照最长复用秒数：原地重写文件、或同一 mtime 刻度内连续新建时目录 mtime 不变，靠它兜底
+_UPLOADS_SNAPSHOT_TTL = float(os.getenv("UPLOADS_SNAPSHOT_TTL", "2"))
+
+@lru_cache(maxsize=4)
+def _uploads_snapshot(dir_mtime_ns: int, ttl_slot: int) -> tuple[tuple[float, str], ...]:
+    """
+    uploads/ 下普通文件的快照：((mtime, 文件名), ...)，按 mtime 降序。
+    以 (目录自身的 mtime_ns, 时间片) 为缓存键：目录内增删/改名文件时立即失效，
+    目录 mtime 看不出来的改动（原地重写、同刻度内多次新建）最多旧 _UPLOADS_SNAPSHOT_TTL 秒。
+    """
+    with os.scandir(OPENWEBUI_UPLOADS) as it:
+        entries = [(e.stat().st_mtime, e.name) for e in it if e.is_file()]
+    entries.sort(reverse=True)
+    return tuple(entries)
+
+def _list_uploads() -> tuple[tuple[float, str], ...]:
+    try:
+        ttl_slot = int(time.monotonic() / _UPLOADS_SNAPSHOT_TTL) if _UPLOADS_SNAPSHOT_TTL > 0 else 0
+        return _uploads_snapshot(OPENWEBUI_UPLOADS.stat().st_mtime_ns, ttl_slot)
+    except FileNotFoundError:
+        return ()
+
+def _store_upload(f, length: int, object_key: str, content_type: Optional[str]) -> str:
+    """
+    /upload 的同步主体，整体放进一次 to_thread（粗粒度，少几次线程往返）：
+    流式算 sha256 → 相同内容近期已上传且对象仍在则服务端复制到本次的对象键（不再经过本机上传）
+    → 否则流式 put_object。始终返回本次请求的对象键：别的会话的键可能随它的清理被删掉。
+    """
+    digest = hashlib.file_digest(f, "sha256").hexdigest()
+    f.seek(0)
+    cached_key = _upload_cache_get(digest)
+    if cached_key:
+        try:
+            if _minio("object_exists")(cached_key):
+                if cached_key != object_key:
+                    _minio("copy_object_in_minio")(cached_key, object_key)
+                logger.info("Upload dedup hit: %s -> %s", cached_key, object_key)
+                _upload_cache_put(digest, object_key)
+                return object_key
+        except Exception as e:
+            logger.warning("Upload dedup 复用失败，改为直接上传：%s", e)
+    _minio("stream_upload_to_minio")(f, length, object_key, content_type)
+    _upload_cache_put(digest, object_key)
+    return object_key
 
 # ================= 路由 =================
 @app.get("/health")
@@ -191,29 +318,17 @@ async def upload(
     session_id: str = Form(..., description="会话ID，前后端一致"),
 ):
     """直接接收前端文件并上传 MinIO（multipart 表单）。"""
-    if not upload_file_to_minio:
-        return JSONResponse(status_code=500, content={"detail": "upload_file_to_minio 未定义，请检查 minio_client.py"})
-
-    safe_name = strip_webui_uuid_prefix(safe_name)
+    safe_name = strip_webui_uuid_prefix(file.filename or "upload.bin")
     object_key = f"uploaded/{sid_core(session_id)}_{safe_name}"
 
-
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp_path = tmp.name
-        content = await file.read()
-        tmp.write(content)
-
+    # UploadFile.file 本身就是 SpooledTemporaryFile：直接流式 put_object，不再中转临时文件
+    length = file.size if file.size is not None else -1
     try:
-        upload_file_to_minio(tmp_path, object_key)
+        object_key = await asyncio.to_thread(_store_upload, file.file, length, object_key, file.content_type)
         logger.info("Uploaded to MinIO: %s", object_key)
     except Exception as e:
         logger.exception("上传 MinIO 失败：%s", e)
         return JSONResponse(status_code=500, content={"detail": f"上传失败: {e}"})
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
 
     return {"file_path": object_key, "query": query, "session_id": session_id}
 
@@ -225,11 +340,32 @@ async def ingest_from_openwebui(payload: IngestIn):
     - filename 省略：在 uploads/ 中自动选择“最新修改”的文件；若提供 prefer_ext，则优先按扩展名筛选后再取最新
     - 目标对象键：uploaded/{session_id}_{源文件名}
     - 幂等：若对象已存在，直接复用（不重复上传）
+    - 合并：同一 (session_id, filename, prefer_ext) 的并发请求只执行一次，其余等待同一结果
     """
+    key = (payload.session_id, payload.filename or "", payload.prefer_ext or "")
+    inflight = _INGEST_INFLIGHT.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    fut = asyncio.get_running_loop().create_future()
+    _INGEST_INFLIGHT[key] = fut
+    try:
+        resp = await _ingest_from_openwebui(payload)
+        fut.set_result(resp)
+        return resp
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # 标记已取回，无人等待时不告警
+        raise
+    finally:
+        _INGEST_INFLIGHT.pop(key, None)
+
+async def _ingest_from_openwebui(payload: IngestIn):
     if not payload.session_id:
         return JSONResponse(status_code=400, content={"ok": False, "msg": "session_id required"})
-    if not upload_file_to_minio:
-        return JSONResponse(status_code=500, content={"ok": False, "msg": "upload_file_to_minio 未定义"})
 
     src: Optional[Path] = None
 
@@ -240,18 +376,17 @@ async def ingest_from_openwebui(payload: IngestIn):
             requested.relative_to(OPENWEBUI_UPLOADS)
         except Exception:
             return JSONResponse(status_code=400, content={"ok": False, "msg": "invalid filename scope"})
-        if requested.exists() and requested.is_file():
+        if requested.is_file():  # is_file 已隐含 exists，只需一次 stat
             src = requested
         else:
-            import glob
-            pattern = str(OPENWEBUI_UPLOADS / f"*_{payload.filename}")
-            matches = [Path(p) for p in glob.glob(pattern)]
-            matches = [p for p in matches if p.is_file()]
-            src = _pick_latest(matches)
+            # 同一份按 mtime 降序的 scandir 快照上做后缀匹配，首个命中即最新
+            suffix = f"_{payload.filename}"
+            name = next((n for _, n in _list_uploads() if n.endswith(suffix)), None)
+            src = OPENWEBUI_UPLOADS / name if name else None
     else:
         # B) filename 省略：自动挑 uploads/ 最新文件；若设置 prefer_ext 则先筛扩展名
-        files = [p for p in OPENWEBUI_UPLOADS.iterdir() if p.is_file()]
-        if not files:
+        entries = _list_uploads()
+        if not entries:
             return JSONResponse(
                 status_code=404,
                 content={
@@ -260,12 +395,12 @@ async def ingest_from_openwebui(payload: IngestIn):
                     "hint": "确认 DATA_DIR/OPENWEBUI_DATA_DIR & 已上传文件",
                 },
             )
+        # 快照已按 mtime 降序：首个即整体最新；有 prefer_ext 时一次扫描取首个匹配，命不中再退回整体最新
+        name = entries[0][1]
         if payload.prefer_ext:
-            ext = payload.prefer_ext.lower().lstrip(".")
-            prefer = [p for p in files if p.suffix.lower().lstrip(".") == ext]
-            src = _pick_latest(prefer) or _pick_latest(files)
-        else:
-            src = _pick_latest(files)
+            ext = "." + payload.prefer_ext.lower().lstrip(".")
+            name = next((n for _, n in entries if n.lower().endswith(ext)), name)
+        src = OPENWEBUI_UPLOADS / name
 
     if not src:
         return JSONResponse(
@@ -279,24 +414,23 @@ async def ingest_from_openwebui(payload: IngestIn):
 
     # ✅ 幂等：若对象已存在，直接复用，不重复上传
     try:
-        from minio_client import object_exists  # 延迟导入，避免顶部依赖顺序问题
-        if object_exists(object_key):
+        if await asyncio.to_thread(_minio("object_exists"), object_key):
             return {
                 "ok": True,
-                "bucket": MINIO_BUCKET or os.getenv("MINIO_BUCKET", ""),
+                "bucket": _minio_setting("MINIO_BUCKET"),
                 "object": object_key,
                 "source": src.name,
                 "exists": True,
             }
     except Exception:
-        # 若匿名策略不允许 stat，忽略检查，继续尝试上传（SDK 会覆盖/或直接成功）
+        # 若匿名策略不允许 stat（或 minio_client 未提供 object_exists），忽略检查，继续尝试上传
         pass
 
     try:
-        upload_file_to_minio(str(src), object_key)
+        await asyncio.to_thread(_minio("upload_file_to_minio"), str(src), object_key)
         return {
             "ok": True,
-            "bucket": MINIO_BUCKET or os.getenv("MINIO_BUCKET", ""),
+            "bucket": _minio_setting("MINIO_BUCKET"),
             "object": object_key,
             "source": src.name,
             "exists": False,
@@ -312,11 +446,15 @@ async def analyze(payload: AnalyzeIn):
     if _recently_started(key, ttl=60.0):  # 60 秒内重复触发直接忽略
         return {"code": 0, "msg": "duplicate_ignored", "session_id": payload.session_id}
 
-    asyncio.create_task(_run_analyze_background(
+    task = asyncio.create_task(_run_analyze_background(
         file_path=payload.file_path,
         query=payload.query,
         session_id=payload.session_id,
     ))
+    # 登记在运行的任务（持有强引用，不会被 GC 静默回收），关停时逐个取消；结束后自动移除。
+    # 不用应用级 TaskGroup：一个任务里漏出的 BaseException 会让整个组失效，之后的 /analyze 全部起不来
+    _LIVE_TASKS.add(task)
+    task.add_done_callback(_LIVE_TASKS.discard)
     return {"code": 0, "msg": "started", "session_id": payload.session_id}
 
 
@@ -336,33 +474,44 @@ async def stream(session_id: str):
     return StreamingResponse(generator, media_type="text/event-stream", headers=headers)
 
 @app.get("/trace/{session_id}")
-async def get_trace_url(session_id: str, raw: int = 0):
+async def get_trace_url(session_id: str, raw: int = 0, range_header: Optional[str] = Header(None, alias="Range")):
     """
     返回：
       - raw=0（默认）：{"session_id": "...", "trace_url": "<可访问URL>"}  —— 兼容旧用法
       - raw=1：直接把 trace jsonl 原文返回（由后端代为读取 MinIO），避免容器访问直链失败
+        支持 Range: bytes=N-[M]，只回传新增的那一段（206），供客户端按偏移增量轮询
     """
     object_key = f"trace/{session_id}.jsonl"
 
-    # raw 模式：尝试通过 SDK 直接读；若没有 download_file_from_minio，则回退用直链 GET
+    # raw 模式：尝试通过 SDK 流式读取；失败（含 minio_client 不可用）则回退用直链 GET
     if raw == 1:
-        # 优先 SDK
-        if download_file_from_minio:
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                tmp_path = tmp.name
-            try:
-                download_file_from_minio(object_key, tmp_path)
-                txt = Path(tmp_path).read_text(encoding="utf-8")
-                return PlainTextResponse(txt, media_type="text/plain; charset=utf-8")
-            except Exception as e:
-                logger.warning("trace SDK 读取失败，将回退直链：%s", e)
-            finally:
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
-
-        # 回退直链
+        m = _BYTE_RANGE_RE.match(range_header.strip()) if range_header else None
+        offset = int(m.group(1)) if m else 0
+        length = (int(m.group(2)) - offset + 1) if m and m.group(2) else 0
+        if length < 0:
+            offset = length = 0
+        ranged = bool(offset or length)
+        # 优先 SDK：边读边回传，不经临时文件
+        try:
+            if not ranged:
+                body = await asyncio.to_thread(_minio("stream_object_from_minio"), object_key)
+                return StreamingResponse(body, media_type="text/plain; charset=utf-8")
+            body, content_range = await asyncio.to_thread(
+                _minio("stream_object_range_from_minio"), object_key, offset, length
+            )
+            if body is None:
+                # 偏移已到末尾：没有新内容，直接 416，不再回退直链多走一趟
+                return Response(status_code=416, headers={"Content-Range": content_range})
+            return StreamingResponse(
+                body,
+                status_code=206,
+                media_type="text/plain; charset=utf-8",
+                headers={"Content-Range": content_range},
+            )
+        except Exception as e:
+            logger.warning("trace SDK 读取失败，将回退直链：%s", e)
+
+        # 回退直链（Range 原样转给 MinIO，416 等状态码透传给客户端）
         url = _compose_trace_url(session_id)
         if not url:
             return JSONResponse(
@@ -370,9 +519,21 @@ async def get_trace_url(session_id: str, raw: int = 0):
                 content={"detail": "无法拼出 Trace 直链，请配置 MINIO_BASE_URL 与 MINIO_BUCKET"},
             )
         try:
-            r = requests.get(url, timeout=60)
-            if r.status_code == 200:
-                return PlainTextResponse(r.text, media_type="text/plain; charset=utf-8")
+            http: httpx.AsyncClient = app.state.http
+            headers = {"Range": range_header} if m else None
+            r = await http.send(http.build_request("GET", url, headers=headers), stream=True)
+            passthrough = {"Content-Range": r.headers["Content-Range"]} if "Content-Range" in r.headers else None
+            if r.status_code in (200, 206):
+                return StreamingResponse(
+                    r.aiter_bytes(),
+                    status_code=r.status_code,
+                    media_type="text/plain; charset=utf-8",
+                    headers=passthrough,
+                    background=BackgroundTask(r.aclose),
+                )
+            await r.aclose()
+            if r.status_code == 416:
+                return Response(status_code=416, headers=passthrough)
             return JSONResponse(status_code=r.status_code, content={"detail": f"get trace via url failed: HTTP {r.status_code}"})
         except Exception as e:
             return JSONResponse(status_code=502, content={"detail": f"fetch trace url error: {e}"})
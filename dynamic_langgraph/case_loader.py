@@ -2,55 +2,97 @@
 # ============================================================================
 # Imports
 # ============================================================================
-import json
 import logging
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional, Any
 
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+import orjson
+from langchain_core.messages import SystemMessage, AIMessage
 
 from .llms import llm_planner
 from .config import CASE_PATH, DEFAULT_TASK_FLOW
+from .utils import invoke_plan_cached
 from .tools.task_selector import choose_tasks  # 现版仅需数字序号
-# from dynamic_langgraph.utils import debug_ai_message  # 如需调试可启用
 # ============================================================================
 
 logger = logging.getLogger("dynamic-langgraph.case_loader")
 
+_THINK_RE = re.compile(r"<think>.*?</think>", re.I | re.S)
+_DIGIT_RE = re.compile(r"\d+")
+
 
 # ----------------------------------------------------------------------------
 # 读取 case.json
 # ----------------------------------------------------------------------------
+# path -> ((st_mtime_ns, st_size), 解析结果)；文件未改动时直接复用，不重复读盘/解析。
+# 这是 case.json 唯一的缓存：planner 的提示词和 choose_tasks 都从这里取，不会对模板列表各执一词
+_CASE_CACHE: Dict[Path, Tuple[Tuple[int, int], List[Dict[str, Any]]]] = {}
+
+
 def load_case_templates(path: Path = CASE_PATH) -> List[Dict[str, Any]]:
     """
     加载模板；若文件缺失则返回空列表，后续走默认流程。
+    结果按文件 (mtime_ns, size) 缓存，case.json 改动后下次调用自动重新加载
+    （加上大小，同一 mtime 刻度内的连续改写也能识别）。
     每个模板建议包含：
       - description: 对应流程模板的一句话描述
       - 其他字段由 choose_tasks 决定是否使用
     """
-    if not path.exists():
+    try:
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
         logger.warning("case.json not found → fallback to default flow.")
         return []
-    with path.open("r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-            if not isinstance(data, list):
-                logger.warning("case.json 格式异常（非 list），将忽略并使用默认流程")
-                return []
-            return data
-        except Exception as e:
-            logger.warning("读取 case.json 失败（%s），将忽略并使用默认流程", e)
-            return []
+
+    cached = _CASE_CACHE.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        data = orjson.loads(path.read_bytes())
+        if not isinstance(data, list):
+            logger.warning("case.json 格式异常（非 list），将忽略并使用默认流程")
+            data = []
+    except Exception as e:
+        logger.warning("读取 case.json 失败（%s），将忽略并使用默认流程", e)
+        data = []
+    _CASE_CACHE[path] = (stamp, data)
+    return data
 
 
 # ----------------------------------------------------------------------------
 # 选模板序号 → choose_tasks(index) → tasks 列表
 # ----------------------------------------------------------------------------
-async def llm_pick_tasks(user_input: str, cases: List[Dict[str, Any]]) -> Tuple[List[Any], Optional[AIMessage]]:
+@lru_cache(maxsize=8)
+def _build_sys_prompt(descriptions: Tuple[str, ...]) -> SystemMessage:
+    """按模板描述生成 planner 的 system 消息；case.json 不变时直接复用缓存。"""
+    template_lines = [f"{idx}. {desc}" for idx, desc in enumerate(descriptions, 1)]
+    return SystemMessage(content=(
+        "你是流程规划助手。\n"
+        "任务：根据【用户需求】从下列模板中选出最合适的一项。\n"
+        "要求：只输出对应的数字序号（如 2），不要添加解释或其他文字。\n"
+        "若没有任何模板合适，请输出 NONE。\n\n"
+        "候选模板：\n" + "\n".join(template_lines)
+    ))
+
+
+def _has_index(ai: AIMessage) -> bool:
+    """planner 回复里能抓到序号才缓存；NONE / 乱答不缓存，下次仍重新询问。"""
+    return bool(_DIGIT_RE.search(_THINK_RE.sub("", ai.content or "")))
+
+
+async def llm_pick_tasks(
+    user_input: str,
+    cases: List[Dict[str, Any]],
+    use_cache: bool = True,
+) -> Tuple[List[Any], Optional[AIMessage]]:
     """
     让 LLM 根据【用户需求】从模板中选出最合适的一项（仅输出数字序号或 NONE）；
-    然后把数字传给 choose_tasks.invoke(index)，得到最终任务列表。
+    然后把数字传给 choose_tasks.ainvoke(index)，得到最终任务列表。
+    相同（模板集合, 用户需求）的选择结果经 invoke_plan_cached 复用，不重复询问 LLM。
 
     返回: (tasks, ai_msg)
       - tasks: List[...]（供 build_graph 使用）
@@ -61,31 +103,25 @@ async def llm_pick_tasks(user_input: str, cases: List[Dict[str, Any]]) -> Tuple[
         return DEFAULT_TASK_FLOW, None
 
     # ---------- 1) 构造给 LLM 的 prompt ----------
-    template_lines = [
-        f"{idx}. {c.get('description', '').strip()}"
-        for idx, c in enumerate(cases, 1)
-    ]
-    sys_prompt = (
-        "你是流程规划助手。\n"
-        "任务：根据【用户需求】从下列模板中选出最合适的一项。\n"
-        "要求：只输出对应的数字序号（如 2），不要添加解释或其他文字。\n"
-        "若没有任何模板合适，请输出 NONE。\n\n"
-        "候选模板：\n" + "\n".join(template_lines)
-    )
+    sys_msg = _build_sys_prompt(tuple(c.get("description", "").strip() for c in cases))
 
     try:
-        ai_msg: AIMessage = await llm_planner.ainvoke([
-            SystemMessage(content=sys_prompt),
-            HumanMessage(content=f"用户需求：{user_input}"),
-        ])
-        # debug_ai_message(ai_msg)  # 如需调试解开
+        ai_msg: AIMessage = await invoke_plan_cached(
+            llm_planner,
+            f"用户需求：{user_input}",
+            namespace="planner",
+            system=sys_msg,
+            use_cache=use_cache,
+            accept=_has_index,
+        )
+        logger.debug("planner_raw=%s", ai_msg.content)
     except Exception as e:
         logger.warning("llm_planner 调用失败（%s）→ 使用默认流程", e)
         return DEFAULT_TASK_FLOW, None
 
     raw = (ai_msg.content or "").strip()
     # 去掉 <think> ... </think> 段落 & 外层引号
-    raw = re.sub(r"<think>.*?</think>", "", raw, flags=re.I | re.S).strip()
+    raw = _THINK_RE.sub("", raw).strip()
     raw = raw.strip('＂"“”\'').strip()
 
     if not raw or raw.upper() == "NONE":
@@ -93,7 +129,7 @@ async def llm_pick_tasks(user_input: str, cases: List[Dict[str, Any]]) -> Tuple[
         return DEFAULT_TASK_FLOW, ai_msg
 
     # ---------- 2) 抓首个数字，并做边界检查 ----------
-    m = re.search(r"\d+", raw)
+    m = _DIGIT_RE.search(raw)
     if not m:
         logger.warning("无法从输出 '%s' 提取数字 → 默认流程", raw)
         return DEFAULT_TASK_FLOW, ai_msg
@@ -108,11 +144,11 @@ async def llm_pick_tasks(user_input: str, cases: List[Dict[str, Any]]) -> Tuple[
 
     # ---------- 3) 交给 choose_tasks(index) ----------
     try:
-        selection = choose_tasks.invoke(index_str)
+        selection = await choose_tasks.ainvoke(index_str)
         # 兼容：若工具返回 JSON 字符串，尝试解析；否则直接用
         if isinstance(selection, str):
             try:
-                parsed = json.loads(selection)
+                parsed = orjson.loads(selection)
             except Exception:
                 parsed = selection
         else:
@@ -130,5 +166,5 @@ async def llm_pick_tasks(user_input: str, cases: List[Dict[str, Any]]) -> Tuple[
         return tasks, ai_msg
 
     except Exception as e:
-        logger.warning("choose_tasks.invoke 失败（%s）→ 默认流程", e)
+        logger.warning("choose_tasks.ainvoke 失败（%s）→ 默认流程", e)
         return DEFAULT_TASK_FLOW, ai_msg
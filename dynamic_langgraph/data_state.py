@@ -11,6 +11,7 @@ class DataState:
     path: Path
     user_input: str
     session_id: Optional[str] = "default"
+    no_cache: bool = False          # True 时跳过 LLM 工具规划缓存
 
     # loader
     loaded: bool = False
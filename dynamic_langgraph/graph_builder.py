@@ -1,10 +1,12 @@
 # dynamic_langgraph/graph_builder.py
 """
-Assemble a LangGraph StateGraph *and* auto-export a PNG flowchart
-to ./graphs/flow_<timestamp>_<uid>.png.
+Assemble a LangGraph StateGraph (cached per task sequence), expose its
+Mermaid source, and render the flowchart PNG on demand.
 """
+from functools import lru_cache
 from pathlib import Path
-import datetime, uuid, logging
+import hashlib, os
+from types import MappingProxyType
 from langgraph.graph import StateGraph
 from .data_state import DataState
 from .nodes.loader import loader
@@ -16,12 +18,11 @@ from .nodes.markdown_convert import markdown_convert
 from .nodes.md_summarizer    import md_summarizer
 from .nodes.asr_convert     import asr_convert
 from .nodes.audio_summarizer     import audio_summarizer
-import inspect
 # ─────────────────────────────────────────────────────────
 # 映射 task_name → 节点函数
 # ※ 以后新增节点记得在此添加
 # ─────────────────────────────────────────────────────────
-_TASK_NODE_MAP = {
+_TASK_NODE_MAP = MappingProxyType({
     "analysis":   analysis,
     "viz":        viz,
     "diagnosis":  diagnosis,
@@ -30,12 +31,17 @@ _TASK_NODE_MAP = {
     "md_summary": md_summarizer,
     "asr": asr_convert,
     "audio_summary": audio_summarizer, 
-}
+})
+_VALID_TASKS = frozenset(_TASK_NODE_MAP)
+
+# 可选：流程图 PNG 的磁盘缓存目录（跨进程复用，避免重启后重新渲染）
+_GRAPH_CACHE_DIR = os.getenv("DLG_GRAPH_CACHE_DIR")
+
 
 def build_graph(task_list):
     """
-    按 task_list 顺序构建 *串行* LangGraph，
-    并将流程图保存到 graphs/flow_<timestamp>_<uid>.png。
+    按 task_list 顺序构建 *串行* LangGraph。
+    编译结果只取决于任务序列，按 tuple(task_list) 缓存复用。
 
     Parameters
     ----------
@@ -46,6 +52,66 @@ def build_graph(task_list):
     -------
     compiled : langgraph.graph.CompiledGraph
     """
+    return _build_cached(tuple(task_list))
+
+
+def graph_mermaid(task_list) -> str:
+    """
+    返回 task_list 对应流程图的 Mermaid 源码。
+    纯本地生成、无网络请求，按任务序列缓存。
+    """
+    return _mermaid_cached(tuple(task_list))
+
+
+def graph_png(task_list) -> bytes:
+    """
+    返回 task_list 对应流程图的 PNG 字节（Mermaid 渲染）。
+    进程内按任务序列缓存；设置 DLG_GRAPH_CACHE_DIR 时另落盘（按 Mermaid 源码哈希命名，
+    源码相同的任务序列共用一张图），重启后也不必重新渲染。
+    """
+    return _graph_png_cached(tuple(task_list))
+
+
+def mermaid_digest(mermaid: str) -> str:
+    """Mermaid 源码的短哈希，用作 .mmd / .png 缓存文件名。"""
+    return hashlib.sha1(mermaid.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _mermaid_cached(tasks: tuple) -> str:
+    return _build_cached(tasks).get_graph(xray=True).draw_mermaid()
+
+
+@lru_cache(maxsize=64)
+def _graph_png_cached(tasks: tuple) -> bytes:
+    mermaid = _mermaid_cached(tasks)
+    cache_file = None
+    if _GRAPH_CACHE_DIR:
+        cache_dir = Path(_GRAPH_CACHE_DIR)
+        digest = mermaid_digest(mermaid)
+        cache_file = cache_dir / f"flow_{digest}.png"
+        if cache_file.exists():
+            return cache_file.read_bytes()
+        # 同时留一份源码，scripts/render_mermaid.py 可离线批量渲染
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        mmd_file = cache_dir / f"flow_{digest}.mmd"
+        if not mmd_file.exists():
+            mmd_file.write_text(mermaid, encoding="utf-8")
+
+    from langchain_core.runnables.graph_mermaid import draw_mermaid_png
+    png_bytes = draw_mermaid_png(mermaid)
+
+    if cache_file is not None:
+        cache_file.write_bytes(png_bytes)
+    return png_bytes
+
+
+@lru_cache(maxsize=64)
+def _build_cached(task_list: tuple):
+    # 先整体校验，避免图建到一半才因未知任务报错
+    bad = set(task_list) - _VALID_TASKS
+    if bad:
+        raise ValueError(f"Unknown task name: {', '.join(sorted(bad))}")
 
     G = StateGraph(DataState)
     # ① loader 入口 ------------------------------------------------------------
@@ -54,8 +120,6 @@ def build_graph(task_list):
 
     # ② 逐任务串联 -------------------------------------------------------------
     for t in task_list:
-        if t not in _TASK_NODE_MAP:
-            raise ValueError(f"Unknown task name: {t}")
         G.add_node(t, _TASK_NODE_MAP[t])
         G.add_edge(prev, t)
         prev = t                      # 往下接链
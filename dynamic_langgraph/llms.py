@@ -1,14 +1,36 @@
 """Instantiate shared LLM objects and their tool bindings."""
+import httpx
+from functools import lru_cache
 from langchain_ollama import ChatOllama
 from langchain_openai import ChatOpenAI
-from .tools.stats_tools import calc_mean, calc_std, calc_var
+from .tools.stats_tools import calc_mean, calc_std, calc_var, calc_stats
 from .tools.viz_tools import time_plot, freq_plot
 from .tools.diagnosis_tools import diagnose_signal
 from .tools.task_selector import choose_tasks
 
-llm_main = ChatOllama(model="qwen3:32b", temperature=0.1)
-llm_multimod = ChatOllama(model="qwen2.5vl:32b", temperature=0.1)
-llm_analysis  = llm_main.bind_tools([calc_mean, calc_var, calc_std])
+# Ollama 的 HTTP 连接池：保持 keep-alive，避免每次调用重新握手
+_OLLAMA_CLIENT_KWARGS = {"limits": httpx.Limits(max_keepalive_connections=16)}
+
+llm_main = ChatOllama(model="qwen3:32b", temperature=0.1, client_kwargs=_OLLAMA_CLIENT_KWARGS)
+llm_analysis  = llm_main.bind_tools([calc_stats, calc_mean, calc_var, calc_std])
 llm_viz       = llm_main.bind_tools([time_plot, freq_plot])
 llm_diagnosis = llm_main.bind_tools([diagnose_signal])
-llm_planner   = llm_main
\ No newline at end of file
+llm_planner   = llm_main
+
+
+@lru_cache(maxsize=1)
+def get_llm_multimod() -> ChatOllama:
+    """多模态模型只有 viz 节点用到，首次调用时再创建。"""
+    llm = ChatOllama(model="qwen2.5vl:32b", temperature=0.1, client_kwargs=_OLLAMA_CLIENT_KWARGS)
+    # bind_tools 返回的包装对象本就复用 llm_main 的客户端；多模态实例也改用同一个连接池
+    for attr in ("_client", "_async_client"):
+        if getattr(llm_main, attr, None) is not None:
+            setattr(llm, attr, getattr(llm_main, attr))
+    return llm
+
+
+def __getattr__(name: str):
+    # 兼容旧的 `from dynamic_langgraph.llms import llm_multimod`
+    if name == "llm_multimod":
+        return get_llm_multimod()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
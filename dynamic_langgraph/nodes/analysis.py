@@ -1,29 +1,38 @@
 # dynamic_langgraph/nodes/analysis.py
-import json
+import orjson
 import asyncio
-from typing import AsyncGenerator, Dict, Any
+from typing import AsyncGenerator, Dict, Any, List
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import AIMessage, SystemMessage
 
 from ..data_state import DataState
 from ..llms import llm_analysis
 from ..tools import stats_tools
-from ..utils import split_thought_and_answer
+from ..utils import invoke_plan_cached, split_thought_and_answer
 
-from scripts.recorder import record_and_stream
+from scripts.recorder import record_and_stream, record_and_stream_batch
 
 _MAP = {
     "calc_mean": stats_tools.calc_mean,
     "calc_std": stats_tools.calc_std,
     "calc_var": stats_tools.calc_var,
+    "calc_stats": stats_tools.calc_stats,
 }
 
-async def _invoke_llm(prompt: str) -> AIMessage:
+# 静态的角色指令只构造一次；每次请求只构造包含路径/需求的 HumanMessage
+_SYSTEM_MSG = SystemMessage(content=(
+    "你是统计专家，只负责选择并调用合适的统计工具；必须以工具调用完成分析，避免自然语言解释。"
+    "需要多个统计量时优先调用 calc_stats 一次完成。"
+))
+
+async def _invoke_llm(prompt: str, file_path: str, use_cache: bool = True) -> AIMessage:
     """
     统一封装一次，llm_analysis.invoke 大概率是同步调用；
-    用 to_thread 避免阻塞事件循环。
+    用 to_thread 避免阻塞事件循环。相同 prompt 的工具规划结果直接复用。
     """
-    return await asyncio.to_thread(llm_analysis.invoke, [HumanMessage(content=prompt)])
+    return await invoke_plan_cached(
+        llm_analysis, prompt, namespace="analysis", system=_SYSTEM_MSG, use_cache=use_cache, file_path=file_path,
+    )
 
 async def analysis(state: DataState) -> AsyncGenerator[dict, None]:
     """
@@ -36,15 +45,11 @@ async def analysis(state: DataState) -> AsyncGenerator[dict, None]:
     print("🚩 进入 analysis 节点")
     session_id = state.session_id
 
-    prompt = (
-        "你是统计专家，只负责选择并调用合适的统计工具；"
-        "必须以工具调用完成分析，避免自然语言解释。\n"
-        f"FILE_PATH={state.path}\nUSER_NEED={state.user_input}"
-    )
+    prompt = f"FILE_PATH={state.path}\nUSER_NEED={state.user_input}"
 
     try:
         # 1) 调 LLM 产生工具调用计划 + 思考
-        ai: AIMessage = await _invoke_llm(prompt)
+        ai: AIMessage = await _invoke_llm(prompt, str(state.path), use_cache=not state.no_cache)
         thought, answer = split_thought_and_answer(ai.content)
 
         # 推送 LLM 思考
@@ -64,57 +69,54 @@ async def analysis(state: DataState) -> AsyncGenerator[dict, None]:
         tool_calls = getattr(ai, "tool_calls", None) or []
         feats: Dict[str, Any] = {}
 
-        # 2) 依次执行工具（先推 tool_call，再执行并推 tool_result）
-        for call in tool_calls:
-            name = call.get("name")
-            args = call.get("args", {})
-
-            # tool_call 事件（参数可视化）
-            async for event in record_and_stream(
-                session_id=session_id,
-                node="analysis",
-                step_type="tool_call",
-                type="trace",
-                tool_name=name,
-                content=args,
-            ):
-                yield event
-
-            func = _MAP.get(name)
-            if func is None:
-                # 未注册的工具，直接报一个结果事件，方便排查
-                async for event in record_and_stream(
-                    session_id=session_id,
-                    node="analysis",
-                    step_type="tool_result",
-                    type="error",
-                    tool_name=name,
-                    content={"error": f"Unknown tool: {name}"},
-                ):
-                    yield event
-                continue
+        # 2) 先按顺序推送全部 tool_call（参数可视化），再并发执行，最后按原顺序推 tool_result
+        async for event in record_and_stream_batch(session_id, "analysis", [
+            {"step_type": "tool_call", "type": "trace", "tool_name": call.get("name"), "content": call.get("args", {})}
+            for call in tool_calls
+        ]):
+            yield event
 
-            # 执行工具
+        # 各统计工具互相独立，并发执行：总耗时≈最慢的一个
+        async def _run(call: Dict[str, Any]) -> Any:
+            func = _MAP.get(call.get("name"))
+            if func is None:
+                return None
             try:
-                result_json = await asyncio.to_thread(func.invoke, args)
-                parsed = json.loads(result_json)
+                result_json = await asyncio.to_thread(func.invoke, call.get("args", {}))
+                return orjson.loads(result_json)
             except Exception as e:
-                parsed = {"error": str(e)}
+                return {"error": str(e)}
+
+        results = await asyncio.gather(*(_run(call) for call in tool_calls))
+
+        # 结果事件攒成一批，一次记录（MinIO trace 只刷新一次）
+        result_steps: List[Dict[str, Any]] = []
+        for call, parsed in zip(tool_calls, results):
+            name = call.get("name")
+            if name not in _MAP:
+                # 未注册的工具，直接报一个结果事件，方便排查
+                result_steps.append({
+                    "step_type": "tool_result",
+                    "type": "error",
+                    "tool_name": name,
+                    "content": {"error": f"Unknown tool: {name}"},
+                })
+                continue
 
             # 汇总特征
             if isinstance(parsed, dict):
                 feats.update(parsed)
 
             # tool_result 事件
-            async for event in record_and_stream(
-                session_id=session_id,
-                node="analysis",
-                step_type="tool_result",
-                type="tool_result",
-                tool_name=name,
-                content=parsed,
-            ):
-                yield event
+            result_steps.append({
+                "step_type": "tool_result",
+                "type": "tool_result",
+                "tool_name": name,
+                "content": parsed,
+            })
+
+        async for event in record_and_stream_batch(session_id, "analysis", result_steps):
+            yield event
 
         # 3) 推送本节点最终结果
         async for event in record_and_stream(
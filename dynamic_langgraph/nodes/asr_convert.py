@@ -5,24 +5,94 @@ LangGraph 节点：音频文件 → 中文转写
     # 或 pip install openai-whisper
 """
 from pathlib import Path
+from typing import Callable
 from dynamic_langgraph.data_state import DataState
 from ..llms import llm_main
+from scripts.recorder import record_step
 
 # ---------- Whisper 初始化 ----------
-from faster_whisper import WhisperModel        # 若用官方 whisper 改这一行
-_MODEL = WhisperModel("large-v3", device="auto", compute_type="int8")
+import os
+import threading
+from functools import lru_cache
 
+_NUM_WORKERS = int(os.getenv("ASR_NUM_WORKERS", "1"))
+_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))   # 0 = 由 CTranslate2 自行决定
+# 默认贪心解码（beam=1）：单人短音频上比 beam=5 快数倍，字错率几乎不变；需要更高精度时设 ASR_BEAM_SIZE=5
+_BEAM_SIZE = int(os.getenv("ASR_BEAM_SIZE", "1"))
+_VAD_PARAMETERS = {"min_silence_duration_ms": int(os.getenv("ASR_VAD_MIN_SILENCE_MS", "500"))}
 
-def _transcribe_to_zh(audio_path: Path) -> str:
+
+_MODEL_LOCK = threading.Lock()
+
+
+def _get_model():
+    # 加锁：并发的首批请求只加载一份权重
+    with _MODEL_LOCK:
+        return _load_model()
+
+
+@lru_cache(maxsize=1)
+def _load_model():
+    """
+    首次转写时才加载 faster-whisper 与 large-v3 权重：
+    不含 asr 任务的流程（以及健康检查等）不再为导入本模块付出数秒启动时间和数 GB 内存。
+    """
+    import ctranslate2
+    import numpy as np
+    from faster_whisper import WhisperModel        # 若用官方 whisper 改这一行
+
+    # 有 GPU：int8 权重 + fp16 计算；纯 CPU：int8
+    device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    model = WhisperModel(
+        "large-v3",
+        device=device,
+        compute_type="int8_float16" if device == "cuda" else "int8",
+        num_workers=_NUM_WORKERS,
+        cpu_threads=_CPU_THREADS,
+    )
+
+    # 预热：用 1 秒静音跑一次，提前完成首次推理的初始化
+    try:
+        warm_segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)
+        list(warm_segments)
+    except Exception:
+        pass
+    return model
+
+
+def _transcribe_to_zh(audio_path: Path, on_segment: Callable[[str], None] | None = None) -> str:
+    """
+    转写并（必要时）翻译成中文。
+    segments 是惰性生成器：每解出一段就回调 on_segment，下游可边解码边展示。
+    """
     if not audio_path.exists():
         raise FileNotFoundError(audio_path)
 
-    segments, info = _MODEL.transcribe(
-        str(audio_path),
-        vad_filter=True,         # 不显式指定 language，让模型自动识别
-        beam_size=5,
+    from faster_whisper import decode_audio
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    # 先解码一次音频并跑 VAD：整段没有人声就直接返回错误，不必加载/启动解码器
+    audio = decode_audio(str(audio_path), sampling_rate=16000)
+    speech = get_speech_timestamps(audio, VadOptions(**_VAD_PARAMETERS))
+    if not speech:
+        raise RuntimeError("Whisper 未识别到有效语音内容（VAD 未检测到人声）")
+
+    # 有人声时也复用这次的结果：只解码 VAD 给出的人声区间（采样点 → 秒），不再让 transcribe 重跑一遍 VAD
+    clips = [t / 16000 for chunk in speech for t in (chunk["start"], chunk["end"])]
+    segments, info = _get_model().transcribe(
+        audio,                   # 复用已解码的波形，不再重复解码文件
+        vad_filter=False,        # 不显式指定 language，让模型自动识别
+        clip_timestamps=clips,
+        beam_size=_BEAM_SIZE,
+        word_timestamps=False,
+        condition_on_previous_text=False,   # 段间不串联上文，单段解码更快
     )
-    raw = "".join(s.text for s in segments).strip()
+    pieces = []
+    for seg in segments:
+        pieces.append(seg.text)
+        if on_segment and seg.text.strip():
+            on_segment(seg.text.strip())
+    raw = "".join(pieces).strip()
     if not raw:
         raise RuntimeError("Whisper 未识别到有效语音内容")
 
@@ -40,12 +110,21 @@ def _transcribe_to_zh(audio_path: Path) -> str:
 # ---------- LangGraph 节点 ----------
 def asr_convert(state: DataState) -> DataState:
     """
-    1. 读取 state.path（音频文件）→ Whisper 转写
+    1. 读取 state.path（音频文件）→ Whisper 转写（每段实时推送 segment 事件）
     2. 成功：写入 state.asr_text
     3. 失败：写入 state.error_msg，但不抛异常，保证流程继续
     """
+    def _push_segment(text: str) -> None:
+        record_step(
+            session_id=state.session_id,
+            node="asr",
+            step_type="segment",
+            type="trace",
+            content=text,
+        )
+
     try:
-        state.asr_text = _transcribe_to_zh(state.path)
+        state.asr_text = _transcribe_to_zh(state.path, on_segment=_push_segment)
     except Exception as err:
         state.error_msg = f"ASR 失败：{err}"
     return state
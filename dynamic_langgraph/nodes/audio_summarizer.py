@@ -4,7 +4,7 @@
 from dynamic_langgraph.data_state import DataState
 from dynamic_langgraph.utils import debug_ai_message
 from ..llms import llm_main
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
 _MAX_INPUT_CHARS = 4000   # 防止超上下文
 _PROMPT_HEADER = (
@@ -13,6 +13,8 @@ _PROMPT_HEADER = (
     "2. 长度控制在 200 字以内\n"
     "仅输出摘要正文，不要标题或解释。\n\n"
 )
+# 固定的写作要求做成 system 消息，只构造一次；正文单独作为 user 消息，不再与头部拼接出新的长字符串
+_SYSTEM_MSG = SystemMessage(content=_PROMPT_HEADER.strip())
 
 def audio_summarizer(state: DataState) -> DataState:
     if not state.asr_text:
@@ -20,9 +22,7 @@ def audio_summarizer(state: DataState) -> DataState:
         return state
 
     text = state.asr_text[:_MAX_INPUT_CHARS]
-    prompt = _PROMPT_HEADER + text
-
-    ai: AIMessage = llm_main.invoke(prompt)
+    ai: AIMessage = llm_main.invoke([_SYSTEM_MSG, HumanMessage(content=text)])
     debug_ai_message(ai)
 
     state.summary = ai.content.strip()
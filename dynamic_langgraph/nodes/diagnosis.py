@@ -1,21 +1,26 @@
 # dynamic_langgraph/nodes/diagnosis.py
 from typing import AsyncGenerator, Dict, Any, Optional
-import json
+import orjson
 import asyncio
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import AIMessage, SystemMessage
 
 from ..data_state import DataState
 from ..llms import llm_diagnosis
 from ..tools.diagnosis_tools import diagnose_signal
-from ..utils import split_thought_and_answer
+from ..utils import invoke_plan_cached, split_thought_and_answer
 
 from scripts.recorder import record_and_stream
 
 
-async def _invoke_llm(prompt: str) -> AIMessage:
-    """避免阻塞事件循环。"""
-    return await asyncio.to_thread(llm_diagnosis.invoke, [HumanMessage(content=prompt)])
+# 静态的角色指令只构造一次；每次请求只构造包含路径/需求的 HumanMessage
+_SYSTEM_MSG = SystemMessage(content="你是故障诊断专家，请仅调用诊断工具并给出结构化结果；避免纯自然语言解释。")
+
+async def _invoke_llm(prompt: str, file_path: str, use_cache: bool = True) -> AIMessage:
+    """避免阻塞事件循环；相同 prompt 的工具规划结果直接复用。"""
+    return await invoke_plan_cached(
+        llm_diagnosis, prompt, namespace="diagnosis", system=_SYSTEM_MSG, use_cache=use_cache, file_path=file_path,
+    )
 
 
 async def _invoke_tool(args: Dict[str, Any]) -> str:
@@ -33,15 +38,11 @@ async def diagnosis(state: DataState) -> AsyncGenerator[dict, None]:
     print("🚩 进入 diagnosis 节点")
     session_id = state.session_id
 
-    prompt = (
-        "你是故障诊断专家，请仅调用诊断工具并给出结构化结果；"
-        "避免纯自然语言解释。\n"
-        f"FILE_PATH={state.path}\nUSER_NEED={state.user_input}"
-    )
+    prompt = f"FILE_PATH={state.path}\nUSER_NEED={state.user_input}"
 
     try:
         # 1) LLM 规划工具调用
-        ai: AIMessage = await _invoke_llm(prompt)
+        ai: AIMessage = await _invoke_llm(prompt, str(state.path), use_cache=not state.no_cache)
         thought, answer = split_thought_and_answer(ai.content)
 
         async for event in record_and_stream(
@@ -91,7 +92,7 @@ async def diagnosis(state: DataState) -> AsyncGenerator[dict, None]:
         try:
             raw = await _invoke_tool(args)
             try:
-                parsed = json.loads(raw)
+                parsed = orjson.loads(raw)
             except Exception:
                 parsed = {"raw": raw}  # 兜底：非JSON也回传
         except Exception as e:
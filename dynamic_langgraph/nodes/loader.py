@@ -13,28 +13,46 @@ logger = logging.getLogger("dynamic-langgraph.nodes.loader")
 
 _MAX_PREVIEW_BYTES = 4096  # 预览最多读取的字节数
 
+mimetypes.init()  # 导入时初始化一次，避免首次 guess_type 时再读系统 mime 表
+
+# 本项目常见的扩展名直接查表，其余再走 mimetypes.guess_type
+_MIME_BY_SUFFIX = {
+    ".txt": "text/plain",
+    ".csv": "text/csv",
+    ".md": "text/markdown",
+    ".json": "application/json",
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/x-wav",
+    ".png": "image/png",
+}
+
+def _guess_mime(path: Path) -> str | None:
+    mime = _MIME_BY_SUFFIX.get(path.suffix.lower())
+    if mime is None:
+        mime, _ = mimetypes.guess_type(str(path))
+    return mime
+
+# 视为文本的非 text/* 子类型（按最后一个 "/" 之后的部分匹配）
+_TEXT_SUBTYPES = frozenset(("/json", "/xml", "/csv", "/yaml", "/x-yaml"))
+
 def _is_text_mime(mime: str | None) -> bool:
     if not mime:
         return False
-    return mime.startswith("text/") or any(
-        mime.endswith(suf) for suf in ("/json", "/xml", "/csv", "/yaml", "/x-yaml")
-    )
+    return mime.startswith("text/") or mime[mime.rfind("/"):] in _TEXT_SUBTYPES
 
 async def _read_preview(path: Path, max_bytes: int = _MAX_PREVIEW_BYTES) -> str:
-    """尽量安全地读一小段文本预览。"""
+    """尽量安全地读一小段文本预览（只读开头，不把整个文件读进内存）。"""
+    def _read_head() -> str:
+        # 按字节截断再解码：文本模式的 read(n) 读的是 n 个字符，中文可能是预算的 3 倍字节
+        with open(path, "rb") as f:
+            return f.read(max_bytes).decode("utf-8", errors="replace")
     try:
-        return await asyncio.to_thread(
-            lambda: Path(path).read_text(encoding="utf-8", errors="replace")[:max_bytes]
-        )
+        return await asyncio.to_thread(_read_head)
     except Exception:
-        # 退回二进制方式尽力读一段
-        try:
-            def _read_bin():
-                with open(path, "rb") as f:
-                    return f.read(max_bytes).decode("utf-8", errors="replace")
-            return await asyncio.to_thread(_read_bin)
-        except Exception:
-            return ""
+        return ""
 
 async def loader(state: DataState) -> AsyncGenerator[dict, None]:
     """
@@ -47,8 +65,12 @@ async def loader(state: DataState) -> AsyncGenerator[dict, None]:
     session_id = state.session_id
     path = Path(state.path)
 
-    # 1) 文件存在性检查
-    if not path.exists():
+    # 1) 文件存在性检查（一次 stat 同时拿到大小）
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        st = None
+    if st is None:
         # 推送异常事件后抛错
         async for event in record_and_stream(
             session_id=session_id,
@@ -71,11 +93,8 @@ async def loader(state: DataState) -> AsyncGenerator[dict, None]:
         yield event
 
     # 2) 元信息：大小 / MIME
-    try:
-        size = await asyncio.to_thread(os.path.getsize, path)
-    except Exception:
-        size = None
-    mime, _ = mimetypes.guess_type(str(path))
+    size = st.st_size
+    mime = _guess_mime(path)
 
     async for event in record_and_stream(
         session_id=session_id,
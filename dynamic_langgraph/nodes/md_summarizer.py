@@ -1,21 +1,30 @@
 """
 节点：对 Markdown（含 OCR 文字）生成摘要
 """
-from pathlib import Path
 from typing import List
 
 from ..data_state import DataState
 from ..llms import llm_main
 from dynamic_langgraph.utils import debug_ai_message
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
 _MAX_CHARS = 10000          # 长文截断上限
 _SUMMARY_LANG = "zh"       # 摘要语言
 
+_SYSTEM_MSG = SystemMessage(content=(
+    "你是一名资深技术编辑，请严格遵守以下要求：\n"
+    "1. 用 **中文** 写作\n"
+    "2. 长度一定要控制在 200 字以内（不要超过 400 字符）\n"
+    "3. 原文中的英文请先翻译后再概括\n"
+    "仅输出摘要正文，不要任何解释或标题。"
+))
+
 # ---------- 内部辅助 ----------
 
 def _load_text(path: str, limit: int) -> str:
-    txt = Path(path).read_text(encoding="utf-8")
+    # 只读 limit+1 个字符：多出的 1 个用来判断是否需要截断，不必读入整个文件
+    with open(path, "r", encoding="utf-8") as f:
+        txt = f.read(limit + 1)
     return txt[:limit] + ("\n\n...(内容过长已截断)..." if len(txt) > limit else "")
 
 def _combine_for_llm(md_text: str, ocr: List[str]) -> str:
@@ -34,17 +43,7 @@ def md_summarizer(state: DataState) -> DataState:
     md_text = _load_text(state.markdown_path, _MAX_CHARS)
     full_text = _combine_for_llm(md_text, state.ocr_snippets)
 
-    ...
-    PROMPT_HEADER = (
-        "你是一名资深技术编辑，请严格遵守以下要求：\n"
-        "1. 用 **中文** 写作\n"
-        "2. 长度一定要控制在 200 字以内（不要超过 400 字符）\n"
-        "3. 原文中的英文请先翻译后再概括\n"
-        "仅输出摘要正文，不要任何解释或标题。\n\n"
-    )
-    prompt = PROMPT_HEADER + full_text
-
-    ai: AIMessage = llm_main.invoke(prompt)
+    ai: AIMessage = llm_main.invoke([_SYSTEM_MSG, HumanMessage(content=full_text)])
 
     debug_ai_message(ai)
 
@@ -2,7 +2,7 @@
 import asyncio
 from typing import AsyncGenerator
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
 from ..data_state import DataState
 from ..llms import llm_main
@@ -10,11 +10,22 @@ from ..utils import split_thought_and_answer
 from scripts.recorder import record_and_stream
 
 
+# 固定的角色与格式要求只构造一次；每次请求只填充变化的部分
+_SYSTEM_MSG = SystemMessage(content=(
+    "你是机械振动信号分析专家，请根据以下信息输出结构化、简洁的综合总结：\n"
+    "要求：先给出要点列表，再给出一段完整结论，避免堆砌冗余。"
+))
+_USER_TEMPLATE = (
+    "- 用户需求: {user_input}\n"
+    "- 统计特征: {features}\n"
+    "- 诊断结果: {diag}\n"
+    "- 图像分析: {viz_summary}\n"
+)
+
+
 async def _invoke_llm(prompt: str) -> AIMessage:
     """避免阻塞事件循环；多数 LLM 客户端是同步的。"""
-    # 如果你的 llm_main.invoke 本来就接受字符串，这里也能正常工作；
-    # 为了与其他节点一致，这里用 HumanMessage 包装。
-    return await asyncio.to_thread(llm_main.invoke, [HumanMessage(content=prompt)])
+    return await asyncio.to_thread(llm_main.invoke, [_SYSTEM_MSG, HumanMessage(content=prompt)])
 
 
 async def summarizer(state: DataState) -> AsyncGenerator[dict, None]:
@@ -31,14 +42,12 @@ async def summarizer(state: DataState) -> AsyncGenerator[dict, None]:
     diag = getattr(state, "diag", None) or {}
     viz_summary = getattr(state, "viz_summary", None) or ""
 
-    prompt = (
-        "你是机械振动信号分析专家，请根据以下信息输出结构化、简洁的综合总结：\n"
-        "要求：先给出要点列表，再给出一段完整结论，避免堆砌冗余。\n"
-        f"- 用户需求: {state.user_input}\n"
-        f"- 统计特征: {features}\n"
-        f"- 诊断结果: {diag}\n"
-        f"- 图像分析: {viz_summary}\n"
-    )
+    prompt = _USER_TEMPLATE.format_map({
+        "user_input": state.user_input,
+        "features": features,
+        "diag": diag,
+        "viz_summary": viz_summary,
+    })
 
     try:
         # 1) 调 LLM
@@ -1,19 +1,20 @@
 import os
-import json
+import re
+import uuid
 import asyncio
 from typing import Any, Dict, List, AsyncGenerator
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
 from ..data_state import DataState
-from ..llms import llm_viz, llm_multimod
+from ..llms import llm_viz, get_llm_multimod
 from ..tools import viz_tools
-from ..utils import b64_image, split_thought_and_answer
+from ..utils import b64_bytes, invoke_plan_cached, split_thought_and_answer
 
-from scripts.recorder import record_step, record_and_stream
+from scripts.recorder import arecord_step, arecord_steps, record_and_stream, record_and_stream_batch
 
 # MinIO 上传：优先用你封装；常量从 env 兜底
-from minio_client import upload_file_to_minio  # type: ignore
+from minio_client import aupload_bytes_to_minio  # type: ignore
 
 MINIO_BASE_URL = os.getenv("MINIO_BASE_URL", "").rstrip("/")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "dynamic-langgraph")
@@ -39,6 +40,31 @@ _MAP = {
 }
 
 
+# 静态的绘图指令只构造一次；每次请求只构造包含路径/需求的 HumanMessage
+_SYSTEM_MSG = SystemMessage(content=(
+    "你是绘图专家，只允许从以下工具中选择并调用，禁止输出自然语言解释：\n"
+    "- time_plot(path: str)\n- freq_plot(path: str)\n"
+    "请基于 FILE_PATH 选择合适工具并传入 path 参数。"
+))
+
+# 关键词路由：只有两个工具，需求里写明了“频谱/时域”时直接选，不必让 LLM 推理一轮；
+# 都没命中（不确定）时才回退给 LLM。VIZ_KEYWORD_ROUTER=0 可关闭
+_KEYWORD_ROUTER = os.getenv("VIZ_KEYWORD_ROUTER", "1") == "1"
+# 英文关键词要求整词（前后不是字母）：timestamp / runtime / frequently 不算；与中文紧挨着写仍能命中
+_ROUTES = (
+    ("time_plot", re.compile(r"时域|波形|(?<![a-z])time(?:[- ]?domain)?(?![a-z])", re.IGNORECASE)),
+    ("freq_plot", re.compile(r"频谱|频域|(?<![a-z])(?:fft|freq(?:uency)?)(?![a-z])", re.IGNORECASE)),
+)
+
+def _route_viz(user_input: str, file_path: str) -> List[Dict[str, Any]]:
+    """按关键词直接给出 tool_calls（格式同 AIMessage.tool_calls）；无法判断时返回空列表。"""
+    text = user_input or ""
+    return [
+        {"name": name, "args": {"path": file_path}, "id": f"route_{uuid.uuid4().hex[:8]}", "type": "tool_call"}
+        for name, pat in _ROUTES if pat.search(text)
+    ]
+
+
 # ---- 辅助：生成对象键 / 拼 URL / 上传取 URL ----
 def _mk_key(prefix: str, session_id: str, filename: str) -> str:
     """
@@ -53,11 +79,19 @@ def _compose_url(object_key: str) -> str:
         return f"{MINIO_BASE_URL}/{MINIO_BUCKET}/{object_key}"
     return f"/{MINIO_BUCKET}/{object_key}"
 
-def _upload_and_get_url(local_path: str, object_key: str) -> str:
-    ret = upload_file_to_minio(local_path, object_key)
+async def _upload_and_encode(data: bytes, object_key: str, mime: str = "image/png") -> tuple[str, str]:
+    """
+    内存中的图片字节：上传到 MinIO 拿 URL，同时生成给多模态 LLM 的 data URL（二者并发）。
+    上传的是原 PNG；给 LLM 的 data URL 转成 JPEG，减小多模态请求体。
+    Ollama 只接受 base64 图片（不会替我们去拉 MinIO 链接），所以两份都要。
+    """
+    data_url, ret = await asyncio.gather(
+        asyncio.to_thread(b64_bytes, data, mime, compress=True),
+        aupload_bytes_to_minio(data, object_key, mime),
+    )
     if isinstance(ret, str) and (ret.startswith("http://") or ret.startswith("https://") or ret.startswith("/")):
-        return ret
-    return _compose_url(object_key)
+        return ret, data_url
+    return _compose_url(object_key), data_url
 
 
 # ==== 主节点：可流式产出事件 ====
@@ -73,8 +107,7 @@ async def viz(state: DataState) -> AsyncGenerator[dict, None]:
     file_path = str(state.path)
 
     # 开始
-    await asyncio.to_thread(
-        record_step,
+    await arecord_step(
         session_id=session_id,
         node="viz",
         step_type="start",
@@ -82,16 +115,18 @@ async def viz(state: DataState) -> AsyncGenerator[dict, None]:
         content=f"开始可视化：{file_path}",
     )
 
-    # 1) 让 LLM 只选择绘图工具（不输出自然语言）
-    prompt = (
-        "你是绘图专家，只允许从以下工具中选择并调用，禁止输出自然语言解释：\n"
-        f"- time_plot(path: str)\n- freq_plot(path: str)\n"
-        f"FILE_PATH={file_path}\nUSER_NEED={state.user_input}\n"
-        "请基于 FILE_PATH 选择合适工具并传入 path 参数。"
-    )
+    # 1) 选择绘图工具：关键词能判断就直接路由，否则让 LLM 只选择工具（不输出自然语言）
+    prompt = f"FILE_PATH={file_path}\nUSER_NEED={state.user_input}"
 
     try:
-        ai: AIMessage = await asyncio.to_thread(llm_viz.invoke, [HumanMessage(content=prompt)])
+        routed = _route_viz(state.user_input, file_path) if _KEYWORD_ROUTER else []
+        if routed:
+            ai = AIMessage(content="", tool_calls=routed, response_metadata={"model": "keyword-router"})
+        else:
+            ai = await invoke_plan_cached(
+                llm_viz, prompt, namespace="viz", system=_SYSTEM_MSG, use_cache=not state.no_cache,
+                file_path=file_path,
+            )
         # 记录 LLM 思考（若有）与工具调用计划
         thought, answer = split_thought_and_answer(ai.content or "")
         async for ev in record_and_stream(
@@ -108,94 +143,89 @@ async def viz(state: DataState) -> AsyncGenerator[dict, None]:
             yield ev
 
         tool_calls = getattr(ai, "tool_calls", None) or []
-        local_imgs: List[str] = []
+        data_urls: List[str] = []
         img_urls: List[str] = []
 
-        # 2) 依次执行工具：先推 tool_call，再执行，上传图片后推 image + tool_result
-        for call in tool_calls:
-            name = call.get("name")
-            args = call.get("args", {}) or {}
-
-            # tool_call 事件
-            async for ev in record_and_stream(
-                session_id=session_id,
-                node="viz",
-                step_type="tool_call",
-                type="trace",
-                tool_name=name,
-                content=args,
-            ):
-                yield ev
+        # 2) 先按顺序推送全部 tool_call，再并发执行（绘图 + 上传），最后按原顺序推 image + tool_result
+        async for ev in record_and_stream_batch(session_id, "viz", [
+            {"step_type": "tool_call", "type": "trace", "tool_name": call.get("name"), "content": call.get("args", {}) or {}}
+            for call in tool_calls
+        ]):
+            yield ev
 
-            func = _MAP.get(name)
-            if func is None:
-                async for ev in record_and_stream(
-                    session_id=session_id,
-                    node="viz",
-                    step_type="tool_result",
-                    type="error",
-                    tool_name=name,
-                    content={"error": f"Unknown tool: {name}"},
-                ):
-                    yield ev
-                continue
-
-            # 真正执行工具（工具返回 {"image_path": "<本地路径>"} 的 JSON）
+        # 各绘图工具互相独立：一个在上传时另一个可以继续绘图，总耗时≈最慢的一个
+        # （绘图在 viz_tools 的进程池里多核并行；VIZ_PLOT_PROCS=0 时退回线程；图片字节不落盘直接上传）
+        async def _run(call: Dict[str, Any]) -> tuple[Any, str | None, str | None]:
+            """返回 (tool_result 内容, 图片 URL, 图片 data URL)；失败时后两项为 None。"""
+            name = call.get("name")
+            if name not in _MAP:
+                return None, None, None
+            # 真正执行工具：渲染在进程池里进行，直接拿回 PNG 字节（不经本地文件）
             try:
-                result_json = await asyncio.to_thread(func.invoke, args)
-                parsed = json.loads(result_json)
-                img_local = parsed.get("image_path")
+                args = call.get("args", {}) or {}
+                data = await viz_tools.arender_bytes(name, str(args["path"]))
             except Exception as e:
-                img_local = None
-                parsed = {"error": str(e)}
-
-            if img_local and os.path.exists(img_local):
-                # 上传到 MinIO 的 pic/<session_id>/...，并拿到 URL
-                object_key = _mk_key("pic", session_id, img_local)
-                url = await asyncio.to_thread(_upload_and_get_url, img_local, object_key)
-
-                # 推送“图片”事件（前端会内嵌显示）
-                await asyncio.to_thread(
-                    record_step,
-                    session_id=session_id,
-                    node="viz",
-                    step_type="plot",
-                    type="image",
-                    content=url,
-                )
-
-                # tool_result 事件（带链接）
-                async for ev in record_and_stream(
-                    session_id=session_id,
-                    node="viz",
-                    step_type="tool_result",
-                    type="tool_result",
-                    tool_name=name,
-                    content={"image_url": url, "object_key": object_key},
-                ):
-                    yield ev
-
-                local_imgs.append(img_local)
-                img_urls.append(url)
-            else:
-                # 工具执行失败
-                async for ev in record_and_stream(
-                    session_id=session_id,
-                    node="viz",
-                    step_type="tool_result",
-                    type="tool_result",
-                    tool_name=name,
-                    content=parsed,
-                ):
-                    yield ev
+                return {"error": str(e)}, None, None
+            if not data:
+                return {"error": "empty image"}, None, None
+            # 上传到 MinIO 的 pic/<session_id>/...，并拿到 URL
+            object_key = _mk_key("pic", session_id, viz_tools.image_name(name))
+            url, data_url = await _upload_and_encode(data, object_key)
+            return {"object_key": object_key}, url, data_url
+
+        # 全部工具同时开跑；按调用顺序逐个等待，某张图一好（且前面的都已推送）就立即推送，不必等全部完成
+        runs = [asyncio.create_task(_run(call)) for call in tool_calls]
+        try:
+            for call, run in zip(tool_calls, runs):
+                parsed, url, data_url = await run
+                name = call.get("name")
+                if name not in _MAP:
+                    async for ev in record_and_stream(
+                        session_id=session_id,
+                        node="viz",
+                        step_type="tool_result",
+                        type="error",
+                        tool_name=name,
+                        content={"error": f"Unknown tool: {name}"},
+                    ):
+                        yield ev
+                    continue
+
+                if url:
+                    # “图片”事件（前端会内嵌显示）+ tool_result 事件（带链接）一次记录；
+                    # 图片事件已直接入队推送，不再 yield，避免下游重复转发
+                    _, result_ev = await arecord_steps(session_id, "viz", [
+                        {"step_type": "plot", "type": "image", "content": url},
+                        {"step_type": "tool_result", "type": "tool_result", "tool_name": name,
+                         "content": {"image_url": url, "object_key": parsed["object_key"]}},
+                    ])
+                    yield result_ev
+
+                    data_urls.append(data_url)
+                    img_urls.append(url)
+                else:
+                    # 工具执行失败
+                    async for ev in record_and_stream(
+                        session_id=session_id,
+                        node="viz",
+                        step_type="tool_result",
+                        type="tool_result",
+                        tool_name=name,
+                        content=parsed,
+                    ):
+                        yield ev
+        finally:
+            # 节点提前退出（异常/取消）时，不让剩余的绘图任务在后台悬空
+            for run in runs:
+                run.cancel()
 
         # 3) 多模态总结（对生成的图给一个简短趋势描述）
         viz_summary = ""
-        if local_imgs:
+        if data_urls:
             mm_prompt = [{"type": "text", "text": "请简要分析下列图像展示的数据总体趋势（尽量简洁）。"}] + [
-                {"type": "image_url", "image_url": {"url": b64_image(p)}} for p in local_imgs
+                {"type": "image_url", "image_url": {"url": u}} for u in data_urls
             ]
-            mm_res: AIMessage = await asyncio.to_thread(llm_multimod.invoke, [HumanMessage(content=mm_prompt)])
+            mm_res: AIMessage = await asyncio.to_thread(get_llm_multimod().invoke, [HumanMessage(content=mm_prompt)])
             viz_summary = mm_res.content or ""
 
             # 推一个 result 事件（结构化）
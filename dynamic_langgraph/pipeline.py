@@ -1,20 +1,23 @@
 # dynamic_langgraph/pipeline.py
 import logging
-import json
+import orjson
 import asyncio
+import contextlib
+import hashlib
 import os
-import re, time  # 新增
+import time
 import uuid
-import tempfile
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 from .case_loader import load_case_templates, llm_pick_tasks
-from .graph_builder import build_graph
-from .utils import split_thought_and_answer
+from .graph_builder import build_graph, graph_png, graph_mermaid
+from .utils import plan_cache_stats, split_thought_and_answer
 
-from scripts.recorder import record_step
-from minio_client import upload_file_to_minio  # 你的封装：可返回直链/预签名/None
+from scripts.recorder import arecord_step, arecord_steps
+from minio_client import aupload_file_to_minio, aupload_bytes_to_minio  # 你的封装：可返回直链/预签名/None
 
 # ---------------- 环境 & 本地目录 ----------------
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "dynamic-langgraph")
@@ -39,19 +42,21 @@ _LOG_DIR.mkdir(exist_ok=True)
 _GRAPHS_DIR = (Path(__file__).resolve().parent.parent / "graphs")
 _GRAPHS_DIR.mkdir(exist_ok=True)
 
+# 流程图渲染：单线程后台执行；DLG_EMIT_FLOWCHART=0 时完全跳过
+_EMIT_FLOWCHART = os.getenv("DLG_EMIT_FLOWCHART", "1") == "1"
+# png：渲染 PNG 并上传（Mermaid 渲染会请求 mermaid.ink）；mermaid：只推 Mermaid 源码，由前端渲染，零网络开销
+_FLOWCHART_FORMAT = os.getenv("DLG_FLOWCHART_FORMAT", "png").lower()
+_FLOWCHART_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flowchart")
+# 同一任务序列的流程图字节完全相同：上传过一次就复用 URL，后续会话不再落盘/上传。
+# 共用的图放在与会话无关的键 flowchart/plans/<任务序列哈希>.png 下，不会随某个会话的清理被删掉。
+# URL 可能是预签名链接，超过 DLG_FLOWCHART_URL_TTL 秒（默认 1 小时，远小于预签名有效期）后重新上传
+_FLOWCHART_URL_TTL = float(os.getenv("DLG_FLOWCHART_URL_TTL", "3600"))
+_FLOWCHART_URLS: Dict[Tuple[str, ...], Tuple[str, float]] = {}
+
 logger = logging.getLogger("dynamic-langgraph.pipeline")
 logging.basicConfig(level=logging.INFO)
 
 # ================== 小工具 ==================
-def safe_serialize(obj: Any) -> Any:
-    if isinstance(obj, Path):
-        return str(obj)
-    if isinstance(obj, dict):
-        return {k: safe_serialize(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [safe_serialize(v) for v in obj]
-    return obj
-
 def _mk_key(prefix: str, session_id: str, name: str) -> str:
     """
     生成对象键：<prefix>/<session_id>/<ts>_<uuid8>_<name>
@@ -70,21 +75,33 @@ def _compose_url(object_key: str) -> str:
         return f"{MINIO_BASE_URL}/{MINIO_BUCKET}/{object_key}"
     return f"/{MINIO_BUCKET}/{object_key}"
 
-def _upload_and_get_url(local_path: str, object_key: str) -> str:
+async def _upload_and_get_url(local_path: str, object_key: str) -> str:
     """
-    上传并尽力得到 URL：
-    - upload_file_to_minio 返回 URL/路径则优先用；
+    上传并尽力得到 URL（异步：装了 aioboto3 时直接在事件循环上 PUT，不占线程池）：
+    - aupload_file_to_minio 返回 URL/路径则优先用；
     - 否则用 _compose_url(object_key) 拼。
     """
-    ret = upload_file_to_minio(local_path, object_key)
+    ret = await aupload_file_to_minio(local_path, object_key)
     if isinstance(ret, str) and (ret.startswith("http://") or ret.startswith("https://") or ret.startswith("/")):
         return ret
     return _compose_url(object_key)
 
+async def _upload_bytes_and_get_url(data: bytes, object_key: str) -> str:
+    """
+    内存字节直接上传（不落临时文件）；URL 规则同 _upload_and_get_url。
+    """
+    content_type = mimetypes.guess_type(object_key)[0] or "application/octet-stream"
+    ret = await aupload_bytes_to_minio(data, object_key, content_type)
+    if isinstance(ret, str) and (ret.startswith("http://") or ret.startswith("https://") or ret.startswith("/")):
+        return ret
+    return _compose_url(object_key)
+
+
+_OWUI_PREFIX = "owui-"
 
 def sid_core(session_id: str) -> str:
     """去掉前缀 'owui-'，得到 b9d605d2002b4fb0975804ab 这种核心ID"""
-    return re.sub(r"^owui-", "", session_id or "")
+    return (session_id or "").removeprefix(_OWUI_PREFIX)
 
 
 async def emit_image_from_file(session_id: str, local_path: str, *, prefix: str = "pic") -> str:
@@ -94,9 +111,8 @@ async def emit_image_from_file(session_id: str, local_path: str, *, prefix: str
     """
     name = Path(local_path).name
     object_key = _mk_key(prefix, session_id, name)
-    url = await asyncio.to_thread(_upload_and_get_url, local_path, object_key)
-    await asyncio.to_thread(
-        record_step,
+    url = await _upload_and_get_url(local_path, object_key)
+    await arecord_step(
         session_id=session_id,
         node="viz",
         step_type="plot",
@@ -112,9 +128,8 @@ async def emit_file_from_path(session_id: str, local_path: str, *, prefix: str =
     """
     name = Path(local_path).name
     object_key = _mk_key(prefix, session_id, name)
-    url = await asyncio.to_thread(_upload_and_get_url, local_path, object_key)
-    await asyncio.to_thread(
-        record_step,
+    url = await _upload_and_get_url(local_path, object_key)
+    await arecord_step(
         session_id=session_id,
         node="artifact",
         step_type="file",
@@ -126,25 +141,74 @@ async def emit_file_from_path(session_id: str, local_path: str, *, prefix: str =
 
 async def emit_bytes_as_file(session_id: str, data: bytes, filename: str, *, prefix: str = "processfiles") -> str:
     """
-    把内存字节保存为临时文件 → 上传 → 推送 file 事件。
+    内存字节直接上传 → 推送 file 事件（事件格式同 emit_file_from_path）。
+    """
+    object_key = _mk_key(prefix, session_id, filename)
+    url = await _upload_bytes_and_get_url(data, object_key)
+    await arecord_step(
+        session_id=session_id,
+        node="artifact",
+        step_type="file",
+        type="file",
+        content=url,
+        result={"filename": filename, "object_key": object_key},
+    )
+    return object_key
+
+# ============ 规划 + 生成流程图（上传到 flowchart/...） ============
+async def _emit_flowchart(tasks: List[Any], session_id: str) -> Optional[str]:
+    """
+    渲染流程图 → 本地 → MinIO（flowchart/...）→ 推 image 事件；返回图的 URL。
+    DLG_FLOWCHART_FORMAT=mermaid 时只推 Mermaid 源码（type="mermaid"），不渲染 PNG，返回 None。
+    Mermaid 渲染可能走网络，放在单线程执行器里后台完成，不阻塞节点执行。
     """
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(data)
-        tmp.flush()
-        tmp_path = tmp.name
     try:
-        return await emit_file_from_path(session_id, tmp_path, prefix=prefix)
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+        if _FLOWCHART_FORMAT == "mermaid":
+            mermaid = await asyncio.get_running_loop().run_in_executor(_FLOWCHART_EXECUTOR, graph_mermaid, tasks)
+            await arecord_step(
+                session_id=session_id,
+                node="planner",
+                step_type="flowchart",
+                type="mermaid",
+                content=mermaid,
+            )
+            return None
+
+        plan = tuple(tasks)
+        cached = _FLOWCHART_URLS.get(plan)
+        if cached is not None and time.time() - cached[1] < _FLOWCHART_URL_TTL:
+            graph_url = cached[0]
+        else:
+            core = sid_core(session_id)                       # ← 统一用核心ID
+            ts = int(time.time())                             # ← 可选：时间戳避免覆盖
+            graph_path = _GRAPHS_DIR / f"graph_{core}_{ts}.png"      # ← 本地文件名也统一
+
+            png_bytes = await asyncio.get_running_loop().run_in_executor(_FLOWCHART_EXECUTOR, graph_png, tasks)
+            await asyncio.to_thread(graph_path.write_bytes, png_bytes)
+
+            # 对象键只由任务序列决定：同一计划的所有会话共用一张图
+            plan_hash = hashlib.sha1("\0".join(map(str, plan)).encode("utf-8")).hexdigest()[:16]
+            object_key = f"flowchart/plans/{plan_hash}.png"
+
+            graph_url = await _upload_bytes_and_get_url(png_bytes, object_key)
+            _FLOWCHART_URLS[plan] = (graph_url, time.time())
+
+        await arecord_step(
+            session_id=session_id,
+            node="planner",
+            step_type="flowchart",
+            type="image",
+            content=graph_url,
+        )
+        return graph_url
+    except Exception as e:
+        logger.warning("流程图生成或上传失败：%s", e)
+        return None
 
-# ============ 规划 + 生成流程图（上传到 pic/flowchart/...） ============
-async def _plan_and_graph(user_input: str, session_id: str) -> Tuple[Any, List[Dict[str, Any]], Optional[str]]:
+async def _plan_and_graph(user_input: str, session_id: str) -> Tuple[Any, List[Dict[str, Any]], Optional["asyncio.Task[Optional[str]]"]]:
     """
-    规划任务 + 生成并上传流程图
-    返回: (compiled_graph, tasks, graph_url)
+    规划任务 + 构图；流程图在后台生成并上传
+    返回: (compiled_graph, tasks, flowchart_task)；flowchart_task 结果为 graph_url（未启用时为 None）
     """
     # 1) 任务规划
     cases = load_case_templates()
@@ -153,8 +217,7 @@ async def _plan_and_graph(user_input: str, session_id: str) -> Tuple[Any, List[D
     # 推送 planner 思考（thought 放详细推理；content 可放简短结论/编号）
     if ai_msg:
         thought, answer = split_thought_and_answer(ai_msg.content)
-        await asyncio.to_thread(
-            record_step,
+        await arecord_step(
             session_id=session_id,
             node="planner",
             step_type="llm",
@@ -172,44 +235,129 @@ async def _plan_and_graph(user_input: str, session_id: str) -> Tuple[Any, List[D
     # 2) 构图
     compiled = build_graph(tasks)
 
-    # 3) 流程图 → 本地 → MinIO（flowchart/...）→ 推 image 事件
-    graph_url: Optional[str] = None
-    try:
-        core = sid_core(session_id)                       # ← 统一用核心ID
-        ts = int(time.time())                             # ← 可选：时间戳避免覆盖
-        graph_path = _GRAPHS_DIR / f"graph_{core}_{ts}.png"      # ← 本地文件名也统一
-
-        png_bytes = compiled.get_graph(xray=True).draw_mermaid_png()
-        graph_path.write_bytes(png_bytes)
-
-        # 不再走 _mk_key("pic/flowchart", ...)，直接明确：flowchart/<core>/graph_<core>_<ts>.png
-        object_key = f"flowchart/{core}/graph_{core}_{ts}.png"    # ← 目标对象键统一
-
-        graph_url = await asyncio.to_thread(_upload_and_get_url, str(graph_path), object_key)
-
-        await asyncio.to_thread(
-            record_step,
-            session_id=session_id,
-            node="planner",
-            step_type="flowchart",
-            type="image",
-            content=graph_url,
-        )
-    except Exception as e:
-        logger.warning("流程图生成或上传失败：%s", e)
-
+    # 3) 流程图：后台渲染 + 上传，与节点执行并行
+    flowchart_task = asyncio.create_task(_emit_flowchart(tasks, session_id)) if _EMIT_FLOWCHART else None
 
     # 4) 推 planner 阶段的任务列表（结构化）
-    await asyncio.to_thread(
-        record_step,
+    await arecord_step(
         session_id=session_id,
         node="planner",
         step_type="result",
         type="trace",
         result={"tasks": tasks},
     )
+    logger.debug("plan cache: %s", plan_cache_stats())
+
+    return compiled, tasks, flowchart_task
+
+# ================== 图输出的后台写入 ==================
+_WRITER_QUEUE_SIZE = 1024
+_WRITER_BATCH = 64          # 每次最多攒多少条一起写
+_QUEUE_DONE = object()      # 结束哨兵
+# 图输出里的 Path 等对象由 default=str 兜底成字符串，无需先递归转换一遍
+_LOG_DUMPS_OPT = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+
+
+def _classify_output(output: Any) -> List[Dict[str, Any]]:
+    """把一条图输出转成要记录的 trace 步骤（record_steps 的参数）；尽量识别 工具调用/结果，过滤 /tmp 噪声。"""
+    step_type = None
+    tool_name = None
+    payload   = None
+
+    if isinstance(output, dict):
+        ev = str(output.get("event") or "")
+        # 形如 {event: 'tool_call', tool_name: 'xxx', args: {...}}
+        if ev in ("tool_call", "call"):
+            step_type = "call"
+            tool_name = output.get("tool") or output.get("tool_name")
+            payload   = output.get("args") or {k: v for k, v in output.items() if k not in ("event",)}
+        # 形如 {event: 'tool_result', tool_name: 'xxx', result: {...}}
+        elif ev in ("tool_result", "result") or ("result" in output):
+            step_type = "result"
+            tool_name = output.get("tool") or output.get("tool_name")
+            payload   = output.get("result") or {k: v for k, v in output.items() if k not in ("event",)}
+        # 已经是图片事件（某些节点也可能主动产出），直接转发
+        elif (output.get("type") == "image") and output.get("content"):
+            return [{
+                "node": output.get("node") or "graph",
+                "step_type": output.get("step_type") or "plot",
+                "type": "image",
+                "content": str(output.get("content")),
+            }]
+        else:
+            step_type = "result"
+            payload   = output
+    else:
+        # 非 dict：也按 result 文本推一次
+        step_type = "result"
+        payload   = output
+
+    # 过滤掉 {"path": "/tmp/tmpxxxx"} 这种噪声
+    if isinstance(payload, dict) and set(payload.keys()) == {"path"} and str(payload.get("path", "")).startswith("/tmp/tmp"):
+        return []
+    if payload is None:
+        return []
+    return [{
+        "step_type": step_type,
+        "type": "trace",
+        "tool_name": tool_name,
+        "result": payload if isinstance(payload, dict) else None,
+        "content": None if isinstance(payload, dict) else str(payload),
+    }]
+
+
+async def _drain(queue: asyncio.Queue) -> Tuple[List[Any], bool]:
+    """等到至少一条，再把已就绪的最多 _WRITER_BATCH 条一起取出；返回 (批次, 是否收到结束哨兵)。"""
+    batch = [await queue.get()]
+    while len(batch) < _WRITER_BATCH and not queue.empty():
+        batch.append(queue.get_nowait())
+    done = any(item is _QUEUE_DONE for item in batch)
+    return [item for item in batch if item is not _QUEUE_DONE], done
+
+
+async def _record_writer(session_id: str, queue: asyncio.Queue) -> None:
+    """实时推流到 trace：一批输出只切一次线程、只刷新一次 MinIO。"""
+    while True:
+        batch, done = await _drain(queue)
+        steps = []
+        for output in batch:
+            try:
+                steps.extend(_classify_output(output))
+            except Exception as _e:
+                # 不要影响主流程
+                logger.debug("stream push ignore error: %s", _e)
+        if steps:
+            try:
+                await arecord_steps(session_id, "graph", steps)
+            except Exception as _e:
+                logger.debug("stream push ignore error: %s", _e)
+        if done:
+            return
+
+
+async def _log_writer(log_path: Path, queue: asyncio.Queue) -> None:
+    """（可选）仍然写入本地 jsonl 备查：文件只打开一次，每批一次 writelines。"""
+    # 写日志失败只记一笔，继续消费队列，避免主循环因队列写满而卡住
+    try:
+        f = await asyncio.to_thread(open, log_path, "ab")
+    except OSError as e:
+        logger.warning("本地日志打开失败：%s", e)
+        f = None
+    try:
+        while True:
+            batch, done = await _drain(queue)
+            if batch and f is not None:
+                try:
+                    lines = [orjson.dumps(o, default=str, option=_LOG_DUMPS_OPT) for o in batch]
+                    await asyncio.to_thread(f.writelines, lines)
+                except Exception as e:
+                    logger.debug("local log ignore error: %s", e)
+            if done:
+                return
+    finally:
+        if f is not None:
+            await asyncio.to_thread(f.close)
 
-    return compiled, tasks, graph_url
 
 # ================== 主流程（流式） ==================
 async def run_dynamic_pipeline_streaming(
@@ -225,8 +373,7 @@ async def run_dynamic_pipeline_streaming(
     logger.info("🟢 [Streaming] 调用 pipeline, file=%s, query=%s", txt_path, user_input)
 
     # 开始事件
-    await asyncio.to_thread(
-        record_step,
+    await arecord_step(
         session_id=session_id,
         node="pipeline",
         step_type="start",
@@ -234,80 +381,42 @@ async def run_dynamic_pipeline_streaming(
         content=f"开始处理：{txt_path}",
     )
 
+    flowchart_task = None
     try:
         # 1) 规划 + 流程图
-        compiled, tasks, graph_url = await _plan_and_graph(user_input, session_id)
+        compiled, tasks, flowchart_task = await _plan_and_graph(user_input, session_id)
 
         # 2) 执行图；将每步输出实时写入 trace（分类为 call/result），前端即可流式显示
-        async for output in compiled.astream({
-            "path": Path(txt_path),
-            "user_input": user_input,
-            "session_id": session_id,
-        }):
-            output = safe_serialize(output)
-
-            # ✅ 实时推流到 trace：尽量识别 工具调用/结果；过滤 /tmp 噪声
-            try:
-                step_type = None
-                tool_name = None
-                payload   = None
-
-                if isinstance(output, dict):
-                    ev = str(output.get("event") or "")
-                    # 形如 {event: 'tool_call', tool_name: 'xxx', args: {...}}
-                    if ev in ("tool_call", "call"):
-                        step_type = "call"
-                        tool_name = output.get("tool") or output.get("tool_name")
-                        payload   = output.get("args") or {k: v for k, v in output.items() if k not in ("event",)}
-                    # 形如 {event: 'tool_result', tool_name: 'xxx', result: {...}}
-                    elif ev in ("tool_result", "result") or ("result" in output):
-                        step_type = "result"
-                        tool_name = output.get("tool") or output.get("tool_name")
-                        payload   = output.get("result") or {k: v for k, v in output.items() if k not in ("event",)}
-                    # 已经是图片事件（某些节点也可能主动产出），直接转发
-                    elif (output.get("type") == "image") and output.get("content"):
-                        record_step(
-                            session_id=session_id,
-                            node=output.get("node") or "graph",
-                            step_type=output.get("step_type") or "plot",
-                            type="image",
-                            content=str(output.get("content")),
-                        )
-                        payload = None  # 已处理
-                    else:
-                        step_type = "result"
-                        payload   = output
-                else:
-                    # 非 dict：也按 result 文本推一次
-                    step_type = "result"
-                    payload   = output
-
-                # 过滤掉 {"path": "/tmp/tmpxxxx"} 这种噪声
-                if isinstance(payload, dict) and set(payload.keys()) == {"path"} and str(payload.get("path", "")).startswith("/tmp/tmp"):
-                    pass
-                elif payload is not None:
-                    record_step(
-                        session_id=session_id,
-                        node="graph",
-                        step_type=step_type,
-                        type="trace",
-                        tool_name=tool_name,
-                        result=payload if isinstance(payload, dict) else None,
-                        content=None if isinstance(payload, dict) else str(payload),
-                    )
-            except Exception as _e:
-                # 不要影响主流程
-                logger.debug("stream push ignore error: %s", _e)
-
-            # （可选）仍然写入本地 jsonl 备查
-            log_path = _LOG_DIR / f"pipeline_{session_id}.jsonl"
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(json.dumps(output, ensure_ascii=False) + "\n")
+        record_queue: asyncio.Queue = asyncio.Queue(maxsize=_WRITER_QUEUE_SIZE)
+        log_queue: asyncio.Queue = asyncio.Queue(maxsize=_WRITER_QUEUE_SIZE)
+        writers = [
+            asyncio.create_task(_record_writer(session_id, record_queue)),
+            asyncio.create_task(_log_writer(_LOG_DIR / f"pipeline_{session_id}.jsonl", log_queue)),
+        ]
+        try:
+            async for output in compiled.astream({
+                "path": Path(txt_path),
+                "user_input": user_input,
+                "session_id": session_id,
+            }):
+                # 主循环只负责入队：推流/落盘由后台 writer 批量完成，节点突发大量事件时不阻塞事件循环
+                await record_queue.put(output)
+                await log_queue.put(output)
+        finally:
+            # 收尾：通知 writer 退出并等它们写完剩余事件
+            for q, w in zip((record_queue, log_queue), writers):
+                if not w.done():
+                    await q.put(_QUEUE_DONE)
+            await asyncio.gather(*writers, return_exceptions=True)
 
     except Exception as e:
         logger.error("❌ Pipeline 执行异常: %s", e)
-        await asyncio.to_thread(
-            record_step,
+        # 流程图不再需要：先取消并等它结束，免得 flowchart 事件晚于 error 落进 trace、任务成孤儿
+        if flowchart_task is not None:
+            flowchart_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await flowchart_task
+        await arecord_step(
             session_id=session_id,
             node="pipeline",
             step_type="exception",
@@ -320,9 +429,11 @@ async def run_dynamic_pipeline_streaming(
             "message": str(e),
         }
 
+    # 流程图在后台生成，结束前收尾拿到 URL（保证 flowchart 事件先于 end）
+    graph_url = await flowchart_task if flowchart_task else None
+
     # 结束事件
-    await asyncio.to_thread(
-        record_step,
+    await arecord_step(
         session_id=session_id,
         node="pipeline",
         step_type="end",
@@ -1,13 +1,24 @@
-from .stats_tools import calc_mean, calc_std, calc_var
-from .viz_tools import time_plot, freq_plot
-from .diagnosis_tools import diagnose_signal
-from .task_selector import choose_tasks
-from .doc_convert_tools import convert_to_markdown_with_ocr
-
-__all__ = [
-    "calc_mean", "calc_std", "calc_var",
-    "time_plot", "freq_plot",
-    "diagnose_signal",
-    "choose_tasks",
-    "convert_to_markdown_with_ocr",
-]
\ No newline at end of file
+"""
+LLM 可调用的工具集合。
+子模块按需导入：只用到统计工具的流程不会顺带加载 torch / pytesseract / pdf2image 等重依赖。
+"""
+import importlib
+
+_EXPORTS = {
+    "calc_mean": "stats_tools", "calc_std": "stats_tools", "calc_var": "stats_tools", "calc_stats": "stats_tools",
+    "time_plot": "viz_tools", "freq_plot": "viz_tools",
+    "diagnose_signal": "diagnosis_tools",
+    "choose_tasks": "task_selector",
+    "convert_to_markdown_with_ocr": "doc_convert_tools",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    mod = _EXPORTS.get(name)
+    if mod is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{mod}", __name__), name)
+    globals()[name] = value
+    return value
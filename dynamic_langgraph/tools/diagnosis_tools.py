@@ -1,8 +1,10 @@
 """CNN‑based fault diagnosis tool exposed to the LLM."""
-import json, torch, torch.nn as nn
+import orjson, os, platform, threading, torch, torch.nn as nn
+import numpy as np
 from pathlib import Path
+from typing import Optional
 from langchain_core.tools import tool
-from ..utils import load_df
+from ..utils import load_df_cached
 
 class SimpleCNN(nn.Module):
     def __init__(self):
@@ -21,7 +23,7 @@ class SimpleCNN(nn.Module):
         self.fc1 = nn.Linear(10*75, 1024)
         self.fc2 = nn.Linear(1024, 4)
     def forward(self, x):
-        x = x.permute(0, 2, 1)
+        """x: (N, 1, 1200)，即 Conv1d 要求的 (batch, channel, length) 布局，调用方直接按此构造，无需 permute。"""
         x = self.pool1(self.bn1(self.conv1(x)))
         x = self.pool2(self.conv2(x))
         x = self.pool3(self.conv3(x))
@@ -32,19 +34,64 @@ class SimpleCNN(nn.Module):
         x = self.dropout(x)
         return self.fc2(x)
 
+# 推理线程数：默认取一半核心，多个工具调用经 asyncio 并发时不至于互相抢核（超额订阅）；
+# 小模型用不上 inter-op 并行，固定 1。DIAG_TORCH_THREADS 可覆盖。
+# 线程数是进程级设置：只在首次真正加载诊断模型时才设（见 _get_model），导入本模块不改动 torch 的全局状态
+_TORCH_THREADS = int(os.getenv("DIAG_TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+
+def _apply_torch_threads() -> None:
+    torch.set_num_threads(_TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # 进程里已有并行任务跑过时不能再改，沿用现值
+
 MODEL_PATH = Path(__file__).resolve().parent.parent.parent / "simple_cnn.pth"
+_LABELS = ("轴承滚珠故障", "健康状态", "轴承内圈故障", "轴承外圈故障")
+
+# CPU 推理时把全连接层动态量化为 int8（fc1 的 750×1024 矩阵占绝大部分计算量）；DIAG_INT8=0 关闭
+_USE_INT8 = os.getenv("DIAG_INT8", "1") == "1"
+
+def _quantize(model: SimpleCNN) -> nn.Module:
+    engines = torch.backends.quantized.supported_engines
+    preferred = "qnnpack" if platform.machine().lower() in ("arm64", "aarch64") else "fbgemm"
+    if preferred not in engines:
+        return model
+    torch.backends.quantized.engine = preferred
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+# 权重只加载一次：进程内单例（eval 模式），并发的首批调用由锁保证只构建一份
+_MODEL: Optional[nn.Module] = None
+_MODEL_LOCK = threading.Lock()
+
+def _get_model() -> nn.Module:
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                _apply_torch_threads()
+                model = SimpleCNN()
+                model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu", weights_only=True))
+                model.eval()
+                if _USE_INT8:
+                    try:
+                        model = _quantize(model)
+                    except Exception:
+                        pass  # 量化不可用时退回 FP32
+                _MODEL = model
+    return _MODEL
 
 @tool
 def diagnose_signal(path: str) -> str:
     """Diagnose vibration signal into 4 classes; returns JSON."""
-    df = load_df(path)
+    df = load_df_cached(path)
     data = df.values.flatten()[:1200]
     if len(data) < 1200:
-        return json.dumps({"error": "INPUT_TOO_SHORT"})
-    model = SimpleCNN()
-    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
-    model.eval()
-    with torch.no_grad():
-        out = model(torch.tensor(data, dtype=torch.float32).unsqueeze(0).unsqueeze(-1))
-        label = ["轴承滚珠故障", "健康状态", "轴承内圈故障", "轴承外圈故障"][out.argmax().item()]
-    return json.dumps({"prediction": label})
+        return orjson.dumps({"error": "INPUT_TOO_SHORT"}).decode()
+    # from_numpy 与 ndarray 共享内存，直接按 (N, C, L) 构造，省掉 torch.tensor 的拷贝与 forward 里的 permute
+    x = torch.from_numpy(np.ascontiguousarray(data, dtype=np.float32)).view(1, 1, 1200)
+    model = _get_model()
+    with torch.inference_mode():
+        out = model(x)
+        label = _LABELS[out.argmax().item()]
+    return orjson.dumps({"prediction": label}).decode()
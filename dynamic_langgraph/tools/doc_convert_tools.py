@@ -5,23 +5,42 @@
 环境依赖：
     - pandoc
     - tesseract-ocr
-    - pip 包：pypandoc python-docx pdfminer.six pytesseract pillow pdf2image
+    - pip 包：pypandoc python-docx pdfminer.six pytesseract pillow pymupdf
+      （未装 pymupdf 时退回 pdf2image + poppler）
 """
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import io
+import os
 import shutil
 import subprocess
-import tempfile
-import uuid
-from typing import List
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
 
 import pytesseract
 from PIL import Image
 
-from pdf2image import convert_from_path  # PDF → image
+try:
+    import fitz  # PyMuPDF：进程内渲染 PDF 页面，不 fork pdftoppm、不经 PPM 中转
+except ImportError:  # pragma: no cover - 可选依赖
+    fitz = None
 
 from dynamic_langgraph import config
 
+# 多张图并行 OCR：每个 pytesseract 调用都是独立的 tesseract 子进程（等待期间不占 GIL），线程池即可；
+# 并行时让每个 tesseract 只用单线程，避免 OpenMP 线程数 × 并发数把 CPU 压爆
+_OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _limit_tesseract_threads() -> None:
+    """
+    OCR 线程池的 initializer：tesseract 子进程继承环境变量，pytesseract 不支持按调用传 env，
+    只能设在本进程环境里；放在这里，只有真正跑并行 OCR 时才设，导入本模块不产生副作用。
+    部署时已显式配置 OMP_THREAD_LIMIT 的沿用配置值。
+    """
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 # ---------- 内部工具 ----------
 
 
@@ -48,41 +67,87 @@ def _pandoc_convert(src: Path, dst: Path) -> None:
         ) from None
 
 
+# --oem 1：只用 LSTM 引擎；--psm 6：按单一文本块识别，跳过整页版面分析
+_TESS_CONFIG = os.getenv("OCR_TESS_CONFIG", "--oem 1 --psm 6")
+_OCR_MAX_SIDE = 2500  # 超过此边长（≈A4 @ 210+ DPI）先减半，tesseract 在 150~200 DPI 上效果最好
+
+
 def _ocr_image(img: Image.Image) -> str:
-    """对单张 PIL.Image 执行 OCR，返回纯文本"""
-    text = pytesseract.image_to_string(img, lang="chi_sim+eng")
+    """对单张 PIL.Image 执行 OCR，返回纯文本（先转灰度、过大则缩小，减少 tesseract 要处理的像素）"""
+    im = img if img.mode == "L" else img.convert("L")
+    if max(im.size) > _OCR_MAX_SIDE:
+        im = im.resize((im.width // 2, im.height // 2), Image.BILINEAR)
+    text = pytesseract.image_to_string(im, lang="chi_sim+eng", config=_TESS_CONFIG)
     return text.strip()
 
 
-def _extract_images_from_docx(src: Path, workdir: Path) -> List[Path]:
+# OCR 输入：图片文件路径，或 (标签, 内存中的 PIL.Image / 未解码的图片字节)
+_OcrItem = Union[Path, Tuple[str, Union[Image.Image, bytes]]]
+
+
+def _ocr_item(item: _OcrItem) -> str:
+    """OCR 一张图片（文件或内存图像）；失败时返回说明文字而不是抛错。"""
+    if isinstance(item, Path):
+        try:
+            with Image.open(item) as im:
+                return _ocr_image(im)
+        except Exception as e:
+            return f"[OCR 失败: {item.name} - {e}]"
+    label, im = item
+    try:
+        # 字节在工作线程里才解码，解码也随 OCR 一起并行
+        if isinstance(im, bytes):
+            im = Image.open(io.BytesIO(im))
+        return _ocr_image(im)
+    except Exception as e:
+        return f"[OCR 失败: {label} - {e}]"
+    finally:
+        if isinstance(im, Image.Image):
+            im.close()
+
+
+def _ocr_parallel(items: Iterable[_OcrItem], fn: Callable[[_OcrItem], str] = _ocr_item) -> List[str]:
+    """
+    并行 OCR，结果保持输入顺序。
+    边产出边提交，同时在途的图片最多 2×workers 张：PDF 页面逐页渲染，不必整本先驻留内存。
     """
-    从 docx 中解包 media 目录里的图片，返回图片路径数组
+    results: List[str] = []
+    with ThreadPoolExecutor(max_workers=max(1, _OCR_WORKERS), initializer=_limit_tesseract_threads) as pool:
+        pending: deque = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * _OCR_WORKERS:
+                results.append(pending.popleft().result())
+        results.extend(f.result() for f in pending)
+    return [t for t in results if t]
+
+
+def _iter_docx_images(src: Path) -> Iterator[Tuple[str, bytes]]:
+    """
+    逐个取出 docx 中 media 目录里的图片（压缩后的原始字节），不落盘，直接交给 OCR。
     """
     import zipfile
 
-    output_images = []
     with zipfile.ZipFile(src) as zf:
         for name in zf.namelist():
             if name.startswith("word/media/") and name.lower().endswith((".png", ".jpg", ".jpeg")):
-                img_data = zf.read(name)
-                out_path = workdir / f"{uuid.uuid4().hex}{Path(name).suffix}"
-                with out_path.open("wb") as f:
-                    f.write(img_data)
-                output_images.append(out_path)
-    return output_images
+                yield Path(name).name, zf.read(name)
 
 
-def _extract_images_from_pdf(src: Path, workdir: Path) -> List[Path]:
+def _iter_pdf_pages(src: Path) -> Iterator[Tuple[str, Image.Image]]:
     """
-    把每页 PDF 渲染成一张 PNG（300 DPI），返回图片路径数组
+    逐页把 PDF 渲染成 300 DPI 灰度图（OCR 不需要颜色，字节量只有 RGB 的 1/3），直接在内存里交给 OCR。
     """
-    pages = convert_from_path(str(src), dpi=300)
-    out_paths = []
-    for i, page in enumerate(pages):
-        out_path = workdir / f"{uuid.uuid4().hex}_p{i}.png"
-        page.save(out_path, "PNG")
-        out_paths.append(out_path)
-    return out_paths
+    if fitz is not None:
+        with fitz.open(str(src)) as doc:
+            for i, page in enumerate(doc):
+                pix = page.get_pixmap(dpi=300, colorspace=fitz.csGRAY, alpha=False)
+                yield f"p{i}", Image.frombytes("L", (pix.width, pix.height), pix.samples)
+        return
+
+    from pdf2image import convert_from_path
+    for i, page in enumerate(convert_from_path(str(src), dpi=300, thread_count=_OCR_WORKERS, grayscale=True)):
+        yield f"p{i}", page
 
 
 # ---------- 对外主函数 ----------
@@ -113,25 +178,13 @@ def convert_to_markdown_with_ocr(src_path: str) -> tuple[str, List[str]]:
         raise ValueError(f"暂不支持 {ext} 文件")
 
     # 2️⃣ 提取图片并 OCR -----------------------------------------
-    with tempfile.TemporaryDirectory() as td:
-        workdir = Path(td)
-        img_paths: List[Path] = []
-
-        if ext in {".doc", ".docx"}:
-            img_paths = _extract_images_from_docx(src, workdir)
-        elif ext == ".pdf":
-            img_paths = _extract_images_from_pdf(src, workdir)
-        # txt / md 不含嵌入图片，不处理
-
-        snippets: List[str] = []
-        for p in img_paths:
-            try:
-                with Image.open(p) as im:
-                    txt = _ocr_image(im)
-                    if txt:
-                        snippets.append(txt)
-            except Exception as e:
-                snippets.append(f"[OCR 失败: {p.name} - {e}]")
+    snippets: List[str] = []
+    # 图片/页面图像都不落盘，取出后直接在内存里 OCR
+    if ext in {".doc", ".docx"}:
+        snippets = _ocr_parallel(_iter_docx_images(src))
+    elif ext == ".pdf":
+        snippets = _ocr_parallel(_iter_pdf_pages(src))
+    # txt / md 不含嵌入图片，不处理
 
     # 3️⃣ 把 OCR 文字追加到 Markdown 末尾 ------------------------
     if snippets:
@@ -1,19 +1,32 @@
 """Statistical calculation tools exposed to the LLM."""
-import json
+import orjson
 from langchain_core.tools import tool
-from ..utils import load_df
+from ..utils import load_df_cached
+
+# 列名是整数（header=None），需 OPT_NON_STR_KEYS；NaN（如单行数据的 std）会序列化为 null，保证是合法 JSON
+_DUMPS_OPT = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _dumps(obj) -> str:
+    return orjson.dumps(obj, option=_DUMPS_OPT).decode()
 
 @tool
 def calc_mean(path: str) -> str:
     """Return per‑column means as JSON."""
-    return json.dumps({"mean": load_df(path).mean().to_dict()})
+    return _dumps({"mean": load_df_cached(path).mean().to_dict()})
 
 @tool
 def calc_std(path: str) -> str:
     """Return per‑column standard deviations as JSON."""
-    return json.dumps({"std": load_df(path).std().to_dict()})
+    return _dumps({"std": load_df_cached(path).std().to_dict()})
 
 @tool
 def calc_var(path: str) -> str:
     """Return per‑column variances as JSON."""
-    return json.dumps({"var": load_df(path).var().to_dict()})
+    return _dumps({"var": load_df_cached(path).var().to_dict()})
+
+@tool
+def calc_stats(path: str) -> str:
+    """Return per‑column mean, std and var in one pass as JSON; prefer this when more than one statistic is needed."""
+    agg = load_df_cached(path).agg(["mean", "std", "var"])
+    return _dumps(agg.to_dict(orient="index"))
@@ -1,39 +1,81 @@
-import re, json, logging
-from pathlib import Path
-from typing import List
+import logging
+from typing import Any, Dict, List, Optional, Tuple
 from langchain_core.tools import tool
-from ..config import CASE_PATH, DEFAULT_TASK_FLOW
+from ..config import DEFAULT_TASK_FLOW
 
-_VALID_TASKS = {
+_VALID_TASKS = frozenset({
     "analysis", "viz", "diagnosis",
     "summarizer", "convert_md", "md_summary","asr","audio_summary"
-}
+})
+
+def _all_valid(tasks: list) -> bool:
+    """一次 C 层的子集判断代替逐个 in；含不可哈希的元素（如 dict）时视为非法。"""
+    try:
+        return _VALID_TASKS.issuperset(tasks)
+    except TypeError:
+        return False
+
+# (模板列表对象, 校验结果)：load_case_templates 在 case.json 未改动时返回同一个列表对象，
+# 以它为准就和 planner 用同一份模板、同一个失效条件
+_TABLE_CACHE: Optional[Tuple[List[Dict[str, Any]], Tuple[Optional[Tuple[str, ...]], ...]]] = None
+
+def _load_templates() -> Tuple[Optional[Tuple[str, ...]], ...]:
+    """
+    取模板并预先校验：第 i 项为模板 #i+1 的 tasks（非法则为 None）。
+    模板来自 case_loader.load_case_templates（case.json 唯一的缓存），这里只缓存校验结果。
+    """
+    global _TABLE_CACHE
+    from ..case_loader import load_case_templates  # case_loader 导入了本模块，这里按需导入避免循环
+    templates = load_case_templates()
+    cached = _TABLE_CACHE
+    if cached is not None and cached[0] is templates:
+        return cached[1]
+    table = []
+    for tpl in templates:
+        tasks = tpl.get("tasks", []) if isinstance(tpl, dict) else []
+        ok = isinstance(tasks, list) and tasks and _all_valid(tasks)
+        table.append(tuple(tasks) if ok else None)
+    _TABLE_CACHE = (templates, tuple(table))
+    return _TABLE_CACHE[1]
+
+def _first_int(text: str) -> Optional[int]:
+    """取字符串里第一串数字（同正则 \\d+ 的语义），直接扫描字符，不走正则引擎。"""
+    n = len(text)
+    i = 0
+    while i < n and not text[i].isdecimal():
+        i += 1
+    if i == n:
+        return None
+    j = i + 1
+    while j < n and text[j].isdecimal():
+        j += 1
+    return int(text[i:j])
 
 @tool
 def choose_tasks(index: str) -> List[str]:
     """index 可以带杂字符，只抓里面第一串数字做序号"""
-    # 1) 读模板
+    # 1) 读模板（case.json 未改动时直接命中缓存）
     try:
-        templates = json.load(Path(CASE_PATH).open(encoding="utf-8"))
+        table = _load_templates()
     except Exception as exc:
         logging.warning("case.json 读取失败：%s → 默认流程", exc)
         return DEFAULT_TASK_FLOW
 
     # 2) 提取数字序号（更宽容）
-    m = re.search(r"\d+", index)
-    if not m:
+    num = _first_int(index)
+    if num is None:
         logging.warning("字符串 '%s' 内未找到数字 → 默认流程", index)
         return DEFAULT_TASK_FLOW
 
-    idx = int(m.group()) - 1           # 转 0-based
-    if idx < 0 or idx >= len(templates):
+    idx = num - 1                      # 转 0-based
+    if idx < 0 or idx >= len(table):
         logging.warning("序号 %s 超出模板范围 → 默认流程", idx + 1)
         return DEFAULT_TASK_FLOW
 
-    # 3) 拿 tasks 并校验
-    tasks = templates[idx].get("tasks", [])
-    if not (isinstance(tasks, list) and tasks and all(t in _VALID_TASKS for t in tasks)):
+    # 3) 拿 tasks（已在加载时校验）
+    tasks = table[idx]
+    if tasks is None:
         logging.warning("模板 #%s 的 tasks 非法 → 默认流程", idx + 1)
         return DEFAULT_TASK_FLOW
 
-    return tasks
+    return list(tasks)
@@ -1,39 +1,148 @@
 """Visualization tools exposed to the LLM."""
-import json, uuid
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+import os
+import uuid
+import asyncio
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Optional
+import orjson
 import numpy as np
 from langchain_core.tools import tool
 from ..config import PLOTS_DIR
-from ..utils import load_df
+from ..utils import load_df_cached
+
+# 不经过 pyplot：每次调用自建 Figure + Agg 画布，没有全局的“当前 figure”与 figure 注册表，
+# 多个会话的绘图工具可以在各自线程里并行渲染，无需加锁，也不必 close
+# 出图参数：dpi 80（默认 100）像素少约 1/3；PNG 用 zlib 1 级压缩，编码快得多、体积只稍大
+_PLOT_DPI = int(os.getenv("VIZ_PLOT_DPI", "80"))
+_PNG_KWARGS = {"compress_level": 1, "optimize": False}
+
+@lru_cache(maxsize=None)
+def _mpl():
+    """首次绘图时才 import matplotlib（几十 MB 常驻内存、数百毫秒导入），只用文本/音频工具的进程不必付这笔开销。"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    return Figure, FigureCanvasAgg
+
+def _new_axes():
+    Figure, _ = _mpl()
+    fig = Figure(figsize=(6, 4), dpi=_PLOT_DPI)
+    return fig, fig.subplots()
+
+def _png_bytes(fig) -> bytes:
+    """渲染到内存里的 PNG 字节（不落盘；落不落盘由调用方决定）。"""
+    _, FigureCanvasAgg = _mpl()
+    fig.tight_layout()
+    buf = BytesIO()
+    FigureCanvasAgg(fig).print_png(buf, pil_kwargs=_PNG_KWARGS)
+    return buf.getvalue()
+
+@lru_cache(maxsize=32)
+def _rfft_freqs(n: int, d: float = 1.0) -> np.ndarray:
+    """按点数缓存 rfft 的频率轴（各调用共享，设为只读）。"""
+    xf = np.fft.rfftfreq(n, d)
+    xf.setflags(write=False)
+    return xf
+
+def _load_columns(path: str) -> tuple[np.ndarray, list[str]]:
+    """在调用方进程里取前 4 列（走 load_df_cached，同一文件只解析一次）；只把数组和列名交给渲染进程。"""
+    df = load_df_cached(path)
+    return df.iloc[:, :4].to_numpy(), [str(c) for c in df.columns[:4]]
+
+# ---- 实际渲染：普通函数，只吃 numpy 数组，可直接在进程池里执行（子进程不再重复读盘解析文件）；返回 PNG 字节 ----
+def _render_time(arr: np.ndarray, labels: list[str]) -> bytes:
+    # 直接把 (N, 列) 数组交给 matplotlib：每列一条线，x 轴即行号（同 DataFrame.plot 的 RangeIndex），省掉 pandas 绘图封装
+    fig, ax = _new_axes()
+    ax.plot(arr)
+    ax.set_title("Time‑domain")
+    ax.legend(labels)
+    return _png_bytes(fig)
+
+def _render_freq(arr: np.ndarray, labels: list[str]) -> bytes:
+    N = len(arr)
+    T = 1.0
+    xf = _rfft_freqs(N, T)
+    # 各列一次批量 rfft：转置后每列是连续的一行，变换轴放在最后一维（pocketfft 的快路径）；
+    # 画图用单精度足够：float32 输入在 numpy≥2 上走单精度 FFT，得到 complex64，带宽减半
+    arr = np.ascontiguousarray(arr.astype(np.float32, copy=False).T)
+    mag = np.abs(np.fft.rfft(arr, axis=-1))
+    fig, ax = _new_axes()
+    ax.plot(xf, mag.T)
+    ax.set_title("Frequency Spectrum")
+    ax.legend(labels)
+    return _png_bytes(fig)
+
+# 工具名 → (图片文件名前缀, 渲染函数)
+_RENDERERS = {
+    "time_plot": ("time", _render_time),
+    "freq_plot": ("freq", _render_freq),
+}
+
+# FFT + 栅格化 + PNG 压缩都是 CPU 活，Python 侧的绘图代码还持有 GIL：放进进程池才能真正多核并行。
+# 首次绘图时才建池（spawn：服务进程里有线程，fork 不安全），之后常驻复用；文件解析留在本进程（load_df_cached），
+# 子进程只收数组、只做 FFT + 出图。池的价值在同时出多张图/多会话并发；只偶尔出单张图的部署
+# 设 VIZ_PLOT_PROCS=0，在调用线程里直接渲染，省掉首次拉起子进程（import numpy/matplotlib）的冷启动
+_PLOT_PROCS = int(os.getenv("VIZ_PLOT_PROCS", str(min(4, os.cpu_count() or 1))))
+_PLOT_POOL: Optional[ProcessPoolExecutor] = None
+_PLOT_POOL_LOCK = threading.Lock()
+
+def _plot_pool() -> Optional[ProcessPoolExecutor]:
+    global _PLOT_POOL
+    if _PLOT_PROCS <= 0:
+        return None
+    if _PLOT_POOL is None:
+        with _PLOT_POOL_LOCK:
+            if _PLOT_POOL is None:
+                _PLOT_POOL = ProcessPoolExecutor(
+                    max_workers=_PLOT_PROCS, mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _PLOT_POOL
+
+def image_name(name: str) -> str:
+    """给工具 name 的产物起一个不重名的文件名，如 freq_<uuid>.png。"""
+    prefix, _ = _RENDERERS[name]
+    return f"{prefix}_{uuid.uuid4().hex}.png"
+
+def render_bytes(name: str, path: str) -> bytes:
+    """同步渲染，返回 PNG 字节：有进程池时提交并等待结果；池不可用时退回本线程渲染。"""
+    _, fn = _RENDERERS[name]
+    arr, labels = _load_columns(path)
+    pool = _plot_pool()
+    if pool is not None:
+        try:
+            return pool.submit(fn, arr, labels).result()
+        except BrokenProcessPool:
+            pass
+    return fn(arr, labels)
+
+async def arender_bytes(name: str, path: str) -> bytes:
+    """异步渲染（节点用）：等待进程池结果时不占用线程，也不阻塞事件循环；字节直接拿去上传，不落盘。"""
+    _, fn = _RENDERERS[name]
+    arr, labels = await asyncio.to_thread(_load_columns, path)
+    pool = _plot_pool()
+    if pool is not None:
+        try:
+            return await asyncio.wrap_future(pool.submit(fn, arr, labels))
+        except BrokenProcessPool:
+            pass
+    return await asyncio.to_thread(fn, arr, labels)
+
+def render(name: str, path: str) -> str:
+    """工具入口：渲染后写到 PLOTS_DIR，返回 {"image_path": ...} 的 JSON（供需要本地文件的调用方）。"""
+    img = PLOTS_DIR / image_name(name)
+    img.write_bytes(render_bytes(name, path))
+    return orjson.dumps({"image_path": str(img)}).decode()
 
 @tool
 def time_plot(path: str) -> str:
     """Plot first 4 numeric columns over time; return JSON with image path."""
-    df = load_df(path)
-    img = PLOTS_DIR / f"time_{uuid.uuid4().hex}.png"
-    df.iloc[:, :4].plot(figsize=(6, 4), title="Time‑domain")
-    plt.tight_layout()
-    plt.savefig(img)
-    plt.close()
-    return json.dumps({"image_path": str(img)})
+    return render("time_plot", path)
 
 @tool
 def freq_plot(path: str) -> str:
     """Simple FFT plot for first 4 columns; return JSON with image path."""
-    df = load_df(path)
-    N = len(df)
-    T = 1.0
-    xf = np.fft.rfftfreq(N, T)
-    img = PLOTS_DIR / f"freq_{uuid.uuid4().hex}.png"
-    plt.figure(figsize=(6, 4))
-    for col in df.columns[:4]:
-        yf = np.fft.rfft(df[col].values)
-        plt.plot(xf, np.abs(yf), label=str(col))
-    plt.title("Frequency Spectrum")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(img)
-    plt.close()
-    return json.dumps({"image_path": str(img)})
+    return render("freq_plot", path)
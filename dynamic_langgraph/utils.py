@@ -1,29 +1,125 @@
 """Utility helpers used across the project."""
-import base64, mimetypes
+import base64, io, mimetypes, mmap
 from pathlib import Path
 import pandas as pd
-from typing import Any
+from typing import Any, Callable
 from pprint import pprint
-from langchain_core.messages import AIMessage
-import datetime, uuid, logging, os
+from collections import OrderedDict
+from functools import lru_cache
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import os
 import re
+import hashlib, threading
+
+def _read_numeric(path: str | Path, sep: str) -> pd.DataFrame:
+    """
+    先按全 float64 解析（C 引擎，跳过逐列类型推断与 select_dtypes）；
+    有非数值列时才退回推断类型 + 只保留数值列。sep=r"\\s+" 在 pandas 里同样走 C 引擎。
+    """
+    try:
+        return pd.read_csv(path, sep=sep, header=None, dtype="float64", engine="c")
+    except (ValueError, TypeError):
+        return pd.read_csv(path, sep=sep, header=None, engine="c").select_dtypes(include="number")
+
+def _sniff_sep(path: str | Path) -> str:
+    """看首行判断分隔符：有逗号按 CSV，否则按空白分隔。"""
+    with open(path, "rb") as f:
+        first = f.read(1024).split(b"\n", 1)[0]
+    return "," if b"," in first else r"\s+"
 
 def load_df(path: str | Path) -> pd.DataFrame:
     """Robustly read numeric TXT/CSV into a DataFrame."""
+    # 先探测分隔符，通常只解析一遍；探测失误导致解析报错时再换另一种分隔符
+    sep = _sniff_sep(path)
     try:
-        return pd.read_csv(path, sep=r"\s+", header=None).select_dtypes(include="number")
+        return _read_numeric(path, sep)
     except Exception:
-        return pd.read_csv(path, header=None).select_dtypes(include="number")
+        return _read_numeric(path, r"\s+" if sep == "," else ",")
+
+# load_df 的进程内缓存：同一文件被多个工具（mean/std/var、绘图、诊断）读取时只解析一次。
+# 键含 mtime/size，文件被覆盖后自动失效；同一键的并发首读由各自的锁合并成一次解析。
+# 返回的 DataFrame 在调用方之间共享，只读使用，不要原地修改。
+_DF_CACHE_MAX = int(os.getenv("DLG_DF_CACHE_SIZE", "32"))
+_DF_CACHE: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
+_DF_LOCKS: dict[tuple, threading.Lock] = {}
+_DF_GUARD = threading.Lock()
 
-def b64_image(image_path: str | Path) -> str:
-    """Return data‑URL string for an image, convenient for multimodal LLMs."""
+def load_df_cached(path: str | Path) -> pd.DataFrame:
+    """load_df 的缓存版本，按 (路径, mtime, size) 复用解析结果。"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _DF_GUARD:
+        df = _DF_CACHE.get(key)
+        if df is not None:
+            _DF_CACHE.move_to_end(key)
+            return df
+        lock = _DF_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        with _DF_GUARD:
+            df = _DF_CACHE.get(key)
+        if df is None:
+            try:
+                df = load_df(path)
+                with _DF_GUARD:
+                    _DF_CACHE[key] = df
+                    while len(_DF_CACHE) > _DF_CACHE_MAX:
+                        _DF_CACHE.popitem(last=False)
+            finally:
+                with _DF_GUARD:
+                    _DF_LOCKS.pop(key, None)
+    return df
+
+# 给多模态 LLM 的图片可先转成 JPEG：matplotlib 出的 PNG 转码后通常小 4~8 倍，而上传带宽是视觉接口的主要耗时。
+# DLG_LLM_JPEG_QUALITY=0 关闭转码；真正带透明通道的图保留 PNG
+_LLM_JPEG_QUALITY = int(os.getenv("DLG_LLM_JPEG_QUALITY", "80"))
+
+def _to_jpeg(data: bytes) -> bytes | None:
+    """PNG 等 → JPEG 字节；有透明像素、无 Pillow 或转码后没变小时返回 None（沿用原图）。"""
+    if _LLM_JPEG_QUALITY <= 0:
+        return None
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.mode == "P":
+                im = im.convert("RGBA")
+            # matplotlib 默认存 RGBA，但 alpha 全是 255，这种可以放心丢掉透明通道
+            if "A" in im.getbands() and im.getchannel("A").getextrema()[0] < 255:
+                return None
+            buf = io.BytesIO()
+            im.convert("RGB").save(buf, format="JPEG", quality=_LLM_JPEG_QUALITY, optimize=True)
+    except Exception:
+        return None
+    out = buf.getvalue()
+    return out if len(out) < len(data) else None
+
+def b64_image(image_path: str | Path, *, compress: bool = False) -> str:
+    """Return data‑URL string for an image, convenient for multimodal LLMs.
+    compress=True 时尽量转成 JPEG 再编码（见 _to_jpeg）。"""
     image_path = Path(image_path)
-    with image_path.open("rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    import mimetypes
     mime = mimetypes.guess_type(image_path)[0] or "image/png"
+    if compress:
+        return b64_bytes(image_path.read_bytes(), mime, compress=True)
+    with image_path.open("rb") as f:
+        # 直接对 mmap 编码，省掉一次整文件 read() 的中间拷贝；空文件无法 mmap，走普通读取
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                b64 = base64.b64encode(mm).decode("ascii")
+        else:
+            b64 = base64.b64encode(f.read()).decode("ascii")
     return f"data:{mime};base64,{b64}"
 
+def b64_bytes(data: bytes, mime: str = "image/png", *, compress: bool = False) -> str:
+    """内存中的图片字节 → data URL（已读入内存时用它，免得再从磁盘读一遍）。
+    compress=True 时尽量转成 JPEG 再编码（见 _to_jpeg）。"""
+    if compress:
+        jpeg = _to_jpeg(data)
+        if jpeg is not None:
+            data, mime = jpeg, "image/jpeg"
+    return f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+
 def debug_ai_message(ai):
     if not isinstance(ai, AIMessage):
         print("❗Not an AIMessage instance:", type(ai))
@@ -41,8 +137,104 @@ def debug_ai_message(ai):
 
 
 
+_THINK_RE = re.compile(r"<think>(.*?)</think>", re.S | re.I)
+
 def split_thought_and_answer(content: str) -> tuple[str, str]:
-    match = re.search(r"<think>(.*?)</think>", content, flags=re.S | re.I)
-    thought = match.group(1).strip() if match else ""
-    answer = re.sub(r"<think>.*?</think>", "", content, flags=re.S | re.I).strip()
+    # 没有任何标签（常见于纯工具调用的回复）时直接返回，免去正则扫描
+    if "<" not in content:
+        return "", content.strip()
+    match = _THINK_RE.search(content)
+    if not match:
+        return "", content.strip()
+    thought = match.group(1).strip()
+    answer = _THINK_RE.sub("", content).strip()
     return thought, answer
+
+
+# ---------- 工具规划类 LLM 调用的记忆化 ----------
+_PLAN_CACHE_MAX = int(os.getenv("DLG_PLAN_CACHE_SIZE", "256"))
+_PLAN_CACHE: "OrderedDict[str, AIMessage]" = OrderedDict()
+try:
+    import diskcache  # 可选：装了就把规划结果持久化到 ./.cache/llm_plans/，跨进程复用
+    _PLAN_DISK = diskcache.Cache(str(Path(__file__).resolve().parent.parent / ".cache" / "llm_plans"))
+except Exception:
+    _PLAN_DISK = None
+
+_PLAN_STATS = {"hits": 0, "misses": 0}
+
+def plan_cache_stats() -> dict[str, int]:
+    """规划缓存的累计命中/未命中次数（进程级）。"""
+    return dict(_PLAN_STATS)
+
+def _has_tool_calls(ai: AIMessage) -> bool:
+    return bool(getattr(ai, "tool_calls", None))
+
+@lru_cache(maxsize=256)
+def _content_digest(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+def file_content_id(path: str | Path) -> str:
+    """文件内容摘要（按 路径+mtime+size 缓存，同一文件只读一遍）。"""
+    st = os.stat(path)
+    return _content_digest(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+# 缓存里的 tool_calls 不存具体路径（对象键输入每次都下载到新的随机临时文件），用占位符代替，取出时换回本次路径
+_PATH_SLOT = "\0FILE_PATH\0"
+
+def _rebase_path(ai: AIMessage, old: str, new: str) -> AIMessage:
+    """返回 tool_calls 参数里值为 old 的项替换成 new 的副本（不改动缓存里的原对象）。"""
+    calls = [
+        {**call, "args": {k: (new if v == old else v) for k, v in (call.get("args") or {}).items()}}
+        for call in ai.tool_calls
+    ]
+    return ai.model_copy(update={"tool_calls": calls})
+
+async def invoke_plan_cached(
+    llm,
+    prompt: str,
+    *,
+    namespace: str,
+    system: SystemMessage | None = None,
+    use_cache: bool = True,
+    accept: Callable[[AIMessage], bool] = _has_tool_calls,
+    file_path: str | None = None,
+) -> AIMessage:
+    """
+    同一 (namespace, system, prompt) 直接复用上次可用的 AIMessage，省掉一次 LLM 往返。
+    system 为调用方在模块级预先构造好的 SystemMessage（静态指令），prompt 只放随请求变化的部分。
+    accept 判断一个回复是否值得缓存（默认：带 tool_calls）；不被接受的结果不缓存，重试仍会问 LLM。
+    use_cache=False 时强制重新调用并刷新缓存。
+    file_path：prompt 里出现的输入文件路径。给了就按文件内容（而不是路径）做键，
+    同一份数据换了临时路径也能命中；命中时 tool_calls 里的路径参数换成本次的 file_path。
+    """
+    sys_text = system.content if system is not None else ""
+    key_prompt = prompt
+    if file_path:
+        try:
+            key_prompt = prompt.replace(file_path, f"<sha1:{file_content_id(file_path)}>")
+        except OSError:
+            file_path = None  # 文件读不了：照常按原 prompt 做键
+    key = hashlib.sha1(f"{namespace}\0{sys_text}\0{key_prompt}".encode("utf-8")).hexdigest()
+    if use_cache:
+        ai = _PLAN_CACHE.get(key)
+        if ai is None and _PLAN_DISK is not None:
+            ai = _PLAN_DISK.get(key)
+        if ai is not None:
+            _PLAN_CACHE[key] = ai
+            _PLAN_CACHE.move_to_end(key)
+            _PLAN_STATS["hits"] += 1
+            return _rebase_path(ai, _PATH_SLOT, file_path) if file_path else ai
+    _PLAN_STATS["misses"] += 1
+
+    messages = [HumanMessage(content=prompt)] if system is None else [system, HumanMessage(content=prompt)]
+    ai = await llm.ainvoke(messages)
+    if accept(ai):
+        cached = _rebase_path(ai, file_path, _PATH_SLOT) if file_path else ai
+        _PLAN_CACHE[key] = cached
+        _PLAN_CACHE.move_to_end(key)
+        while len(_PLAN_CACHE) > _PLAN_CACHE_MAX:
+            _PLAN_CACHE.popitem(last=False)
+        if _PLAN_DISK is not None:
+            _PLAN_DISK.set(key, cached)
+    return ai
@@ -8,16 +8,26 @@
 #   MINIO_BUCKET        默认 "dynamic-langgraph"
 #   MINIO_BASE_URL      若提供，用于拼公开直链，如 "http://192.168.100.1:9000"
 #   MINIO_PRESIGN_HOURS 预签名有效期小时数（无 BASE_URL 时生效），默认 24
+#   MINIO_SKIP_BUCKET_CHECK "1" 时跳过首次的 bucket_exists/make_bucket（桶确定已存在的线上环境），默认 "0"
 
 import os
-import posixpath
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import mimetypes
+from io import BytesIO
+from functools import lru_cache
 from datetime import timedelta
 from pathlib import Path
-from typing import Optional, Dict, Any, Iterable
+from typing import Optional, Dict, Any, Iterable, Iterator, BinaryIO, Tuple
 from minio import Minio
+from minio.commonconfig import ComposeSource, CopySource
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error, InvalidResponseError
 
+logger = logging.getLogger("dynamic-langgraph.minio_client")
+
 # -------- 配置 ----------
 MINIO_ENDPOINT   = os.getenv("MINIO_ENDPOINT", "192.168.100.1:9000").strip()
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "").strip()
@@ -26,44 +36,69 @@ MINIO_SECURE     = os.getenv("MINIO_SECURE", "0").strip() in ("1", "true", "TRUE
 MINIO_BUCKET     = os.getenv("MINIO_BUCKET", "dynamic-langgraph").strip()
 MINIO_BASE_URL   = os.getenv("MINIO_BASE_URL", "").strip().rstrip("/")
 PRESIGN_HOURS    = int(os.getenv("MINIO_PRESIGN_HOURS", "24"))
+SKIP_BUCKET_CHECK = os.getenv("MINIO_SKIP_BUCKET_CHECK", "0").strip() in ("1", "true", "TRUE", "True")
 
 # 暴露给外部（api_server 会引用这两个）
 MINIO_BASE_URL = MINIO_BASE_URL
 MINIO_BUCKET   = MINIO_BUCKET
 
 _client: Optional[Minio] = None
+_client_lock = threading.Lock()
+# 已确认存在的桶：客户端重建（如 fork 后）不再重复 bucket_exists 往返
+_checked_buckets: set = set()
 
 
 def _client_instance() -> Minio:
-    """单例 Minio 客户端；确保桶存在。"""
+    """单例 Minio 客户端；确保桶存在。并发的首批调用由锁保证只建一个客户端。"""
     global _client
     if _client is None:
-        if not MINIO_ACCESS_KEY or not MINIO_SECRET_KEY:
-            raise RuntimeError("MINIO_ACCESS_KEY / MINIO_SECRET_KEY 未设置，请在环境变量中配置。")
-        _client = Minio(
-            endpoint=MINIO_ENDPOINT,
-            access_key=MINIO_ACCESS_KEY,
-            secret_key=MINIO_SECRET_KEY,
-            secure=MINIO_SECURE,
-        )
-        _ensure_bucket(_client, MINIO_BUCKET)
+        with _client_lock:
+            if _client is None:
+                if not MINIO_ACCESS_KEY or not MINIO_SECRET_KEY:
+                    raise RuntimeError("MINIO_ACCESS_KEY / MINIO_SECRET_KEY 未设置，请在环境变量中配置。")
+                cli = Minio(
+                    endpoint=MINIO_ENDPOINT,
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=MINIO_SECURE,
+                )
+                _ensure_bucket(cli, MINIO_BUCKET)
+                _client = cli
     return _client
 
 
 def _ensure_bucket(cli: Minio, bucket: str) -> None:
+    if SKIP_BUCKET_CHECK or bucket in _checked_buckets:
+        return
     if not cli.bucket_exists(bucket):
         cli.make_bucket(bucket)
+    _checked_buckets.add(bucket)
 
 
-def _guess_content_type(path: str) -> str:
-    ctype, _ = mimetypes.guess_type(path)
+# 上传热路径里只按扩展名查类型：mimetypes 表在导入时就初始化好，结果按后缀缓存
+mimetypes.init()
+# trace 等 jsonl 文件：系统表里通常没有，补上，免得落成 application/octet-stream
+mimetypes.add_type("application/x-ndjson", ".jsonl")
+
+
+@lru_cache(maxsize=256)
+def _content_type_for_suffix(suffix: str) -> str:
+    ctype, _ = mimetypes.guess_type("x" + suffix)
     return ctype or "application/octet-stream"
 
 
+def _guess_content_type(path: str) -> str:
+    suffix = os.path.splitext(str(path))[1].lower()
+    if suffix in mimetypes.encodings_map:
+        # .gz/.bz2 等压缩后缀要结合前一段扩展名判断，走完整的 guess_type
+        ctype, _ = mimetypes.guess_type(str(path))
+        return ctype or "application/octet-stream"
+    return _content_type_for_suffix(suffix)
+
+
 def _path_join(*parts: str) -> str:
-    """使用 / 连接对象键片段；过滤空段。"""
-    parts = [str(p).strip("/") for p in parts if p and str(p).strip("/")]
-    return "/".join(parts)
+    """使用 / 连接对象键片段；过滤空段（每段只 strip 一次，不建中间列表）。"""
+    return "/".join(seg for seg in (str(p).strip("/") for p in parts if p) if seg)
 
 
 def _object_public_url(object_key: str) -> Optional[str]:
@@ -89,30 +124,80 @@ def object_url(object_key: str) -> str:
 
 # -------------- 上传/下载 ----------------
 
-def upload_file_to_minio(local_path: str, object_key: str, content_type: Optional[str] = None) -> str:
-    """上传本地文件到 MinIO；返回可访问 URL。"""
+def upload_file_to_minio(local_path: str, object_key: str, content_type: Optional[str] = None,
+                         part_size: int = 0) -> str:
+    """
+    上传本地文件到 MinIO；返回可访问 URL。
+    part_size：分片大小（字节，>= 5MiB）；文件不超过它时一次 PUT，超过才走 multipart。0 = SDK 自动（5MiB 起）。
+    """
     cli = _client_instance()
     local_path = str(local_path)
     if content_type is None:
         content_type = _guess_content_type(local_path)
 
-    size = os.path.getsize(local_path)
-    with open(local_path, "rb") as f:
-        cli.put_object(
+    # fput_object 自己按块流式读文件，超过分片阈值时自动走 multipart
+    cli.fput_object(
+        MINIO_BUCKET,
+        object_key,
+        local_path,
+        content_type=content_type,
+        part_size=part_size,
+    )
+    return object_url(object_key)
+
+
+# compose 要求除最后一个外的源对象都 >= 5MiB
+COMPOSE_MIN_SOURCE_SIZE = 5 * 1024 * 1024
+
+
+def append_file_to_minio(local_path: str, object_key: str, offset: int, length: int,
+                         content_type: Optional[str] = None, part_size: int = 0) -> None:
+    """
+    把本地文件 [offset, offset+length) 这一段追加到已有对象末尾：
+    先传成临时对象 {object_key}.part-{offset}，再 compose_object([原对象, 临时对象]) 覆盖原对象，最后删临时对象。
+    offset=0 时就是普通上传（只传前 length 字节）。
+    调用方保证 offset 等于 MinIO 上原对象的大小，且 offset >= COMPOSE_MIN_SOURCE_SIZE（否则 compose 会被拒）。
+    读者看到的要么是旧对象要么是拼好的新对象，对象只会变长。
+    """
+    cli = _client_instance()
+    local_path = str(local_path)
+    if content_type is None:
+        content_type = _guess_content_type(local_path)
+    target = object_key if offset == 0 else f"{object_key}.part-{offset}"
+    try:
+        # 显式给 length：文件还在被追加，只传调用方量好的这一段
+        with open(local_path, "rb") as fh:
+            fh.seek(offset)
+            cli.put_object(
+                MINIO_BUCKET,
+                target,
+                data=fh,
+                length=length,
+                content_type=content_type,
+                part_size=part_size,
+            )
+        if offset == 0:
+            return
+        # compose 不会沿用源对象的 Content-Type，不显式给的话拼完就变成默认类型
+        cli.compose_object(
             MINIO_BUCKET,
             object_key,
-            data=f,
-            length=size,
-            content_type=content_type,
+            [ComposeSource(MINIO_BUCKET, object_key), ComposeSource(MINIO_BUCKET, target)],
+            metadata={"Content-Type": content_type},
         )
-    return object_url(object_key)
+    finally:
+        # 临时分段无论成败都删掉（上传中途失败时可能根本不存在）；清理失败不掩盖原来的异常
+        if offset != 0:
+            try:
+                delete_object(target)
+            except Exception as e:
+                logger.warning("删除临时分段 %s 失败：%s", target, e)
 
 
 def upload_bytes_to_minio(data: bytes, object_key: str, content_type: str = "application/octet-stream") -> str:
     """上传内存 bytes；返回可访问 URL。"""
-    from io import BytesIO
     cli = _client_instance()
-    bio = BytesIO(data)
+    bio = BytesIO(data)  # 对 bytes 不拷贝（写时才复制），只是给 SDK 一个可读流
     cli.put_object(
         MINIO_BUCKET,
         object_key,
@@ -123,6 +208,38 @@ def upload_bytes_to_minio(data: bytes, object_key: str, content_type: str = "app
     return object_url(object_key)
 
 
+def stream_upload_to_minio(
+    stream: BinaryIO,
+    length: int,
+    object_key: str,
+    content_type: Optional[str] = None,
+    part_size: int = 16 * 1024 * 1024,
+) -> str:
+    """
+    把可读流直接写入 MinIO（不落本地文件）；返回可访问 URL。
+    length 未知时传 -1，SDK 会按 part_size 走分片上传。
+    """
+    cli = _client_instance()
+    if content_type is None:
+        content_type = _guess_content_type(object_key)
+    cli.put_object(
+        MINIO_BUCKET,
+        object_key,
+        data=stream,
+        length=length,
+        content_type=content_type,
+        part_size=part_size,
+    )
+    return object_url(object_key)
+
+
+def copy_object_in_minio(src_key: str, dst_key: str) -> str:
+    """服务端复制对象（同桶，数据不经过本机）；返回目标对象的可访问 URL。"""
+    cli = _client_instance()
+    cli.copy_object(MINIO_BUCKET, dst_key, CopySource(MINIO_BUCKET, src_key))
+    return object_url(dst_key)
+
+
 def download_file_from_minio(object_key: str, local_path: str) -> str:
     """下载对象到本地路径；返回本地路径。"""
     cli = _client_instance()
@@ -130,11 +247,172 @@ def download_file_from_minio(object_key: str, local_path: str) -> str:
     return local_path
 
 
+def stream_object_from_minio(object_key: str, chunk_size: int = 64 * 1024,
+                             offset: int = 0, length: int = 0) -> Iterator[bytes]:
+    """
+    按块读取对象内容（不落本地文件）。
+    get_object 在调用时即发出，对象不存在等错误会立刻抛出；返回的迭代器读完后自动释放连接。
+    offset/length：只读对象的某一段（length=0 表示读到末尾），用于 trace 的增量轮询。
+    """
+    cli = _client_instance()
+    resp = cli.get_object(MINIO_BUCKET, object_key, offset=offset, length=length)
+
+    def _iter() -> Iterator[bytes]:
+        try:
+            yield from resp.stream(chunk_size)
+        finally:
+            resp.close()
+            resp.release_conn()
+
+    return _iter()
+
+
+def stream_object_range_from_minio(object_key: str, offset: int, length: int = 0,
+                                   chunk_size: int = 64 * 1024) -> Tuple[Optional[Iterator[bytes]], str]:
+    """
+    按字节范围读取对象，返回 (数据迭代器, Content-Range 头)，供 HTTP Range 请求直接回 206/416。
+    offset 已到/超过对象末尾（增量轮询空闲时的常态）时返回 (None, "bytes */<对象大小>")，调用方回 416。
+    """
+    cli = _client_instance()
+    try:
+        resp = cli.get_object(MINIO_BUCKET, object_key, offset=offset, length=length)
+    except S3Error as e:
+        if getattr(e, "code", "") != "InvalidRange":
+            raise
+        return None, f"bytes */{cli.stat_object(MINIO_BUCKET, object_key).size}"
+
+    content_range = resp.headers.get("Content-Range", "")
+    if not content_range:
+        # 服务端没回 Content-Range（如 offset=0 且未限长时 SDK 不发 Range），按 Content-Length 补一个
+        n = int(resp.headers.get("Content-Length", "0"))
+        content_range = f"bytes {offset}-{offset + n - 1}/{offset + n}"
+
+    def _iter() -> Iterator[bytes]:
+        try:
+            yield from resp.stream(chunk_size)
+        finally:
+            resp.close()
+            resp.release_conn()
+
+    return _iter(), content_range
+
+
+# -------------- 异步上传（aioboto3 可选） ----------------
+# 装了 aioboto3 时 PUT 直接跑在事件循环上，不占线程池；否则退回 to_thread + 同步 SDK。
+try:
+    import aioboto3  # type: ignore
+    from boto3.s3.transfer import TransferConfig  # type: ignore
+    from botocore.config import Config as _BotoConfig  # type: ignore
+except Exception:  # pragma: no cover - 可选依赖
+    aioboto3 = None
+
+# 大文件分片：超过 16MB 走 multipart，8 个分片并行上传
+_TRANSFER_CONFIG = (
+    TransferConfig(multipart_threshold=16 * 1024 * 1024, max_concurrency=8) if aioboto3 is not None else None
+)
+_aclient = None
+_aclient_cm = None  # session.client(...) 返回的异步上下文管理器，关闭客户端要走它的 __aexit__
+_aclient_loop = None
+_aclient_lock = None
+
+
+async def _close_aclient_cm(cm, loop) -> None:
+    """关闭一个 aioboto3 客户端（连同 aiohttp 连接池）；它绑定的事件循环还在别的线程跑时投递过去关。"""
+    try:
+        if loop is not None and loop is not asyncio.get_running_loop() and loop.is_running():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(cm.__aexit__(None, None, None), loop))
+        else:
+            await cm.__aexit__(None, None, None)
+    except Exception:
+        # 旧事件循环已关闭时连接池无法再优雅关闭，只能交给 GC
+        pass
+
+
+async def aclose_aclient() -> None:
+    """关闭进程级的 aioboto3 客户端（应用关停时调用）；没建过则什么也不做。"""
+    global _aclient, _aclient_cm, _aclient_loop, _aclient_lock
+    cm, loop = _aclient_cm, _aclient_loop
+    _aclient = _aclient_cm = _aclient_loop = _aclient_lock = None
+    if cm is not None:
+        await _close_aclient_cm(cm, loop)
+
+
+async def _aclient_instance():
+    """事件循环内单例的 aioboto3 S3 客户端（客户端绑定创建它的事件循环）。"""
+    global _aclient, _aclient_cm, _aclient_loop, _aclient_lock
+    loop = asyncio.get_running_loop()
+    if _aclient is not None and _aclient_loop is loop:
+        return _aclient
+    if _aclient_lock is None or _aclient_loop is not loop:
+        # 换了事件循环：旧客户端不能跨循环复用，先关掉再建新的
+        old_cm, old_loop = _aclient_cm, _aclient_loop
+        _aclient_lock = asyncio.Lock()
+        _aclient_loop = loop
+        _aclient = _aclient_cm = None
+        if old_cm is not None:
+            await _close_aclient_cm(old_cm, old_loop)
+    async with _aclient_lock:
+        if _aclient is None:
+            if not MINIO_ACCESS_KEY or not MINIO_SECRET_KEY:
+                raise RuntimeError("MINIO_ACCESS_KEY / MINIO_SECRET_KEY 未设置，请在环境变量中配置。")
+            session = aioboto3.Session(
+                aws_access_key_id=MINIO_ACCESS_KEY,
+                aws_secret_access_key=MINIO_SECRET_KEY,
+                region_name="us-east-1",
+            )
+            cm = session.client(
+                "s3",
+                endpoint_url=f"{'https' if MINIO_SECURE else 'http'}://{MINIO_ENDPOINT}",
+                config=_BotoConfig(signature_version="s3v4", s3={"addressing_style": "path"}),
+            )
+            cli = await cm.__aenter__()  # 进程级长连接，由 aclose_aclient / 换事件循环时关闭
+            try:
+                # 桶的存在性检查沿用同步客户端（只做一次）
+                await asyncio.to_thread(_client_instance)
+            except BaseException:
+                await _close_aclient_cm(cm, loop)
+                raise
+            _aclient, _aclient_cm = cli, cm
+    return _aclient
+
+
+async def _aobject_url(object_key: str) -> str:
+    pub = _object_public_url(object_key)
+    if pub:
+        return pub
+    return await asyncio.to_thread(_object_presigned_url, object_key)
+
+
+async def aupload_file_to_minio(local_path: str, object_key: str, content_type: Optional[str] = None) -> str:
+    """upload_file_to_minio 的异步版本；返回可访问 URL。"""
+    local_path = str(local_path)
+    if aioboto3 is None:
+        return await asyncio.to_thread(upload_file_to_minio, local_path, object_key, content_type)
+    if content_type is None:
+        content_type = _guess_content_type(local_path)
+    cli = await _aclient_instance()
+    await cli.upload_file(
+        local_path, MINIO_BUCKET, object_key,
+        ExtraArgs={"ContentType": content_type},
+        Config=_TRANSFER_CONFIG,
+    )
+    return await _aobject_url(object_key)
+
+
+async def aupload_bytes_to_minio(data: bytes, object_key: str, content_type: str = "application/octet-stream") -> str:
+    """upload_bytes_to_minio 的异步版本；返回可访问 URL。"""
+    if aioboto3 is None:
+        return await asyncio.to_thread(upload_bytes_to_minio, data, object_key, content_type)
+    cli = await _aclient_instance()
+    await cli.put_object(Bucket=MINIO_BUCKET, Key=object_key, Body=data, ContentType=content_type)
+    return await _aobject_url(object_key)
+
+
 # -------------- Trace 相关 ----------------
 
 def get_trace_object_key(session_id: str) -> str:
     """标准化 trace 文件对象键。"""
-    return _path_join("trace", f"{session_id}.jsonl")
+    return f"trace/{session_id}.jsonl"
 
 
 def get_trace_url(session_id: str) -> str:
@@ -175,6 +453,9 @@ def save_and_yield(
 
 # -------------- 删除 / 清理 ----------------
 
+_MISSING_CODES = ("NoSuchKey", "NoSuchObject")
+
+
 def delete_object(object_key: str, *, missing_ok: bool = True) -> bool:
     """
     删除单个对象。
@@ -186,7 +467,7 @@ def delete_object(object_key: str, *, missing_ok: bool = True) -> bool:
         return True
     except S3Error as e:
         # 对象不存在：NoSuchKey
-        if missing_ok and getattr(e, "code", "") in ("NoSuchKey", "NoSuchObject"):
+        if missing_ok and getattr(e, "code", "") in _MISSING_CODES:
             return True
         raise
     except InvalidResponseError:
@@ -194,37 +475,57 @@ def delete_object(object_key: str, *, missing_ok: bool = True) -> bool:
         raise
 
 
+_DELETE_BATCH = 1000  # S3 批量删除单次上限
+
+
+def _remove_batch(cli: Minio, keys: list, *, missing_ok: bool = True) -> int:
+    """一次 remove_objects 请求删除 keys（≤1000 个）；返回成功数量（不存在且 missing_ok 的也计入）。"""
+    if not keys:
+        return 0
+    failed = 0
+    # remove_objects 是惰性的：必须把返回的错误迭代完，请求才真正发出
+    for err in cli.remove_objects(MINIO_BUCKET, [DeleteObject(k) for k in keys]):
+        if not (missing_ok and getattr(err, "code", "") in _MISSING_CODES):
+            failed += 1
+    return len(keys) - failed
+
+
 def delete_objects(object_keys: Iterable[str], *, missing_ok: bool = True) -> int:
     """
-    批量删除对象（逐个删除，便于兼容所有部署；量大时可改用批量 API）。
+    批量删除对象（S3 批量删除 API，每 1000 个键一次请求）。
     返回成功删除的数量（不存在但 missing_ok=True 的也计入）。
+    某一批请求失败只记日志并跳过这一批，其余批次照常删除；列举 object_keys 本身出错则向上抛出。
     """
+    cli = _client_instance()
     n = 0
-    for key in object_keys:
+    batch: list = []
+
+    def _flush() -> int:
         try:
-            if delete_object(key, missing_ok=missing_ok):
-                n += 1
-        except Exception:
-            # 想更严格可改成 raise
-            pass
+            return _remove_batch(cli, batch, missing_ok=missing_ok)
+        except Exception as e:
+            logger.warning("批量删除失败（%d 个键，首个 %s）：%s", len(batch), batch[0], e)
+            return 0
+
+    for key in object_keys:
+        batch.append(key)
+        if len(batch) >= _DELETE_BATCH:
+            n += _flush()
+            batch = []
+    if batch:
+        n += _flush()
     return n
 
 
 def delete_prefix(prefix: str) -> int:
     """
     删除某个前缀下所有对象（如 pic/<session_id>/、processfiles/<session_id>/）。
-    返回删除数量。
+    边列举边按 1000 个一批批量删除；返回删除数量。
     """
     cli = _client_instance()
-    count = 0
-    for obj in cli.list_objects(MINIO_BUCKET, prefix=prefix, recursive=True):
-        try:
-            cli.remove_object(MINIO_BUCKET, obj.object_name)
-            count += 1
-        except Exception:
-            # 不中断；按需记录日志
-            pass
-    return count
+    return delete_objects(
+        obj.object_name for obj in cli.list_objects(MINIO_BUCKET, prefix=prefix, recursive=True)
+    )
 
 
 def delete_session_artifacts(session_id: str) -> Dict[str, int]:
@@ -237,33 +538,27 @@ def delete_session_artifacts(session_id: str) -> Dict[str, int]:
     返回每个类别删除数量统计。
     """
     stats = {"trace": 0, "pic": 0, "processfiles": 0, "graphs": 0}
-
-    # trace
-    try:
-        if delete_object(_path_join("trace", f"{session_id}.jsonl")):
-            stats["trace"] = 1
-    except Exception:
-        pass
-
-    # pic/
-    try:
-        stats["pic"] = delete_prefix(_path_join("pic", session_id))
-    except Exception:
-        pass
-
-    # processfiles/
-    try:
-        stats["processfiles"] = delete_prefix(_path_join("processfiles", session_id))
-    except Exception:
-        pass
-
-    # graphs/
-    try:
-        key = _path_join("graphs", f"graph_{session_id}.png")
-        if delete_object(key):
-            stats["graphs"] = 1
-    except Exception:
-        pass
+    if not session_id or "/" in session_id:
+        # 空 ID 会让前缀退化成整个 pic/、processfiles/ 目录，直接拒绝
+        return stats
+
+    # 前缀固定，直接拼键；目录前缀带结尾的 /，避免 pic/abc 误删 pic/abcdef/...
+    # 四类互相独立，并发删除：总耗时≈最慢的一类（Minio 客户端可在多线程间共用）
+    jobs = {
+        "trace": (delete_object, get_trace_object_key(session_id)),
+        "pic": (delete_prefix, f"pic/{session_id}/"),
+        "processfiles": (delete_prefix, f"processfiles/{session_id}/"),
+        "graphs": (delete_object, f"graphs/graph_{session_id}.png"),
+    }
+    with ThreadPoolExecutor(max_workers=len(jobs)) as ex:
+        futs = {k: ex.submit(fn, arg) for k, (fn, arg) in jobs.items()}
+        for k, fut in futs.items():
+            try:
+                ret = fut.result()
+            except Exception:
+                continue
+            # delete_object 返回 bool（成功计 1），delete_prefix 返回数量
+            stats[k] = int(ret) if isinstance(ret, bool) else (ret or 0)
 
     return stats
 
@@ -1,8 +1,30 @@
 # pipelines/langgraph_stream_pipeline.py
 from typing import Generator, Iterator, Union, List, Optional, Any, Tuple
 from pydantic import BaseModel, Field
-import requests, json, uuid, os, posixpath, re
-import time, hashlib
+import requests, requests.adapters, json, uuid, os, posixpath, re
+import time, queue, threading, asyncio
+from collections import OrderedDict
+from hashlib import blake2b
+
+try:  # 可选：xxh3 是专为指纹设计的非加密哈希，比 blake2b 还快一个量级；没装就用标准库 blake2b
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:  # 可选：orjson 解析/渲染事件比标准库 json 快数倍，UTF-8 原生处理（等价 ensure_ascii=False）
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # 可选：httpx 在一个共享事件循环上承载所有 SSE 流；装了 h2 时走 HTTP/2，多路流复用同一条连接
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 
 """
 LangGraph Stream v2 (fingerprint + join-window)
@@ -17,22 +39,93 @@ LangGraph Stream v2 (fingerprint + join-window)
 _JOIN_TTL   = float(os.getenv("LG_JOIN_TTL",  "10"))    # 秒，默认 10s
 # 启动防抖：同一“消息指纹”在该窗口内只触发一次 /analyze（避免长流程末尾再次触发）
 _START_TTL  = float(os.getenv("LG_START_TTL", "3600"))  # 秒，默认 1h
+_JOIN_TTL_INT = max(1, int(_JOIN_TTL))                  # 合并时间窗长度（整数秒），只算一次
+# 各去重/缓存表的条目上限：TTL 只在访问时清理，长跑的进程里再加一道容量上限，防止慢性内存增长
+_MAX_FP     = int(os.getenv("LG_MAX_FP", "4096"))
+
+def _hasher():
+    """增量指纹哈希器：32 位十六进制结果，与原 md5 等长。"""
+    return xxhash.xxh3_128() if xxhash is not None else blake2b(digest_size=16)
+
+def _fp(s: str) -> str:
+    """非安全用途的指纹（去重键/兜底会话 ID）。"""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(s)
+    return blake2b(s.encode("utf-8"), digest_size=16).hexdigest()
+
+# ---------- 事件 JSON ----------
+if orjson is not None:
+    _loads = orjson.loads  # 直接吃 bytes，trace 增量读到的行不必先解码
+
+    def _dumps(o: Any) -> str:
+        """事件渲染用的缩进 JSON。"""
+        return orjson.dumps(o, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+else:
+    _loads = json.loads
+
+    def _dumps(o: Any) -> str:
+        """事件渲染用的缩进 JSON。"""
+        return json.dumps(o, ensure_ascii=False, indent=2)
+
+def _json_body(o: Any) -> bytes:
+    """发往后端的请求体：紧凑 JSON（无多余空格，中文不转义），比 requests 的 json= 默认输出更短。"""
+    if orjson is not None:
+        return orjson.dumps(o)
+    return json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# ---------- 后端 HTTP：共享连接池 ----------
+# 所有对后端/MinIO 的请求共用一个 Session，复用 TCP（及 TLS）连接；trace 轮询时每轮都省一次握手
+_HTTP = requests.Session()
+_HTTP.headers["Connection"] = "keep-alive"
+for _scheme in ("http://", "https://"):
+    _HTTP.mount(_scheme, requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+
+# ---------- SSE：共享事件循环 + httpx.AsyncClient ----------
+# 每个并发会话的 SSE 读取都是这条循环上的一个协程，而不是各占一个阻塞读线程
+_ALOOP: Optional[asyncio.AbstractEventLoop] = None
+_ALOOP_LOCK = threading.Lock()
+_AHTTP = None   # httpx.AsyncClient，只在 _ALOOP 线程里创建/使用
+
+def _aloop() -> asyncio.AbstractEventLoop:
+    global _ALOOP
+    if _ALOOP is None:
+        with _ALOOP_LOCK:
+            if _ALOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="lg-sse-loop", daemon=True).start()
+                _ALOOP = loop
+    return _ALOOP
+
+def _ahttp():
+    global _AHTTP
+    if _AHTTP is None:
+        _AHTTP = httpx.AsyncClient(http2=_HTTP2, limits=httpx.Limits(max_connections=32, max_keepalive_connections=16))
+    return _AHTTP
 
 # ---------- 全局映射/去重 ----------
-# 指纹 -> (session_id, 首次分配时间)   （短合并窗）
-_FP2SID: dict[str, tuple[str, float]] = {}
+# 两张表都按时间先后排列（新写入/刷新的挪到末尾），过期清理只需从头部弹出，
+# 遇到第一个未过期的就停：每次只处理真正过期的条目，而不是全表扫描
+# 指纹 -> (session_id, 最近活跃时间)   （短合并窗）
+_FP2SID: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
 # 已触发过 /analyze 的指纹 -> 首次触发时间（长窗口）
-_STARTED: dict[str, float] = {}
+_STARTED: "OrderedDict[str, float]" = OrderedDict()
 
 def _started_recent(fp: str, ttl: float = _START_TTL) -> bool:
     """长窗口防抖：同一条消息（指纹）在 ttl 内只触发一次 /analyze。"""
     now = time.time()
-    for k, t in list(_STARTED.items()):
-        if now - t > ttl:
-            _STARTED.pop(k, None)
+    while _STARTED:
+        t = next(iter(_STARTED.values()))
+        if now - t <= ttl:
+            break
+        _STARTED.popitem(last=False)
     if fp in _STARTED and (now - _STARTED[fp]) < ttl:
         return True
     _STARTED[fp] = now
+    _STARTED.move_to_end(fp)
+    if len(_STARTED) > _MAX_FP:
+        _STARTED.popitem(last=False)
     return False
 
 def _last_user_id(msgs: list) -> str:
@@ -47,7 +140,7 @@ def _last_user_id(msgs: list) -> str:
 def _make_dedupe_key(body: dict, msgs: list, effective_query: str) -> str:
     """
     生成“一轮消息”的指纹（作为 dkey）：
-      fp = md5(conversation_id + last_user_id + normalized_query + time_window)
+      fp = hash(conversation_id + last_user_id + normalized_query + time_window)   （xxh3/blake2b，见 _fp）
     说明：
       - time_window = floor(now / JOIN_TTL)
         * 保证 inlet/outlet 在 JOIN_TTL 内得到同一个指纹（同一个 session_id）
@@ -56,9 +149,16 @@ def _make_dedupe_key(body: dict, msgs: list, effective_query: str) -> str:
     """
     cid = body.get("conversation_id") or body.get("chat_id") or body.get("thread_id") or ""
     uid = _last_user_id(msgs)  # 可能为空；为空也没关系，time_window 可打破历史复用
-    win = int(time.time() // max(1, int(_JOIN_TTL)))  # 合并时间窗编号
-    seed = f"{cid}||uid:{uid}||q:{effective_query}||win:{win}"
-    return hashlib.md5(seed.encode("utf-8")).hexdigest()
+    win = int(time.time()) // _JOIN_TTL_INT  # 合并时间窗编号
+    # 逐段喂给哈希器（结果与哈希整串 f"{cid}||uid:{uid}||q:{query}||win:{win}" 相同），不拼中间字符串
+    h = _hasher()
+    h.update(str(cid).encode("utf-8"))
+    h.update(b"||uid:")
+    h.update(uid.encode("utf-8"))
+    h.update(b"||q:")
+    h.update(effective_query.encode("utf-8"))
+    h.update(b"||win:%d" % win)
+    return h.hexdigest()
 
 def _session_for_turn(dkey: str, ttl: float = _JOIN_TTL) -> str:
     """
@@ -66,15 +166,20 @@ def _session_for_turn(dkey: str, ttl: float = _JOIN_TTL) -> str:
     注意：沿用原函数名以最小化改动；这里 dkey 就是 fingerprint。
     """
     now = time.time()
-    for k, (sid, ts) in list(_FP2SID.items()):
-        if now - ts > ttl:
-            _FP2SID.pop(k, None)
+    while _FP2SID:
+        _, ts = next(iter(_FP2SID.values()))
+        if now - ts <= ttl:
+            break
+        _FP2SID.popitem(last=False)
     if dkey in _FP2SID:
         sid, _ = _FP2SID[dkey]
         _FP2SID[dkey] = (sid, now)  # touch
+        _FP2SID.move_to_end(dkey)
         return sid
     sid = "owui-" + uuid.uuid4().hex[:24]
     _FP2SID[dkey] = (sid, now)
+    if len(_FP2SID) > _MAX_FP:
+        _FP2SID.popitem(last=False)
     return sid
 
 def _touch_turn(dkey: str):
@@ -82,9 +187,22 @@ def _touch_turn(dkey: str):
     if dkey in _FP2SID:
         sid, _ = _FP2SID[dkey]
         _FP2SID[dkey] = (sid, time.time())
+        _FP2SID.move_to_end(dkey)
 
 # 为避免 inlet/outlet 重复登记，缓存一次登记结果（按 session_id + filename + prefer_ext）
-_INGEST_CACHE: dict[str, str] = {}
+class _LRUDict(OrderedDict):
+    """写入即挪到末尾；超过 cap 时淘汰最久未写入的条目。"""
+    def __init__(self, cap: int):
+        super().__init__()
+        self.cap = cap
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.cap:
+            self.popitem(last=False)
+
+_INGEST_CACHE: "_LRUDict[str, str]" = _LRUDict(_MAX_FP)
 def _ingest_ck(session_id: str, filename: str | None, prefer_ext: str | None) -> str:
     return f"{session_id}:{filename or '_auto'}:{prefer_ext or ''}"
 
@@ -180,19 +298,20 @@ class Pipeline:
             return msg if not want_stream else _as_generator([msg])
 
         # 6) 启动分析 —— 按“指纹”做长窗口防抖（默认 1 小时）
-        try:
-            if not _started_recent(dkey, ttl=_START_TTL):
-                requests.post(
-                    f"{base}{self.valves.ANALYZE_PATH}",
-                    json={"file_path": file_path, "query": effective_query, "session_id": session_id},
-                    timeout=15,
-                )
-        except Exception as e:
-            msg = f"启动分析失败：{e}"
-            return msg if not want_stream else _as_generator([msg])
+        # POST 放到后台线程：流式时“已启动”先到 UI，再等 POST 结果（失败则在流里报错）
+        wait_analyze = None
+        if not _started_recent(dkey, ttl=_START_TTL):
+            wait_analyze = _post_in_background(
+                f"{base}{self.valves.ANALYZE_PATH}",
+                {"file_path": file_path, "query": effective_query, "session_id": session_id},
+                timeout=15,
+            )
 
         # 7) 输出：流式 / 非流式
         if not want_stream:
+            err = wait_analyze() if wait_analyze else None
+            if err:
+                return f"启动分析失败：{err}"
             chunks = [f"🟢 已启动（session={session_id}，file={file_path}）\n"]
             chunks += list(_drain_trace_short(base, session_id, self.valves.TRACE_PATH, tries=3, poll_sec=self.valves.TRACE_POLL_SEC))
             return "".join(chunks) or f"🟢 已启动（session={session_id}）。稍后查看过程…"
@@ -200,6 +319,10 @@ class Pipeline:
         # 流式：SSE 优先 → trace 回退
         def _stream():
             yield f"🟢 已启动 LangGraph（session={session_id}，file={file_path}）\n\n"
+            err = wait_analyze() if wait_analyze else None
+            if err:
+                yield f"启动分析失败：{err}"
+                return
             used_sse, any_event, seen_end = False, False, False
 
             if self.valves.MODE.lower() == "sse":
@@ -231,6 +354,19 @@ class Pipeline:
         return _stream()
 
 # --------------- helpers ---------------
+# 每次 inlet/outlet 都要用的正则，导入时编译一次
+_RE_FILE_NOISE  = re.compile(r"\b(FILE|FILENAME)\s*:\s*\S+", re.I)
+_RE_FNAME_NOISE = re.compile(r"\b\S*\d{3,}\S*\.\w+\b")
+_RE_FILE_TAG    = re.compile(r"\bFILE\s*:\s*(\S+)", re.I)
+_RE_FNAME_TAG   = re.compile(r"\bFILENAME\s*:\s*([^\s]+)", re.I)
+_RE_USER_LINE   = re.compile(r"\bUSER:\s*(.+)")
+# trace 行的字节级噪声预筛：content/message/text/result 恰为 {"path": "/tmp/tmp..."} 的事件
+# （与 _format_event 的噪声规则一致；recorder 用 orjson 紧凑输出），命中即跳过，省掉整行 JSON 解码
+_RE_TMP_NOISE   = re.compile(rb'"(?:content|message|text|result)":\{"path":"/tmp/tmp[^"\\]*"\}')
+
+def _is_tmp_noise(ln: bytes) -> bool:
+    return b'"/tmp/tmp' in ln and _RE_TMP_NOISE.search(ln) is not None
+
 def _sticky_session_id(body: dict, msgs: list) -> str:
     """
     旧的“粘性”推导，留作兜底（本 v2 默认不用它来区分一轮消息）
@@ -247,8 +383,10 @@ def _sticky_session_id(body: dict, msgs: list) -> str:
                 return v
     first_user = next((m for m in msgs if m.get("role") == "user"), {})
     seed = (first_user.get("content") or "")[:512]
-    digest = hashlib.md5(seed.encode("utf-8")).hexdigest()
-    return f"owui-{digest[:24]}"
+    if xxhash is None:
+        # blake2b 直接出 12 字节（24 位十六进制），不必先算 16 字节再截断
+        return "owui-" + blake2b(seed.encode("utf-8"), digest_size=12).hexdigest()
+    return "owui-" + xxhash.xxh3_128_hexdigest(seed)[:24]
 
 def _as_generator(lines: List[str]) -> Generator[str, None, None]:
     def gen():
@@ -256,19 +394,48 @@ def _as_generator(lines: List[str]) -> Generator[str, None, None]:
             yield x
     return gen()
 
+def _is_user_tag(s: str, j: int) -> bool:
+    """s[j:] 处的 "USER:" 前面是否是词边界（等价正则里的 \\bUSER:）。"""
+    return j == 0 or not (s[j - 1].isalnum() or s[j - 1] == "_")
+
 def _extract_last_user_from_history_block(text: str) -> Optional[str]:
     """
     兼容“### Task … ### Chat History … <chat_history> …”格式。
     取历史里的最后一条 USER 作为真实用户意图。
+    结果与原来对整段历史 _RE_USER_LINE.findall 后取最后一个完全一致（包括 "USER:" 后只有空白时返回 ""、
+    同一行或隔着空白行的前一个 USER: 把后面的吞进自己的匹配）；但只从末尾附近的同步点开始匹配，不扫整段历史。
     """
-    if "### Chat History:" not in text:
+    if text.find("### Chat History:") < 0:
         return None
-    m = re.search(r"<chat_history>(.*)", text, re.S)
-    if not m:
+    k = text.find("<chat_history>")
+    if k < 0:
         return None
-    hist = m.group(1)
-    users = re.findall(r"\bUSER:\s*(.+)", hist)
-    return users[-1].strip() if users else None
+    hist = text[k + len("<chat_history>"):]
+    end = len(hist)
+    while True:
+        j = hist.rfind("USER:", 0, end)
+        while j >= 0 and not _is_user_tag(hist, j):
+            j = hist.rfind("USER:", 0, j)
+        if j < 0:
+            return None
+        # 同步点：j 所在行的行首。若它之前（跳过空白）紧挨着一个 USER:，那个匹配的 \s* 会跨行延续过来，
+        # 行首就在匹配中间，要退到那个 USER: 所在的行首再看
+        b = hist.rfind("\n", 0, j) + 1
+        while True:
+            w = b
+            while w > 0 and hist[w - 1].isspace():
+                w -= 1
+            if w >= 5 and hist.startswith("USER:", w - 5) and _is_user_tag(hist, w - 5):
+                b = hist.rfind("\n", 0, w - 5) + 1
+            else:
+                break
+        last = None
+        for last in _RE_USER_LINE.finditer(hist, b):
+            pass
+        if last is not None:
+            return last.group(1).strip()
+        # 同步点之后一个匹配都没有（如末尾的 "USER:" 后只剩换行）：最后一个匹配在更前面
+        end = b
 
 def _clean_query_noise(q: str) -> str:
     """
@@ -276,61 +443,80 @@ def _clean_query_noise(q: str) -> str:
     - 去掉 FILE:/FILENAME: 标签
     - 去掉像 xxxxx_ball501.txt 这类文件名（避免指纹被文件名影响）
     """
-    q = re.sub(r"\b(FILE|FILENAME)\s*:\s*\S+", "", q, flags=re.I)
-    q = re.sub(r"\b\S*\d{3,}\S*\.\w+\b", "", q)
+    q = _RE_FILE_NOISE.sub("", q)
+    q = _RE_FNAME_NOISE.sub("", q)
     return q.strip()
 
 def _extract_file_tag(text: str) -> Optional[str]:
     """支持：FILE: uploaded/xxx.ext 或 FILE: /abs/path.ext"""
     if not text:
         return None
-    m = re.search(r"\bFILE\s*:\s*(\S+)", text, re.I)
+    m = _RE_FILE_TAG.search(text)
     return m.group(1) if m else None
 
 def _extract_filename_tag(text: str) -> Optional[str]:
     """支持：FILENAME: name.ext"""
     if not text:
         return None
-    m = re.search(r"\bFILENAME\s*:\s*([^\s]+)", text, re.I)
+    m = _RE_FNAME_TAG.search(text)
     return m.group(1) if m else None
 
 def _looks_like_object_key(s: Optional[str]) -> bool:
     return bool(s and s.startswith("uploaded/"))
 
+_ATTACH_KEYS = ("files", "attachments", "images")
+
+def _attachment_name(x: Any) -> Optional[str]:
+    """单个附件项 → 文件名（basename，去掉 URL 查询串）；认不出返回 None。"""
+    n = None
+    if isinstance(x, str):
+        n = posixpath.basename(x)
+    elif isinstance(x, dict):
+        n = x.get("name") or x.get("filename") or x.get("file_name")
+        if not n:
+            p = x.get("path") or x.get("url")
+            if p:
+                n = posixpath.basename(p)
+    if n:
+        n = posixpath.basename(n.split("?")[0])
+    return n or None
+
 def _extract_attachments_from_body(body: dict, messages: List[dict]) -> List[str]:
     """
     尽力从请求体/消息里找附件信息，返回“文件名（basename）”列表。
     兼容常见字段：files / attachments / images；每项尝试读 name/filename/file_name/path/url。
     """
     names: List[str] = []
-    def add_name(x: Any):
-        n = None
-        if isinstance(x, str):
-            n = posixpath.basename(x)
-        elif isinstance(x, dict):
-            n = x.get("name") or x.get("filename") or x.get("file_name")
-            if not n:
-                p = x.get("path") or x.get("url")
-                if p:
-                    n = posixpath.basename(p)
-        if n:
-            n = n.split("?")[0]
-            n = posixpath.basename(n)
-            names.append(n)
-    for k in ("files", "attachments", "images"):
-        v = body.get(k)
-        if isinstance(v, list):
-            for item in v: add_name(item)
-    for m in messages:
-        for k in ("files", "attachments", "images"):
-            v = m.get(k)
+    for src in (body, *messages):
+        for k in _ATTACH_KEYS:
+            v = src.get(k)
             if isinstance(v, list):
-                for item in v: add_name(item)
-    seen = set(); uniq = []
-    for n in names:
-        if n not in seen:
-            seen.add(n); uniq.append(n)
-    return uniq
+                for item in v:
+                    n = _attachment_name(item)
+                    if n:
+                        names.append(n)
+    return list(dict.fromkeys(names))  # 保序去重
+
+def _post_in_background(url: str, payload: dict, timeout: float):
+    """
+    在后台线程里发 POST，立即返回 wait()。
+    wait() 等请求结束：成功返回 None，失败返回错误信息。
+    """
+    err: List[Optional[str]] = [None]
+
+    def _run():
+        try:
+            _HTTP.post(url, data=_json_body(payload), headers=_JSON_HEADERS, timeout=timeout)
+        except Exception as e:
+            err[0] = str(e)
+
+    t = threading.Thread(target=_run, daemon=True)
+    t.start()
+
+    def wait() -> Optional[str]:
+        t.join()
+        return err[0]
+    return wait
 
 def _try_ingest(base: str, filename: Optional[str], session_id: str, ingest_path: str, prefer_ext: Optional[str]) -> Tuple[bool, str]:
     """
@@ -342,7 +528,7 @@ def _try_ingest(base: str, filename: Optional[str], session_id: str, ingest_path
         payload = {"session_id": session_id}
         if filename:   payload["filename"]    = filename
         if prefer_ext: payload["prefer_ext"]  = prefer_ext
-        r = requests.post(f"{base}{ingest_path}", json=payload, timeout=20)
+        r = _HTTP.post(f"{base}{ingest_path}", data=_json_body(payload), headers=_JSON_HEADERS, timeout=20)
         j = r.json()
         if r.status_code == 200 and j.get("ok"):
             return True, j.get("object")
@@ -350,70 +536,165 @@ def _try_ingest(base: str, filename: Optional[str], session_id: str, ingest_path
     except Exception as e:
         return False, str(e)
 
+# SSE 小批量合并：连发的事件攒成一块再交给 WebUI，减少逐条 chunk 的分帧开销。
+# 攒够 _SSE_FLUSH_CHARS 字符、或首条入缓冲已满 _SSE_FLUSH_SEC 秒、或见到 end 时立即冲刷
+_SSE_FLUSH_CHARS = 4096
+_SSE_FLUSH_SEC   = 0.05
+_SSE_EOF = object()  # 读取结束哨兵
+
+async def _sse_pump(url: str, connect_timeout: float, read_timeout: float, lines: "queue.Queue") -> None:
+    """_ALOOP 上的协程：把 SSE 行搬进队列，结束放 _SSE_EOF，出错放异常对象（由消费方重新抛出）。"""
+    try:
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        async with _ahttp().stream("GET", url, timeout=timeout) as r:
+            r.raise_for_status()
+            async for raw in r.aiter_lines():
+                lines.put(raw)
+        lines.put(_SSE_EOF)
+    except Exception as e:
+        lines.put(e)
+
+def _sse_reader(url: str, timeout: tuple, lines: "queue.Queue", stop: threading.Event) -> None:
+    """未装 httpx 时的后台读线程：requests 流式读取，其余约定同 _sse_pump。"""
+    try:
+        with _HTTP.get(url, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            for raw in r.iter_lines(decode_unicode=True):
+                if stop.is_set():
+                    return
+                lines.put(raw)
+        lines.put(_SSE_EOF)
+    except Exception as e:
+        lines.put(e)
+
+def _open_sse(url: str, connect_timeout: float, read_timeout: float, lines: "queue.Queue"):
+    """开始把 url 的 SSE 行送进 lines；返回 stop()，用于消费方提前结束时关闭连接。"""
+    if httpx is not None:
+        fut = asyncio.run_coroutine_threadsafe(_sse_pump(url, connect_timeout, read_timeout, lines), _aloop())
+        return fut.cancel
+    stop = threading.Event()
+    threading.Thread(target=_sse_reader, args=(url, (connect_timeout, read_timeout), lines, stop), daemon=True).start()
+    return stop.set
+
 def _pipe_from_sse_with_idle(base: str, session_id: str, stream_path: str,
                              connect_timeout: float, idle_timeout: float,
                              on_event=lambda: None):
     """
     连接 SSE；若在 idle_timeout 内没有新的事件，就结束并由上层回退到 trace。
-    产出：(text, any_event_flag, seen_end_flag)
+    产出：(text, any_event_flag, seen_end_flag)；text 可能是若干条事件合并后的文本
     on_event(): 每有事件就调用一次，用于 keep-alive 指纹
+    读取在共享事件循环上（无 httpx 时为后台线程），主循环用带超时的 get 等待，
+    保证缓冲里的事件最迟 _SSE_FLUSH_SEC 秒就发出，不会因为下一行迟迟不来（心跳间隔 10s）而被压住。
     """
     url = f"{base}{stream_path}/{session_id}"
     last_evt = time.time()
     any_event = False
     seen_end = False
-    timeout = (connect_timeout, idle_timeout + 5.0)
-    with requests.get(url, stream=True, timeout=timeout) as r:
-        r.raise_for_status()
-        for raw in r.iter_lines(decode_unicode=True):
-            now = time.time()
-            # keep-alive / comment
-            if raw is None or (isinstance(raw, str) and raw.startswith(":")):
-                if (now - last_evt) > idle_timeout:
-                    break  # 长时间没新事件 → 交给上层回退
-                continue
-            if not isinstance(raw, str) or not raw.startswith("data: "):
-                continue
+    err = None
+    buf: List[str] = []
+    buf_chars = 0
+    first_ts = None     # 缓冲中首条事件的入队时刻（monotonic）
+    lines: "queue.Queue" = queue.Queue()
+    stop = _open_sse(url, connect_timeout, idle_timeout + 5.0, lines)
+    try:
+        while True:
             try:
-                evt = json.loads(raw[6:])
-            except Exception:
-                continue
-            et   = (evt.get("type") or "").lower()
-            node = (evt.get("node") or "").lower()
-            if et == "end" and node in ("pipeline", "api", "service"):
-                seen_end = True
-            out = _format_event(evt)
-            if out:
-                any_event = True
-                last_evt = now
-                on_event()          # 🔸保持指纹活跃
-                yield out, True, seen_end
+                wait = None if first_ts is None else max(0.0, first_ts + _SSE_FLUSH_SEC - time.monotonic())
+                raw = lines.get(timeout=wait)
+            except queue.Empty:
+                raw = None  # 到点：只做冲刷
+            else:
+                if raw is _SSE_EOF:
+                    break
+                if isinstance(raw, Exception):
+                    err = raw
+                    break
+                now = time.time()
+                # keep-alive / comment
+                if raw is None or (isinstance(raw, str) and raw.startswith(":")):
+                    if (now - last_evt) > idle_timeout:
+                        break  # 长时间没新事件 → 交给上层回退
+                elif isinstance(raw, str) and raw.startswith("data: "):
+                    try:
+                        evt = _loads(raw[6:])
+                    except Exception:
+                        evt = None
+                    if evt is not None:
+                        et   = (evt.get("type") or "").lower()
+                        node = (evt.get("node") or "").lower()
+                        if et == "end" and node in _END_NODES:
+                            seen_end = True
+                        out = _format_event(evt)
+                        if out:
+                            any_event = True
+                            last_evt = now
+                            on_event()          # 🔸保持指纹活跃
+                            buf.append(out)
+                            buf_chars += len(out)
+                            if first_ts is None:
+                                first_ts = time.monotonic()
+            if buf and (seen_end or buf_chars >= _SSE_FLUSH_CHARS
+                        or time.monotonic() - first_ts >= _SSE_FLUSH_SEC):
+                yield "".join(buf), True, seen_end
+                buf.clear(); buf_chars = 0; first_ts = None
+    finally:
+        stop()
+    if buf:
+        yield "".join(buf), True, seen_end
+    if err is not None:
+        raise err
     if not any_event:
         yield "", False, seen_end
 
+def _get_trace_bytes(url: str, offset: int = 0, limit: int = 0) -> Optional[bytes]:
+    """
+    按字节偏移读 trace：带 Range 头，只取 offset 之后的部分（limit>0 时最多取 limit 字节）。
+    - 206：服务端已按 Range 切好
+    - 200：服务端忽略了 Range，本地切片兜底
+    - 416：偏移已到末尾，没有新内容
+    其它状态码返回 None，由调用方决定是否回退。
+    """
+    if offset or limit:
+        end = str(offset + limit - 1) if limit > 0 else ""
+        resp = _HTTP.get(url, headers={"Range": f"bytes={offset}-{end}"}, timeout=10)
+    else:
+        resp = _HTTP.get(url, timeout=10)
+    if resp.status_code == 206:
+        return resp.content
+    if resp.status_code == 200:
+        data = resp.content[offset:]
+        return data[:limit] if limit > 0 else data
+    if resp.status_code == 416:
+        return b""
+    return None
+
 def _pipe_from_trace(base: str, session_id: str, trace_path: str, poll_sec: float,
                      on_event=lambda: None):
     """
     持续轮询 trace（优先走后端代理 raw=1；失败再回退直链）。
+    - 按字节偏移增量拉取（Range），每次只下载新增部分；不完整的末行留到下一轮拼接
+    - 自适应轮询间隔：有新事件就减半（不低于 poll_sec），空轮询就翻倍（上限 max(10s, 16×poll_sec)）
     - 单条解析/渲染失败不会中断
     - 一旦看到 end 事件就停止生成（结束流）
     on_event(): 每解析一条就调用一次，用于 keep-alive 指纹
     """
-    import json as _json
     proxy_url  = f"{base}{trace_path}/{session_id}?raw=1"
     use_proxy  = True
     direct_url = None
-    seen       = 0
+    offset     = 0      # 已收到的字节数
+    partial    = b""    # 上一轮末尾未以换行结束的半行
+    min_i      = poll_sec
+    max_i      = max(10.0, poll_sec * 16)
+    interval   = poll_sec
     while True:
+        got_new = False
         try:
             if use_proxy:
-                resp = requests.get(proxy_url, timeout=10)
-                if resp.status_code == 200 and resp.text:
-                    txt = resp.text
-                else:
+                data = _get_trace_bytes(proxy_url, offset)
+                if data is None:
                     use_proxy = False
                     try:
-                        j = requests.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
+                        j = _HTTP.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
                         direct_url = j.get("trace_url")
                     except Exception as e:
                         yield f"获取 trace 直链失败（{e}）。\n"; return
@@ -423,62 +704,67 @@ def _pipe_from_trace(base: str, session_id: str, trace_path: str, poll_sec: floa
             else:
                 if not direct_url:
                     try:
-                        j = requests.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
+                        j = _HTTP.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
                         direct_url = j.get("trace_url")
                     except Exception as e:
                         yield f"获取 trace 直链失败（{e}）。\n"; return
                     if not direct_url:
                         yield "获取 trace 直链失败。\n"; return
-                txt = requests.get(direct_url, timeout=10).text
-            lines = txt.splitlines()
-            for i in range(seen, len(lines)):
+                data = _get_trace_bytes(direct_url, offset) or b""
+            offset += len(data)
+            complete, nl, partial = (partial + data).rpartition(b"\n")
+            got_new = bool(nl)
+            for ln in complete.split(b"\n"):
+                if not ln or _is_tmp_noise(ln):
+                    continue
                 try:
-                    evt = _json.loads(lines[i])
+                    evt = _loads(ln)
                 except Exception:
                     continue
                 # 渲染
                 try:
                     out = _format_event(evt)
                 except Exception as e:
-                    out = f"⚠️ 事件渲染失败：{e}\n\n```json\n" + _json.dumps(evt, ensure_ascii=False, indent=2) + "\n```\n"
+                    out = f"⚠️ 事件渲染失败：{e}\n\n```json\n" + _dumps(evt) + "\n```\n"
                 if out:
                     on_event()      # 🔸保持指纹活跃
                     yield out
                 # 🛑 见到 end 立即结束
                 et   = (evt.get("type") or "").lower()
                 node = (evt.get("node") or "").lower()
-                if et == "end" and node in ("pipeline", "api", "service"):
+                if et == "end" and node in _END_NODES:
                     return
-            seen = len(lines)
         except Exception as e:
             yield f"trace 读取失败，稍后重试…（{e}）\n"
-        time.sleep(poll_sec)
+        interval = max(min_i, interval * 0.5) if got_new else min(max_i, interval * 2.0)
+        time.sleep(interval)
+
+# 非流式短轮询只渲染头几条事件，读前 64KB 足够
+_DRAIN_HEAD_BYTES = 64 * 1024
 
 def _drain_trace_short(base: str, session_id: str, trace_path: str, tries: int, poll_sec: float):
     """非流式场景：短轮询几次，把头几条事件带回，避免 UI 空白。"""
-    import json as _json
     for attempt in range(max(1, tries)):
         try:
             proxy_url = f"{base}{trace_path}/{session_id}?raw=1"
-            resp = requests.get(proxy_url, timeout=10)
-            if resp.status_code == 200 and resp.text:
-                txt = resp.text
-            else:
-                j = requests.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
+            data = _get_trace_bytes(proxy_url, 0, _DRAIN_HEAD_BYTES)
+            if not data:
+                j = _HTTP.get(f"{base}{trace_path}/{session_id}", timeout=10).json()
                 direct_url = j.get("trace_url")
                 if not direct_url: break
-                txt = requests.get(direct_url, timeout=10).text
-            lines = txt.splitlines()
+                data = _get_trace_bytes(direct_url, 0, _DRAIN_HEAD_BYTES) or b""
             out_texts = []
-            for ln in lines[:50]:
+            for ln in data.splitlines()[:50]:
+                if _is_tmp_noise(ln):
+                    continue
                 try:
-                    evt = _json.loads(ln)
+                    evt = _loads(ln)
                 except Exception:
                     continue
                 try:
                     out = _format_event(evt)
                 except Exception as e:
-                    out = f"⚠️ 事件渲染失败：{e}\n\n```json\n" + _json.dumps(evt, ensure_ascii=False, indent=2) + "\n```\n"
+                    out = f"⚠️ 事件渲染失败：{e}\n\n```json\n" + _dumps(evt) + "\n```\n"
                 if out: out_texts.append(out)
             if out_texts:
                 for o in out_texts: yield o
@@ -487,28 +773,36 @@ def _drain_trace_short(base: str, session_id: str, trace_path: str, tries: int,
             pass
         time.sleep(poll_sec)
 
+# _format_event / 结束判定用到的常量集合，模块级只建一次
+_TERMINAL_STATES = frozenset({"start", "end", "error", "exception"})
+_END_NODES       = frozenset({"pipeline", "api", "service"})
+_FILE_TYPES      = frozenset({"file", "document", "artifact"})
+
+def _is_tmp_path_only(x) -> bool:
+    """噪声：只有 /tmp 路径的 {"path": "/tmp/tmp..."}。"""
+    return isinstance(x, dict) and len(x) == 1 and isinstance(x.get("path"), str) and x["path"].startswith("/tmp/tmp")
+
 def _format_event(evt: dict) -> Optional[str]:
     """
     渲染 recorder 事件为聊天文本（过滤 /tmp 噪声；工具调用/结果；图片/流程图；文件；思考；开始/结束/错误）
     """
-    import json as _json
     t  = (evt.get("type") or "").lower()
     st = (evt.get("step_type") or "").lower()
     ev = (evt.get("event") or "").lower()
     content = evt.get("content"); message = evt.get("message"); text = evt.get("text")
-    result  = evt.get("result") if isinstance(evt.get("result"), dict) else None
+    result  = evt.get("result")
+    if not isinstance(result, dict): result = None
     tool    = evt.get("tool_name") or (result.get("tool_name") if result else None)
     # 噪声：只有 /tmp 路径
-    def _is_tmp_path_only(x) -> bool:
-        return isinstance(x, dict) and set(x.keys()) == {"path"} and isinstance(x.get("path"), str) and x["path"].startswith("/tmp/tmp")
     if _is_tmp_path_only(content) or _is_tmp_path_only(message) or _is_tmp_path_only(text) or _is_tmp_path_only(result):
         return None
     url = (evt.get("url") or evt.get("image_url") or (result.get("url") if result else None)
            or (content if isinstance(content, str) and content.startswith(("http://","https://","/")) else None))
     if t == "flowchart" and url: return f"### 流程图\n\n![]({url})\n\n"
+    if t == "mermaid" and isinstance(content, str): return f"### 流程图\n\n```mermaid\n{content}\n```\n\n"
     if (t == "image" or t == "plot") and url:
         title = evt.get("title") or "图像"; return f"**{title}**\n\n![]({url})\n\n"
-    if t in ("file","document","artifact") and url:
+    if t in _FILE_TYPES and url:
         name = (result.get("filename") if result else None) or url.split("/")[-1]; return f"[下载 {name}]({url})\n\n"
     is_tool_call   = (st == "tool_call") or (ev == "tool_call")
     is_tool_result = (st == "tool_result") or (ev == "tool_result")
@@ -519,32 +813,34 @@ def _format_event(evt: dict) -> Optional[str]:
         elif isinstance(text,(dict,list)): args = text
         elif result and isinstance(result.get("args"),(dict,list)): args = result["args"]
         if args is not None:
-            pretty = _json.dumps(args, ensure_ascii=False, indent=2)
+            pretty = _dumps(args)
             return f"🛠️ **调用工具：{tool or '未知工具'}**\n\n```json\n{pretty}\n```\n"
         return f"🛠️ **调用工具：{tool or '未知工具'}**\n\n"
     if is_tool_result:
         payload = result if result is not None else (content if isinstance(content,(dict,list)) else content)
         if isinstance(payload,(dict,list)):
-            pretty = _json.dumps(payload, ensure_ascii=False, indent=2)
+            pretty = _dumps(payload)
             return f"✅ **工具结果（{tool or '未知工具'}）**\n\n```json\n{pretty}\n```\n"
         if isinstance(payload,(str,int,float)):
             return f"✅ **工具结果（{tool or '未知工具'}）**\n\n{str(payload)}\n\n"
-    if evt.get("thought") is not None:
-        model = evt.get("model"); usage = evt.get("usage") if isinstance(evt.get("usage"), dict) else {}
+    thought = evt.get("thought")
+    if thought is not None:
+        model = evt.get("model"); usage = evt.get("usage")
+        if not isinstance(usage, dict): usage = {}
         tok = usage.get("total_tokens") or usage.get("total") or ""
         meta = " (" + " | ".join([s for s in [str(model) if model else None, f"tokens={tok}" if tok else None] if s]) + ")" if (model or tok) else ""
-        out = f"**[THOUGHT]{meta}**\n\n{evt['thought']}\n\n"
-        if isinstance(content,(str,int,float)) and str(content).strip() and str(content).strip() != str(evt["thought"]).strip():
+        out = f"**[THOUGHT]{meta}**\n\n{thought}\n\n"
+        if isinstance(content,(str,int,float)) and str(content).strip() and str(content).strip() != str(thought).strip():
             out += f"**LLM 选择：** {str(content).strip()}\n\n"
         return out
-    if (t in ("start","end","error","exception")) or (st in ("start","end","error","exception")):
+    if (t in _TERMINAL_STATES) or (st in _TERMINAL_STATES):
         body = message if message is not None else (text if text is not None else content)
-        if isinstance(body,(dict,list)): rendered = "```json\n" + _json.dumps(body, ensure_ascii=False, indent=2) + "\n```"
+        if isinstance(body,(dict,list)): rendered = "```json\n" + _dumps(body) + "\n```"
         elif body is None:             rendered = ""
         else:                          rendered = str(body)
         tag = (st or t).upper()
         return f"**[{tag}]** {rendered}\n\n"
     body = message if message is not None else (text if text is not None else content)
     if body is None: return None
-    if isinstance(body,(dict,list)): return "```json\n" + _json.dumps(body, ensure_ascii=False, indent=2) + "\n```\n"
+    if isinstance(body,(dict,list)): return "```json\n" + _dumps(body) + "\n```\n"
     return str(body) + "\n"
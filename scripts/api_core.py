@@ -2,27 +2,34 @@
 # 统一的分析编排入口：校验参数 -> 准备文件 -> 调 LangGraph 流程 -> 推送事件（SSE/trace） -> 收尾
 import os
 import asyncio
+import contextlib
 import tempfile
 import logging
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
-from dotenv import load_dotenv
-load_dotenv()  # 读取项目根目录的 .env
+from scripts.recorder import arecord_step  # 事件推送（SSE & trace）
 
-from scripts.recorder import record_step  # 事件推送（SSE & trace）
-from minio_client import download_file_from_minio
+
+def _load_env_once() -> None:
+    """读取项目根目录的 .env；同一进程里已经读过（如 api_server 先读了）就跳过，连 dotenv 都不导入。"""
+    if os.getenv("LG_ENV_LOADED"):
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    os.environ["LG_ENV_LOADED"] = "1"
+
+
+_load_env_once()
 
 logger = logging.getLogger("dynamic-langgraph.api_core")
 logging.basicConfig(level=logging.INFO)
 
 # ——— 这里按你的实际 pipeline 名称做自动适配 ———
 # 优先顺序：run_pipeline -> run -> analyze
-_PIPELINE_CALLABLE_CACHE = None
+# 解析结果由 lru_cache 记住；解析失败抛异常不会被缓存，下次调用会重试
+@lru_cache(maxsize=1)
 def _resolve_pipeline_callable():
-    global _PIPELINE_CALLABLE_CACHE
-    if _PIPELINE_CALLABLE_CACHE is not None:
-        return _PIPELINE_CALLABLE_CACHE
-
     import importlib
     try:
         pl = importlib.import_module("dynamic_langgraph.pipeline")
@@ -32,13 +39,45 @@ def _resolve_pipeline_callable():
     for name in ("run_pipeline", "run", "analyze"):
         fn = getattr(pl, name, None)
         if callable(fn):
-            _PIPELINE_CALLABLE_CACHE = fn
             logger.info("使用 pipeline 入口函数：dynamic_langgraph.pipeline.%s", name)
             return fn
 
     raise RuntimeError("在 dynamic_langgraph.pipeline 中未找到 run_pipeline/run/analyze 任一可调用入口函数")
 
 
+# 对象键下载的落地目录：默认内存盘 /dev/shm（pipeline 只按路径读文件，放内存盘省掉一次落盘/回读）
+_TMP_DIR = os.getenv("API_TMP_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+def _download_to_tmp(object_key: str) -> str:
+    """
+    把 MinIO 对象下载到临时文件并返回路径（调用方负责删除）。
+    内存盘放不下（容器里 /dev/shm 常只有 64MB）时自动退回系统临时目录。
+    """
+    from minio_client import download_file_from_minio  # 只有对象键分支用得到，按需导入
+    dirs = (_TMP_DIR, None) if _TMP_DIR else (None,)
+    for d in dirs:
+        try:
+            # 目录不存在/不可写时在这里就失败，同样退回下一个目录
+            tmp = tempfile.NamedTemporaryFile(delete=False, dir=d)
+            tmp.close()
+        except OSError:
+            if d is None:
+                raise
+            logger.warning("临时目录 %s 不可用，改用系统临时目录", d)
+            continue
+        try:
+            return download_file_from_minio(object_key, tmp.name)
+        except BaseException as e:
+            # 任何失败（对象不存在、网络错误、取消……）都先删掉临时文件，否则会留在内存盘里
+            with contextlib.suppress(OSError):
+                os.remove(tmp.name)
+            if d is None or not isinstance(e, OSError):
+                raise
+        # 只有写本地文件失败（多半是内存盘满）才换下一个目录
+        logger.warning("临时目录 %s 写入失败，改用系统临时目录", d)
+
+
 def _is_local_path(path: str) -> bool:
     try:
         return os.path.isabs(path) or os.path.exists(path)
@@ -65,7 +104,7 @@ async def analyze_with_streaming_path(
     - 返回 pipeline 的最终结果（dict）
     """
     # 1) start 事件
-    record_step(
+    await arecord_step(
         session_id=session_id,
         node="api",
         step_type="start",
@@ -81,14 +120,11 @@ async def analyze_with_streaming_path(
             local_path = file_path
         else:
             # 当 file_path 是形如 "uploaded/xxx" 或 "trace/xxx" 的对象键时，下载到临时文件
-            tmp = tempfile.NamedTemporaryFile(delete=False)
-            tmp_local = tmp.name
-            tmp.close()
-            download_file_from_minio(file_path, tmp_local)
+            tmp_local = await asyncio.to_thread(_download_to_tmp, file_path)
             local_path = tmp_local
 
         # 2.1 input 事件（让前端能看到当前输入）
-        record_step(
+        await arecord_step(
             session_id=session_id,
             node="api",
             step_type="input",
@@ -102,7 +138,7 @@ async def analyze_with_streaming_path(
 
         # 3) 解析并调用 pipeline
         fn = _resolve_pipeline_callable()
-        record_step(
+        await arecord_step(
             session_id=session_id,
             node="api",
             step_type="call",
@@ -114,7 +150,7 @@ async def analyze_with_streaming_path(
         result = await _maybe_await(fn, file_path=local_path, query=query, session_id=session_id)
 
         # 4) 输出结果事件
-        record_step(
+        await arecord_step(
             session_id=session_id,
             node="api",
             step_type="result",
@@ -126,7 +162,7 @@ async def analyze_with_streaming_path(
     except Exception as e:
         logger.exception("analyze_with_streaming_path 异常：%s", e)
         # 推送异常事件（SSE/trace 前端能立即看到错误）
-        record_step(
+        await arecord_step(
             session_id=session_id,
             node="api",
             step_type="exception",
@@ -144,7 +180,7 @@ async def analyze_with_streaming_path(
             except Exception:
                 pass
 
-        record_step(
+        await arecord_step(
             session_id=session_id,
             node="api",
             step_type="end",
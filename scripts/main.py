@@ -1,14 +1,14 @@
 # scripts/main.py  ── 修改后版本
-import argparse, logging, pathlib, sys, importlib
+import argparse, asyncio, logging, pathlib, sys, importlib, uuid
 
 # ① 把项目根（dynamic_langgraph_project）塞进 sys.path，确保包可见
 ROOT = pathlib.Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT))
 
-# ② 再安全导入
-run_dynamic_pipeline = importlib.import_module(
+# ② 再安全导入（旧的同步入口 run_dynamic_pipeline 已移除，统一走异步 run_pipeline）
+run_pipeline = importlib.import_module(
     "dynamic_langgraph.pipeline"
-).run_dynamic_pipeline
+).run_pipeline
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
@@ -18,9 +18,9 @@ def main():
     parser.add_argument("-q", "--query", required=True, help="User query / requirement")
     args = parser.parse_args()
 
-    result = run_dynamic_pipeline(pathlib.Path(args.txt), args.query)
-    #print("\n LLM 规划任务流:", tasks)
-    print(" 摘要:\n", result["summary"]) # asr_text summary
+    session_id = f"cli-{uuid.uuid4().hex[:12]}"
+    result = asyncio.run(run_pipeline(str(pathlib.Path(args.txt)), args.query, session_id))
+    print(" 结果:\n", result)
 
 if __name__ == "__main__":
     main()
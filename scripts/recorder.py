@@ -1,13 +1,14 @@
 # scripts/recorder.py
 import os
 import time
-import json
+import atexit
+import orjson
 import queue
 import asyncio
-from typing import Dict, Any, List, AsyncGenerator
+import threading
+from typing import Dict, Any, List, AsyncGenerator, BinaryIO
 from threading import Lock
-
-from minio_client import upload_file_to_minio, get_trace_object_key
+from collections import OrderedDict, deque
 
 # ================== 可调参数（也可用环境变量覆盖） ==================
 # 每写入多少条事件再上传一次 MinIO（1 = 每条都传，开发期推荐；线上可调大）
@@ -16,55 +17,201 @@ UPLOAD_EVERY_N = int(os.getenv("TRACE_UPLOAD_EVERY_N", "1"))
 # 每个 session 在内存里最多保留多少条事件（防止长会话内存暴涨）
 MAX_IN_MEMORY_EVENTS = int(os.getenv("TRACE_MAX_IN_MEMORY", "5000"))
 
-# SSE 的空闲等待（秒）
-SSE_IDLE_SLEEP = float(os.getenv("TRACE_SSE_IDLE_SLEEP", "0.2"))
-
 # 发送心跳的间隔（秒）
 HEARTBEAT_SECONDS = float(os.getenv("TRACE_HEARTBEAT_SECONDS", "10"))
 
+# 上传合并窗口（毫秒）：后台上传线程拿到任务后先等这么久，让同一波突发事件并成一次 PUT
+UPLOAD_COALESCE_MS = float(os.getenv("TRACE_UPLOAD_COALESCE_MS", "50"))
+
+# trace 上传的分片大小（字节）：jsonl 不超过它就一次 PUT，超过才按这个粒度 multipart。
+# SDK 默认 5MiB 起分片，大 trace 每次上传都要 初始化 + 多个分片 + 合并 多轮往返
+TRACE_MINIO_PART_SIZE = max(5 << 20, int(os.getenv("TRACE_MINIO_PART_SIZE", str(8 << 20))))
+
+# MinIO 上的 trace 到 COMPOSE_MIN_SOURCE_SIZE（5MiB）以后，每次只上传新增的那段再 compose 拼到末尾，
+# 不再整份重传；"0" 关闭（存储不支持 compose 时），始终整份上传
+TRACE_MINIO_APPEND = os.getenv("TRACE_MINIO_APPEND", "1").strip() in ("1", "true", "TRUE", "True")
+
+# 本地 jsonl 所在目录；指向 tmpfs（如 /dev/shm）时追加和上传前的回读都只走内存，不落盘
+TRACE_TMP_DIR = os.getenv("TRACE_TMP_DIR", "/tmp")
+
+# 同时保持打开的本地 trace 文件句柄上限（超出按打开先后关掉最早的，再写时以追加方式重开）
+MAX_OPEN_TRACE_FILES = int(os.getenv("TRACE_MAX_OPEN_FILES", "256"))
+
 # ===================================================================
 
-event_queues: Dict[str, queue.Queue] = {}
-event_queues_lock = Lock()
+# 事件序列化：orjson 直接产出 UTF-8 bytes（等价于 ensure_ascii=False），无需中间 str；
+# 个别不可序列化的字段（如自定义对象）退化为 str，不让一条事件拖垮整条 trace
+_DUMPS_OPT = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
 
-# 内存事件轨迹；用于快速回放 + 写 jsonl
-event_trace: Dict[str, List[Dict[str, Any]]] = {}
 
-# 累计计数：用来决定什么时候上传 MinIO
-_event_counter: Dict[str, int] = {}
+def _dumps(event: Dict[str, Any]) -> bytes:
+    return orjson.dumps(event, default=str, option=_DUMPS_OPT)
 
-def _ensure_session(session_id: str) -> None:
-    with event_queues_lock:
-        event_queues.setdefault(session_id, queue.Queue())
-        event_trace.setdefault(session_id, [])
-        _event_counter.setdefault(session_id, 0)
+# SSE 帧的固定前后缀（bytes 常量，直接与 orjson 的输出拼接）
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
 
-def _trim_if_needed(session_id: str) -> None:
+class _SessionState:
     """
-    防止事件无限增长导致内存占用过大，只保留最近 MAX_IN_MEMORY_EVENTS 条。
+    单个会话的全部内存状态，放在一个对象里：记一条事件只查一次 _sessions。
+    - queue：SSE 待发事件。定长 deque 充当环形缓冲（append/popleft 本身线程安全，不需要 queue.Queue
+      内部那把锁和条件变量；唤醒由 waiters 负责）。没有 SSE 客户端在读时最多积压 MAX_IN_MEMORY_EVENTS 条，
+      更早的自动丢弃（trace 里仍是全量）
+    - trace：内存事件轨迹，用于快速回放（jsonl 由本地追加文件负责）。定长 deque，超出时自动从头部丢弃
+    - counter：累计计数，用来决定什么时候上传 MinIO
+    - waiters：正在等事件的 SSE 生成器 {(所在事件循环, asyncio.Event)}
+    - dropped：SSE 客户端太慢/不在时，queue 满了被挤掉的事件数（close_session 时打印）
+    - lock：会话自己的锁，保护以上字段和 fh 的写入；不同会话记录事件互不争锁
+    - fh / created：本地 jsonl 句柄（被 LRU 关掉后为 None）；是否已建过文件（首次截断，之后追加）
+    - uploaded：MinIO 上的 trace 已有多少字节（只由上传线程读写），下次只传这之后的部分
     """
-    buf = event_trace.get(session_id)
-    if not buf:
+    __slots__ = ("queue", "trace", "counter", "waiters", "dropped", "lock", "fh", "created", "uploaded")
+
+    def __init__(self) -> None:
+        self.queue: "deque[Dict[str, Any]]" = deque(maxlen=MAX_IN_MEMORY_EVENTS)
+        self.trace: "deque[Dict[str, Any]]" = deque(maxlen=MAX_IN_MEMORY_EVENTS)
+        self.counter = 0
+        self.waiters: set = set()
+        self.dropped = 0
+        self.lock = Lock()
+        self.fh: BinaryIO | None = None
+        self.created = False
+        self.uploaded = 0
+
+# 全局锁只在建/删会话时拿；记录事件走各会话自己的 st.lock
+_sessions: Dict[str, _SessionState] = {}
+event_queues_lock = Lock()
+
+# 本地 jsonl：只追加新事件，不再每次把整条轨迹重写一遍。
+# 持有打开句柄的会话按打开先后排队（受 _trace_fh_lock 保护，只在打开/关闭句柄时拿），超过上限关最早的
+_trace_fh: "OrderedDict[str, _SessionState]" = OrderedDict()
+_trace_fh_lock = Lock()
+
+# MinIO 上传交给单个后台线程：记录事件只负责排队，不再同步等网络。
+# 同一会话在队列里最多一份（_upload_pending 去重，受 _upload_lock 保护）；
+# 单线程也保证同一对象不会并发 PUT，旧内容不会覆盖新内容
+_upload_queue: "queue.Queue[str]" = queue.Queue()
+_upload_pending: set = set()
+_upload_lock = Lock()
+# 上传本身串行（后台线程和退出时的 flush_uploads 不会同时给同一对象追加）
+_upload_run_lock = Lock()
+_upload_thread: threading.Thread | None = None
+
+def _ensure_session(session_id: str) -> _SessionState:
+    st = _sessions.get(session_id)
+    if st is None:
+        with event_queues_lock:
+            st = _sessions.get(session_id)
+            if st is None:
+                st = _sessions[session_id] = _SessionState()
+    return st
+
+def _trace_tmp_path(session_id: str) -> str:
+    return os.path.join(TRACE_TMP_DIR, f"{session_id}.jsonl")
+
+def _trace_handle(session_id: str, st: _SessionState) -> BinaryIO:
+    """取会话的本地 jsonl 句柄（调用方须持有 st.lock）。已打开时不碰任何全局结构。"""
+    fh = st.fh
+    if fh is not None:
+        return fh
+    fh = st.fh = open(_trace_tmp_path(session_id), "ab" if st.created else "wb", buffering=1 << 16)
+    st.created = True
+    evicted = []
+    with _trace_fh_lock:
+        _trace_fh[session_id] = st
+        while len(_trace_fh) > MAX_OPEN_TRACE_FILES:
+            evicted.append(_trace_fh.popitem(last=False))
+    # 关别的会话的句柄要拿它的锁；只试一次不等待（两个会话互相淘汰时不会死锁），拿不到说明它正在写，放回队尾
+    for other_id, other in evicted:
+        if other.lock.acquire(blocking=False):
+            try:
+                if other.fh is not None:
+                    other.fh.close()
+                    other.fh = None
+            finally:
+                other.lock.release()
+        else:
+            with _trace_fh_lock:
+                _trace_fh[other_id] = other
+    return fh
+
+def _schedule_upload(session_id: str) -> None:
+    """登记一次上传；已在排队的会话不重复入队。"""
+    global _upload_thread
+    with _upload_lock:
+        if session_id in _upload_pending:
+            return
+        _upload_pending.add(session_id)
+        _upload_queue.put_nowait(session_id)
+        if _upload_thread is None:
+            _upload_thread = threading.Thread(target=_upload_worker, name="trace-uploader", daemon=True)
+            _upload_thread.start()
+
+def _upload_once(session_id: str) -> None:
+    """flush 本地 jsonl 后上传一次；出队在上传之前，上传期间的新事件会再排一次，不会漏。"""
+    with _upload_lock:
+        _upload_pending.discard(session_id)
+    st = _sessions.get(session_id)
+    try:
+        if st is not None:
+            # 在会话锁内 flush 并量长度：这个长度之内都是完整的行，之后追加的留给下一次
+            with st.lock:
+                if st.fh is not None:
+                    st.fh.flush()
+                size = os.path.getsize(_trace_tmp_path(session_id))
+        else:
+            size = os.path.getsize(_trace_tmp_path(session_id))
+    except OSError as e:
+        print(f"❌ 写入本地 trace 出错: {e}")
         return
-    extra = len(buf) - MAX_IN_MEMORY_EVENTS
-    if extra > 0:
-        # 丢弃最早的 extra 条
-        del buf[0:extra]
+    with _upload_run_lock:
+        try:
+            _upload_trace_to_minio(session_id, st, size)
+        except Exception as e:
+            # 不抛出，避免影响主流程；打印即可。下次退回整份上传，把 MinIO 上的对象重新对齐
+            if st is not None:
+                st.uploaded = 0
+            print(f"❌ 写入 MinIO trace 出错: {e}")
+
+def _upload_worker() -> None:
+    while True:
+        session_id = _upload_queue.get()
+        if UPLOAD_COALESCE_MS > 0:
+            time.sleep(UPLOAD_COALESCE_MS / 1000)
+        _upload_once(session_id)
+
+def flush_uploads() -> None:
+    """把还在排队的 trace 上传在当前线程做完（进程退出前调用，避免丢最后几条事件）。"""
+    while True:
+        try:
+            session_id = _upload_queue.get_nowait()
+        except queue.Empty:
+            return
+        _upload_once(session_id)
+
+atexit.register(flush_uploads)
 
-def _upload_trace_to_minio(session_id: str) -> None:
+def _upload_trace_to_minio(session_id: str, st: _SessionState | None, size: int) -> None:
     """
-    把当前内存的 event_trace 写入临时 jsonl 文件后上传到 MinIO。
+    把本地 jsonl 的前 size 字节（已由 _commit_events 追加并 flush）同步到 MinIO。
+    文件只追加不重写，MinIO 上的 trace 也只会变长，按字节偏移增量轮询的客户端可以一直接着读。
+    已上传部分够 compose 的下限时只传新增的那段（网络开销按增量算，不再随轨迹长度线性增长），
+    否则整份上传；会话已被 close_session 移除时（不知道 MinIO 上有多少）也整份上传。
     """
-    object_key = get_trace_object_key(session_id)  # 标准化：trace/{session_id}.jsonl
-    tmp_path = f"/tmp/{session_id}.jsonl"
-
-    # 写本地 jsonl（全量覆盖；简单稳妥）
-    with open(tmp_path, "w", encoding="utf-8") as f:
-        for e in event_trace.get(session_id, []):
-            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    # 只在上传线程里用到 MinIO：按需导入，导入 recorder 不会连带加载 minio SDK
+    from minio_client import COMPOSE_MIN_SOURCE_SIZE, append_file_to_minio, get_trace_object_key
 
-    # 上传 MinIO（忽略返回 url；api_server /trace/{session_id} 统一给直链）
-    upload_file_to_minio(tmp_path, object_key)
+    offset = st.uploaded if st is not None else 0
+    if offset >= size:
+        return
+    if not TRACE_MINIO_APPEND or offset < COMPOSE_MIN_SOURCE_SIZE:
+        offset = 0
+    object_key = get_trace_object_key(session_id)  # 标准化：trace/{session_id}.jsonl
+    # 上传 MinIO（api_server /trace/{session_id} 统一给直链）
+    append_file_to_minio(_trace_tmp_path(session_id), object_key, offset, size - offset,
+                         part_size=TRACE_MINIO_PART_SIZE)
+    if st is not None:
+        st.uploaded = size
 
 def record_step(
     session_id: str,
@@ -79,15 +226,41 @@ def record_step(
     tool_name: str | None = None,
     type: str = "trace",
     content: Any | None = None,
-) -> None:
+) -> Dict[str, Any]:
     """
     记录单条事件：
     - 推进 SSE 队列
     - 追加到内存 trace
-    - 按策略上传 MinIO 的 jsonl（全量覆盖）
+    - 追加到本地 jsonl，按策略排队上传 MinIO（后台线程合并上传）
+    返回记录下的事件 dict（record_and_stream 直接复用，不再重复构造）。
     """
-    _ensure_session(session_id)
+    event = _build_event(
+        session_id, node, step_type, type,
+        (thought, tool_calls, result, model, usage, tool_name, content),
+    )
+    _commit_events(session_id, [event])
+    return event
+
+def record_steps(session_id: str, node: str, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    批量记录同一节点的多条事件（每项是 record_step 的关键字参数，须含 step_type；可用 node 单独覆盖）：
+    一次加锁入队，MinIO 的 jsonl 最多刷新一次，而不是每条事件各传一遍。
+    """
+    events = []
+    for step in steps:
+        if "node" in step:
+            step = dict(step)
+            events.append(_make_event(session_id, step.pop("node"), **step))
+        else:
+            events.append(_make_event(session_id, node, **step))
+    if events:
+        _commit_events(session_id, events)
+    return events
+
+_OPTIONAL_FIELDS = ("thought", "tool_calls", "result", "model", "usage", "tool_name", "content")
 
+def _build_event(session_id: str, node: str, step_type: str, type: str, values: tuple) -> Dict[str, Any]:
+    """values 与 _OPTIONAL_FIELDS 一一对应；record_step 直接传位置元组，省掉 **kwargs 重新打包成 dict。"""
     event: Dict[str, Any] = {
         "timestamp": time.time(),
         "type": type,
@@ -95,85 +268,129 @@ def record_step(
         "node": node,
         "step_type": step_type,
     }
-    # 可选字段
-    if thought is not None:
-        event["thought"] = thought
-    if tool_calls is not None:
-        event["tool_calls"] = tool_calls
-    if result is not None:
-        event["result"] = result
-    if model is not None:
-        event["model"] = model
-    if usage is not None:
-        event["usage"] = usage
-    if tool_name is not None:
-        event["tool_name"] = tool_name
-    if content is not None:
-        event["content"] = content
-
-    # 入队 + 入内存
-    with event_queues_lock:
-        event_queues[session_id].put(event)
-        event_trace[session_id].append(event)
-        _event_counter[session_id] += 1
+    # 可选字段：值为 None 的不写入
+    for key, value in zip(_OPTIONAL_FIELDS, values):
+        if value is not None:
+            event[key] = value
+    return event
+
+def _make_event(
+    session_id: str,
+    node: str,
+    step_type: str,
+    *,
+    type: str = "trace",
+    **fields: Any,
+) -> Dict[str, Any]:
+    """关键字参数版（record_steps 的每项 step 字典走这里）。"""
+    get = fields.get
+    return _build_event(session_id, node, step_type, type, tuple(get(k) for k in _OPTIONAL_FIELDS))
 
-        # 控制内存
-        _trim_if_needed(session_id)
+def _commit_events(session_id: str, events: List[Dict[str, Any]]) -> None:
+    """入队 + 入内存 + 追加本地 jsonl + 按策略登记 MinIO 上传。"""
+    st = _ensure_session(session_id)
+    # 序列化放在锁外：锁内只剩入队、追加和一次缓冲写
+    lines = b"".join([_dumps(e) + b"\n" for e in events])
 
-    # 刷新 MinIO（按批次）
-    try:
-        if _event_counter[session_id] >= UPLOAD_EVERY_N:
-            _upload_trace_to_minio(session_id)
-            _event_counter[session_id] = 0
-    except Exception as e:
-        # 不抛出，避免影响主流程；打印即可
-        print(f"❌ 写入 MinIO trace 出错: {e}")
+    with st.lock:
+        overflow = len(st.queue) + len(events) - MAX_IN_MEMORY_EVENTS
+        if overflow > 0:  # 定长 deque 会从头部挤掉这么多条
+            st.dropped += overflow
+        st.queue.extend(events)
+        st.trace.extend(events)  # 定长 deque，自动控制内存
+        st.counter += len(events)
+        waiters = tuple(st.waiters)
 
-async def stream_event_generator(session_id: str) -> AsyncGenerator[str, None]:
+        # 本地 jsonl 只追加这几条（flush 由上传线程在 PUT 前统一做）；写入仍在锁内，保证行序与入队顺序一致
+        try:
+            _trace_handle(session_id, st).write(lines)
+        except OSError as e:
+            print(f"❌ 写入本地 trace 出错: {e}")
+        else:
+            # 刷新 MinIO（按批次）：只排队，由后台线程合并上传
+            if st.counter >= UPLOAD_EVERY_N:
+                st.counter = 0
+                _schedule_upload(session_id)
+
+    # 唤醒该会话的 SSE 生成器（可能在别的线程的事件循环上）；跨线程唤醒要写管道，放锁外
+    for loop, wake in waiters:
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:  # 事件循环已关闭
+            pass
+
+async def stream_event_generator(session_id: str) -> AsyncGenerator[bytes, None]:
     """
     SSE 事件生成器：
       - 从 session 对应的队列中取出事件
       - 每条以 Server-Sent Events 的格式发送：`data: {...}\n\n`
       - 定期发送注释心跳，防止代理或浏览器断开
+    没有事件时挂在 asyncio.Event 上等（_commit_events 入队后跨线程唤醒），不再按固定间隔轮询：
+    空闲会话不占 CPU，新事件也不必等下一个轮询点。
     """
-    _ensure_session(session_id)
-    last_heartbeat = time.time()
+    st = _ensure_session(session_id)
+    q = st.queue
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    wake = waiter[1]
+    with st.lock:
+        st.waiters.add(waiter)
+    last_heartbeat = time.monotonic()
 
-    while True:
-        try:
-            with event_queues_lock:
-                q = event_queues.get(session_id)
+    try:
+        while True:
+            # 先 clear 再取队列：取空之后才入队的事件一定会再次 set，不会漏唤醒
+            wake.clear()
+            if q:
+                # 一次唤醒取到的事件拼成一块发出：每条只序列化一次，整批只 join 一次、只过一次 ASGI send
+                frames: List[bytes] = []
+                while True:
+                    try:
+                        event = q.popleft()
+                    except IndexError:
+                        break
+                    frames += (_SSE_PREFIX, _dumps(event), _SSE_SUFFIX)
+                if frames:
+                    yield b"".join(frames)
 
-            # 理论上不会为 None，因为 _ensure_session 已经创建
-            if q is None:
-                await asyncio.sleep(SSE_IDLE_SLEEP)
+            # 定时心跳（SSE 注释行）
+            now = time.monotonic()
+            remaining = HEARTBEAT_SECONDS - (now - last_heartbeat)
+            if remaining <= 0:
+                # 注释不会被前端 onmessage 接收，但能保持连接活跃（墙钟时间只在真正发心跳时取）
+                yield b": keep-alive %d\n\n" % int(time.time())
+                last_heartbeat = now
                 continue
-
             try:
-                event = q.get_nowait()
-                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-            except queue.Empty:
-                await asyncio.sleep(SSE_IDLE_SLEEP)
+                await asyncio.wait_for(wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
-            # 定时心跳（SSE 注释行）
-            if time.time() - last_heartbeat > HEARTBEAT_SECONDS:
-                # 注释不会被前端 onmessage 接收，但能保持连接活跃
-                yield f": keep-alive {int(time.time())}\n\n"
-                last_heartbeat = time.time()
-
-        except asyncio.CancelledError:
-            # 客户端断开
-            break
-        except Exception as e:
-            print(f"❌ SSE 错误: {e}")
-            break
+    except asyncio.CancelledError:
+        # 客户端断开
+        pass
+    except Exception as e:
+        print(f"❌ SSE 错误: {e}")
+    finally:
+        with st.lock:
+            st.waiters.discard(waiter)
 
 def get_trace(session_id: str) -> List[Dict[str, Any]]:
     """
     仅供调试或本地快速回看；生产环境建议通过 MinIO 上的 jsonl。
     """
-    _ensure_session(session_id)
-    return event_trace.get(session_id, [])
+    st = _ensure_session(session_id)
+    with st.lock:
+        return list(st.trace)
+
+# record_step 现在只做入队/追加这类内存操作（jsonl 是缓冲写，MinIO 上传在后台线程），
+# 异步版直接在事件循环里调用：省掉每条事件一次线程池切换（提交、唤醒工作线程、回调回到循环）
+async def arecord_step(**kwargs) -> Dict[str, Any]:
+    """record_step 的异步版（不阻塞事件循环，保留 await 接口供节点/管道调用）。"""
+    return record_step(**kwargs)
+
+async def arecord_steps(session_id: str, node: str, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """record_steps 的异步版。"""
+    return record_steps(session_id, node, steps)
 
 async def record_and_stream(
     session_id: str,
@@ -183,36 +400,47 @@ async def record_and_stream(
 ) -> AsyncGenerator[dict, None]:
     """
     节点/管道中常用的便捷函数：
-      - 先用线程安全方式记录事件（包含 MinIO 刷新与 SSE 入队）
-      - 再把事件结构 yield 一份给调用者（方便本地日志）
+      - 先记录事件（SSE 入队 + 本地 jsonl 追加；MinIO 上传由后台线程排队完成）
+      - 再把同一个事件 dict yield 给调用者（方便本地日志）
     """
-    await asyncio.to_thread(
-        record_step,
+    event = await arecord_step(
         session_id=session_id,
         node=node,
         step_type=step_type,
         **kwargs
     )
-
-    event = {
-        "timestamp": time.time(),
-        "type": kwargs.get("type", "trace"),
-        "session_id": session_id,
-        "node": node,
-        "step_type": step_type,
-    }
-    for key in ("thought", "tool_calls", "result", "model", "usage", "tool_name", "content"):
-        if key in kwargs:
-            event[key] = kwargs[key]
-
     yield event
 
+async def record_and_stream_batch(
+    session_id: str,
+    node: str,
+    steps: List[Dict[str, Any]],
+) -> AsyncGenerator[dict, None]:
+    """
+    record_and_stream 的批量版：一个阶段内的多条事件一次性记录（一次加锁、最多登记一次 MinIO 上传），
+    再按原顺序逐条 yield 给调用者。
+    批量 yield 之间让出一次事件循环（sleep(0)），一大串事件不会独占循环、拖慢其他会话的 SSE 推送。
+    """
+    events = await arecord_steps(session_id, node, steps)
+    for i, event in enumerate(events):
+        if i:
+            await asyncio.sleep(0)
+        yield event
+
 def close_session(session_id: str) -> None:
     """
     可选：结束后清理内存里的队列与轨迹（如果你的会话是一次性的，建议调用）。
     注意：不会删除 MinIO 上的 jsonl。
     """
     with event_queues_lock:
-        event_queues.pop(session_id, None)
-        event_trace.pop(session_id, None)
-        _event_counter.pop(session_id, None)
+        st = _sessions.pop(session_id, None)
+    if st is None:
+        return
+    with _trace_fh_lock:
+        _trace_fh.pop(session_id, None)
+    with st.lock:
+        if st.fh is not None:
+            st.fh.close()
+            st.fh = None
+    if st.dropped:
+        print(f"⚠️ 会话 {session_id} 的 SSE 队列积压溢出，丢弃了 {st.dropped} 条事件（trace 中仍完整）")
@@ -0,0 +1,36 @@
+# scripts/render_mermaid.py
+"""
+把 DLG_GRAPH_CACHE_DIR（默认 graphs/）下的 flow_<hash>.mmd 批量渲染为同名 PNG。
+文件名即源码哈希，已存在 PNG 的直接跳过，相同流程只渲染一次。
+"""
+import argparse, logging, os, pathlib, sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-render cached Mermaid flowcharts to PNG.")
+    parser.add_argument("dir", nargs="?", default=os.getenv("DLG_GRAPH_CACHE_DIR") or str(ROOT / "graphs"),
+                        help="Directory containing flow_*.mmd files")
+    parser.add_argument("-f", "--force", action="store_true", help="Re-render even if the PNG exists")
+    args = parser.parse_args()
+
+    from langchain_core.runnables.graph_mermaid import draw_mermaid_png
+
+    rendered = skipped = 0
+    for mmd in sorted(pathlib.Path(args.dir).glob("flow_*.mmd")):
+        png = mmd.with_suffix(".png")
+        if png.exists() and not args.force:
+            skipped += 1
+            continue
+        try:
+            png.write_bytes(draw_mermaid_png(mmd.read_text(encoding="utf-8")))
+            rendered += 1
+        except Exception as e:
+            logging.warning("渲染失败 %s: %s", mmd.name, e)
+    logging.info("rendered=%d skipped=%d", rendered, skipped)
+
+if __name__ == "__main__":
+    main()
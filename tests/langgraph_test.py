@@ -11,19 +11,11 @@ async def async_llm(prompt: str):
         await asyncio.sleep(0.1)
         yield tok
 
-def streaming_node(state: State):
-    """同步生成器节点"""
+async def streaming_node(state: State):
+    """异步节点：直接 async for 收集 token，不再在节点里另起/嵌套事件循环"""
     prompt = state["messages"][-1]
-    loop = asyncio.get_event_loop()
-
-    async_gen = async_llm(prompt)           # 拿到异步生成器
-    gen = loop.run_until_complete(
-        loop.create_task(async_gen.__aiter__().__anext__())
-    )  # 简单示例，实际请用 async for + queue
-
-    # 下面仅做演示：一次性返回，避免阻塞
-    # 真实场景请用同步队列或把异步逻辑拆出去
-    yield {"messages": ["Hello world!"]}
+    chunks = [tok async for tok in async_llm(prompt)]
+    return {"messages": ["".join(chunks)]}
 
 # 建图
 builder = StateGraph(State)
@@ -32,5 +24,9 @@ builder.set_entry_point("stream")
 graph = builder.compile()
 
 # 运行
-for chunk in graph.stream({"messages": ["hi"]}, stream_mode="updates"):
-    print(chunk)
\ No newline at end of file
+async def main():
+    async for chunk in graph.astream({"messages": ["hi"]}, stream_mode="updates"):
+        print(chunk)
+
+if __name__ == "__main__":
+    asyncio.run(main())